@@ -0,0 +1,273 @@
+"""
+Benchmark for image-size-conversion.py
+
+Generates synthetic masters (no artwork needed, runs offline), then times every phase of the
+resizer separately with the settings in image-size-conversion.py and resize_profiles.toml:
+decode, the LANCZOS resize of each size, the PNG size estimate, each PNG save at every level in
+PNG_COMPRESS_LEVELS and the size check. Optionally runs the whole resizer end to end with a few
+worker counts. Results go to JSON and CSV, and --compare checks them against an earlier run.
+
+    python3 image-size-benchmark.py --scale 0.25 --out before.json
+    (upgrade Pillow, change a compress level, ...)
+    python3 image-size-benchmark.py --scale 0.25 --out after.json --compare before.json --threshold 10
+"""
+import argparse
+import csv
+import importlib.util
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+import PIL
+from PIL import Image, ImageDraw
+from png_size_estimate import pick_compress_level
+
+BENCHMARK_FOLDER = None # where synthetic masters and outputs are written, None uses a temp folder that is removed afterwards
+REPEATS = 3 # every phase is timed this many times and the median is reported
+SCALE = 1.0 # multiply every profile size by this, 1.0 benchmarks the real sizes (needs a few GB of RAM), 0.1-0.25 for quick runs
+THRESHOLD_PERCENT = 10 # --compare flags phases that got slower than this
+MIN_COMPARE_SECONDS = 0.01 # phases faster than this in the baseline are too noisy to compare
+CONTENTS = ("artwork", "noise") # artwork: smooth gradients and shapes that compress like real designs, noise: worst case for PNG
+
+RESIZER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "image-size-conversion.py")
+
+def load_resizer():
+    """Import image-size-conversion.py (its name isn't a valid module name) to benchmark it with its own settings."""
+    spec = importlib.util.spec_from_file_location("image_size_conversion", RESIZER)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module  # the pool pickles process_job_in_worker by module name
+    spec.loader.exec_module(module)
+    return module
+
+def worker_context():
+    """
+    A fork context for the resizer's process pool, None where the OS has no fork (Windows). Spawned workers
+    would import image-size-conversion.py by a name they can't find, and without the WATCH_FOLDER and
+    OUTPUT_FOLDER set on it here, forked ones inherit the module as it is.
+    """
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return None
+
+def scaled_targets(targets, scale):
+    """Targets with width and height multiplied by scale, nothing smaller than 16px."""
+    return [
+        (max(16, round(width * scale)), max(16, round(height * scale))) + tuple(rest)
+        for width, height, *rest in targets
+    ]
+
+def synthetic_master(size, content):
+    """A master of the given size, made at 1/8 scale and enlarged so generating it stays cheap."""
+    width, height = size
+    if content == "noise":
+        return Image.merge("RGB", [Image.effect_noise(size, sigma) for sigma in (40, 60, 80)])
+    small = (max(1, width // 8), max(1, height // 8))
+    gradient = Image.linear_gradient("L")
+    channels = [
+        gradient.resize(small),
+        gradient.rotate(90).resize(small),
+        Image.radial_gradient("L").resize(small),
+    ]
+    img = Image.merge("RGB", channels)
+    draw = ImageDraw.Draw(img)
+    for i in range(24):
+        x = (i * 7919) % small[0]
+        y = (i * 104729) % small[1]
+        radius = max(2, min(small) // (4 + i % 6))
+        draw.ellipse((x - radius, y - radius, x + radius, y + radius), fill=((i * 37) % 256, (i * 91) % 256, (i * 53) % 256))
+    img = img.resize(size, Image.BICUBIC)
+    grain = Image.effect_noise(size, 8).convert("RGB")
+    return Image.blend(img, grain, 0.08)
+
+def timed(fn, repeats):
+    """Run fn repeats times, return (seconds of each run, last return value)."""
+    runs, value = [], None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        value = fn()
+        runs.append(time.perf_counter() - start)
+    return runs, value
+
+def timing(phase, runs, target=None, level=None, bytes_=None, content=None):
+    return {
+        "phase": phase,
+        "content": content,
+        "target": f"{target[0]}x{target[1]}_{target[2]}dpi" if target else None,
+        "level": level,
+        "median_s": statistics.median(runs),
+        "min_s": min(runs),
+        "max_s": max(runs),
+        "bytes": bytes_,
+        "runs": runs,
+    }
+
+def benchmark_phases(resizer, master_path, targets, folder, content, repeats):
+    """Time decode, then resize, estimate, save and size check for every target, one at a time."""
+    timings = []
+
+    def decode():
+        with Image.open(master_path) as img:
+            img.load()
+            return img.copy()
+    runs, master = timed(decode, repeats)
+    timings.append(timing("decode", runs, bytes_=os.path.getsize(master_path), content=content))
+    print(f"⏱️ [{content}] decode {master.width}x{master.height}: {statistics.median(runs):.3f}s")
+
+    for target in targets:
+        width, height, dpi, _, max_size_mb, _ = target
+        runs, resized = timed(lambda: master.resize((width, height), Image.LANCZOS), repeats)
+        timings.append(timing("resize", runs, target, content=content))
+        resize_seconds = statistics.median(runs)
+        resized.info["dpi"] = (dpi, dpi)
+
+        max_bytes = max_size_mb * 1024 * 1024
+        runs, _ = timed(lambda: pick_compress_level(resized, max_bytes, resizer.PNG_COMPRESS_LEVELS), repeats)
+        timings.append(timing("estimate", runs, target, content=content))
+
+        out_path = os.path.join(folder, f"bench_{width}x{height}_{dpi}dpi.png")
+        saves = []
+        for level in resizer.PNG_COMPRESS_LEVELS:
+            runs, _ = timed(lambda: resized.save(out_path, format="PNG", compress_level=level), repeats)
+            written = os.path.getsize(out_path)
+            timings.append(timing("save", runs, target, level, written, content))
+            saves.append(f"L{level} {statistics.median(runs):.3f}s {written / (1024 * 1024):.1f}MB")
+            runs, _ = timed(lambda: resizer.is_file_too_large(out_path, max_size_mb), repeats)
+            timings.append(timing("size_check", runs, target, level, content=content))
+            os.remove(out_path)
+        print(f"⏱️ [{content}] {width}x{height}: resize {resize_seconds:.3f}s, save {', '.join(saves)}")
+        resized.close()
+    master.close()
+    return timings
+
+def benchmark_end_to_end(resizer, watch_folder, targets, folder, worker_counts, content):
+    """Run the resizer over the synthetic masters with each worker count, cache off, outputs thrown away."""
+    timings = []
+    resizer.WATCH_FOLDER = watch_folder
+    filenames = resizer.list_source_files(watch_folder, ["*.tif"])
+    context = worker_context()
+    for workers in worker_counts:
+        if workers > 1 and context is None:
+            print(f"⚠️ [{content}] skipping the run with {workers} workers, it needs processes started with fork, which this OS doesn't have")
+            continue
+        resizer.OUTPUT_FOLDER = os.path.join(folder, f"out_{workers}")
+        resizer.make_group_folders(targets)
+        args = SimpleNamespace(workers=workers, max_memory_mb=resizer.MAX_MEMORY_MB)
+        jobs = resizer.build_jobs([(filename, targets) for filename in filenames])
+        with open(os.devnull, "w") as skipped_log:
+            start = time.perf_counter()
+            results = resizer.run_jobs(jobs, args, skipped_log, mp_context=context)
+            elapsed = time.perf_counter() - start
+        shutil.rmtree(resizer.OUTPUT_FOLDER)
+        row = timing("end_to_end", [elapsed], content=content)
+        row["workers"] = workers
+        row["images"] = len(results)
+        timings.append(row)
+        print(f"⏱️ [{content}] end to end with {workers} worker(s): {elapsed:.2f}s, {len(results) / elapsed * 60:.1f} images/minute")
+    return timings
+
+def timing_key(row):
+    return (row["phase"], row["content"], row["target"], row["level"], row.get("workers"))
+
+def compare(timings, baseline_path, threshold_percent):
+    """Print phases that got slower or faster than threshold_percent against a baseline JSON, return the regressions."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {timing_key(row): row for row in json.load(f)["timings"]}
+    regressions = []
+    print(f"📈 Against {baseline_path} (threshold {threshold_percent}%):")
+    for row in timings:
+        old = baseline.get(timing_key(row))
+        if old is None or old["median_s"] < MIN_COMPARE_SECONDS:
+            continue
+        change = (row["median_s"] / old["median_s"] - 1) * 100
+        if abs(change) < threshold_percent:
+            continue
+        label = " ".join(str(part) for part in timing_key(row) if part is not None)
+        print(f"  {'🔴' if change > 0 else '🟢'} {label}: {old['median_s']:.3f}s → {row['median_s']:.3f}s ({change:+.1f}%)")
+        if change > 0:
+            regressions.append({"key": label, "baseline_s": old["median_s"], "median_s": row["median_s"], "change_percent": change})
+    if not regressions:
+        print("  ✅ no regressions")
+    return regressions
+
+def write_csv(path, timings):
+    fields = ["phase", "content", "target", "level", "workers", "median_s", "min_s", "max_s", "bytes", "images"]
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(timings)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the decode, resize, estimate, save and size check phases of image-size-conversion.py.")
+    parser.add_argument("--scale", type=float, default=SCALE, help="multiply every profile size (and the master) by this")
+    parser.add_argument("--repeats", type=int, default=REPEATS, help="times each phase is run, the median is reported")
+    parser.add_argument("--content", choices=CONTENTS, action="append", help="synthetic master content, can be repeated (default: artwork)")
+    parser.add_argument("--groups", default="", help="comma separated profile groups to benchmark (default: all)")
+    parser.add_argument("--workers", default="", help="comma separated worker counts to also time a full run with, e.g. 1,2,4")
+    parser.add_argument("--folder", default=BENCHMARK_FOLDER, help="work folder, kept afterwards (default: a temp folder)")
+    parser.add_argument("--out", default="benchmark.json", help="JSON results, a CSV with the same name is written next to it")
+    parser.add_argument("--compare", help="earlier JSON results to compare against, exits with 1 on regressions")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD_PERCENT, help="percent slower than the baseline that counts as a regression")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    resizer = load_resizer()
+    profile_args = SimpleNamespace(profiles=resizer.RESIZE_PROFILES, groups=resizer.group_list(args.groups))
+    targets = scaled_targets(resizer.resize_targets(profile_args), args.scale)
+    # Masters should be bigger than every size they are resized to
+    master_size = (max(t[0] for t in targets), max(t[1] for t in targets))
+    contents = args.content or ["artwork"]
+
+    folder = args.folder or tempfile.mkdtemp(prefix="resize-bench-")
+    os.makedirs(folder, exist_ok=True)
+    timings = []
+    try:
+        for content in contents:
+            watch_folder = os.path.join(folder, f"masters_{content}")
+            os.makedirs(watch_folder, exist_ok=True)
+            master_path = os.path.join(watch_folder, "master.tif")
+            print(f"🎨 Generating a {master_size[0]}x{master_size[1]} {content} master")
+            synthetic_master(master_size, content).save(master_path)
+            timings.extend(benchmark_phases(resizer, master_path, targets, folder, content, args.repeats))
+            if args.workers:
+                worker_counts = [int(count) for count in args.workers.split(",")]
+                timings.extend(benchmark_end_to_end(resizer, watch_folder, targets, folder, worker_counts, content))
+    finally:
+        if not args.folder:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    results = {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "pillow": PIL.__version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "settings": {
+            "scale": args.scale,
+            "repeats": args.repeats,
+            "master_size": master_size,
+            "compress_levels": resizer.PNG_COMPRESS_LEVELS,
+            "targets": [list(t[:3]) for t in targets],
+        },
+        "timings": timings,
+    }
+    if args.compare:
+        results["regressions"] = compare(timings, args.compare, args.threshold)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=1)
+    csv_path = os.path.splitext(args.out)[0] + ".csv"
+    write_csv(csv_path, timings)
+    print(f"✅ Results written to {args.out} and {csv_path}")
+    if results.get("regressions"):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
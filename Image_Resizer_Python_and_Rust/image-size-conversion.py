@@ -1,63 +1,810 @@
+import argparse
+import fnmatch
 import os
+import shutil
+import time
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 from PIL import Image
+from output_formats import FORMAT_EXTENSIONS, encode_frame, normalize_formats
+from png_size_estimate import pick_compress_level, raw_png_size
+from render_cache import RenderCache, evict, pixel_hash, render_key
+from resize_run_log import PhaseTimer, RunLog, add_phases
+from resize_profiles import load_profiles, merge_profiles, profile_groups, select_groups
+from resize_pyramid import PYRAMID_HEADROOM, pyramid_branches, quality_report, render_pyramid
+from resize_watch import POLL_SECONDS, Debouncer, StateIndex, make_watcher, settings_hash
+from streaming_resize import BAND_ROWS, OUTPUT_BAND_COPIES, BandReader, png_mode, source_rows_for, stream_resize_to_png
 
 WATCH_FOLDER = "/home/invent/watch/"
 OUTPUT_FOLDER = "/home/invent/file-outputs/"
 SKIPPED_LOG = os.path.join(OUTPUT_FOLDER, "skipped_files.txt")
-MAX_SIZE_MB = 100
-#Towels, Polycotton Face and Hand Towels are duped in bathroom stuff script or kitchen stuff script, but file names are identical on W H DPI
+RUN_LOG = os.path.join(OUTPUT_FOLDER, "resize_run.jsonl") # one JSON line per output with phase timings, bytes, compress level, peak memory and skip reason, appended to on every run, override with --run-log, turn off with --no-run-log
+SLOWEST_TARGETS = 10 # rows in the slowest outputs table printed at the end of a run
+STATE_INDEX = os.path.join(OUTPUT_FOLDER, "resize_state.json") # watch mode remembers finished (master, target row) renders here so a restart picks up where it left off
+MAX_SIZE_MB = 100 # default for profiles that don't set their own max_size_mb
+RESIZE_PROFILES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resize_profiles.toml") # product sizes and their groups, see the top of that file, override with --profiles
+PROFILE_GROUPS = [] # groups to render, empty renders every group in the catalog, override with --groups bathroom,kitchen
+INPUT_GLOBS = ["*.tif"] # masters to pick up from the watch folder, e.g. ["*.tif", "*.png", "*.jpg", "*.webp"], no vector files such as svg's, just 2D images only, override with --input-glob
+OUTPUT_FORMATS = {"png": {}} # formats (and Pillow encoder options) for profiles that don't list their own, e.g. {"png": {}, "webp": {"quality": 90}, "jpeg": {"quality": 95}, "tiff": {"compression": "tiff_lzw"}}
+PNG_COMPRESS_LEVELS = (0, 2) # tried cheapest first, the size of each is estimated before saving so only the level that fits gets written, add higher levels (up to 9) to trade CPU for fewer skipped sizes
+WORKERS = 1 # number of processes for (source file, target size) jobs, override with --workers N
+MAX_MEMORY_MB = 16384 # ceiling for decoded masters + resized frames held by in-flight jobs, and masters workers keep for their next job, when running with --workers, override with --max-memory-mb
+USE_PYRAMID = False # resample smaller targets from shared box-reduced intermediates instead of the full-res master, see resize_pyramid.py, turn on with --pyramid
+USE_RENDER_CACHE = True # serve renders that were already made from the same pixels and settings from RENDER_CACHE instead of resampling again, turn off with --no-cache
+RENDER_CACHE = os.path.join(OUTPUT_FOLDER, ".render_cache") # keep it on the same filesystem as OUTPUT_FOLDER so hits are hard links instead of copies
+RENDER_CACHE_MB = 20480 # least recently used renders are evicted past this, hard links shared with outputs you still have only count once on disk, override with --cache-mb
+USE_STREAMING = False # read masters and write PNGs band by band so memory scales with one band instead of whole images, see streaming_resize.py, turn on with --streaming
 #Pillow>10.0.0 is the only python package needed for this script to work
 #In order for the resizing to product good images for you, I recommend you start with a larger image file than your largest image required at 600 DPI, scaling does not become pixelated
-RESIZE_SETTINGS = [
-    (4725, 9225, 150), #Polycotton Towel Small 30x60
-    (5625, 11025, 150), #Polycotton Towel Large 36x72
-    (7238, 3638, 150), #Youth Hooded Towel
-    (18900, 9900, 300), #Beach Towel Horizontal Template 60x30, but printify calls it 30x60
-    (3630, 5730, 300), #Rally Towel 11x18
-    (4800, 9300, 150), #Mink Cotton Towel 30x60
-    (3600, 4800, 150), #Tea Towel 28x28
-    (4500, 4500, 300), #Face Towel 13x13
-    (5693, 9154, 300), #Hand Towel 16x28
-    (5374, 8102, 300), #Beach Towel 18x27
-    (7163, 13205, 300), #Beach Towel 24x44
-    (9579, 18390, 300), #Beach Towel Vertical Template 30x60
-    (3000, 4800, 150), #Tea Towels Cotton Poly 18x30
-    (5043, 7350, 300), #Golf Towel 16x24
-    (6000, 12450, 150) #Boho Beach Cloth
-]
-
-os.makedirs(OUTPUT_FOLDER, exist_ok=True)
-
-def is_file_too_large(path):
+
+# Each worker process keeps the last master it decoded, so consecutive jobs for the same file don't decode it again
+_open_source = {"path": None, "img": None}
+
+def is_file_too_large(path, max_size_mb=MAX_SIZE_MB):
     size_mb = os.path.getsize(path) / (1024 * 1024)
-    return size_mb > MAX_SIZE_MB
+    return size_mb > max_size_mb
+
+def selected_profiles(args):
+    """Profiles of the catalog in args.profiles, narrowed down to args.groups."""
+    return select_groups(load_profiles(args.profiles), args.groups)
+
+def resize_targets(args):
+    """
+    The selected profiles as (width, height, dpi, formats, max_size_mb, groups) targets, one per distinct
+    width/height/dpi, see resize_profiles.merge_profiles. The catalog is read again on every call, so
+    watch mode picks up edits.
+    """
+    return merge_profiles(selected_profiles(args), normalize_formats(OUTPUT_FORMATS), MAX_SIZE_MB)
+
+def is_source_file(filename, patterns=None):
+    name = filename.lower()
+    return any(fnmatch.fnmatch(name, pattern.lower()) for pattern in (patterns or INPUT_GLOBS))
+
+def list_source_files(folder, patterns=None):
+    """Return the masters in the watch folder, in os.listdir order."""
+    return [filename for filename in os.listdir(folder) if is_source_file(filename, patterns)]
+
+def release_source():
+    """Close the master this process kept from its last job."""
+    if _open_source["img"] is not None:
+        _open_source["img"].close()
+    _open_source["path"], _open_source["img"] = None, None
+
+def held_source_bytes():
+    """Rough bytes of the decoded master this process keeps between jobs, 0 when it keeps none."""
+    img = _open_source["img"]
+    return img.width * img.height * len(img.getbands()) if img is not None else 0
+
+def load_source(input_path):
+    """Open and decode a master once per process, reusing it for the following jobs on the same file."""
+    if _open_source["path"] != input_path:
+        release_source()
+        img = Image.open(input_path)
+        img.load()
+        _open_source["path"], _open_source["img"] = input_path, img
+    return _open_source["img"]
+
+def peak_rss_mb(who="self"):
+    """Peak resident memory of this process (or its finished children) in MB, None where the OS doesn't report it."""
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who == "self" else resource.RUSAGE_CHILDREN)
+    return usage.ru_maxrss / (1024 * 1024 if os.uname().sysname == "Darwin" else 1024)
+
+def legacy_write_cost(raw, estimates, written_sizes, max_bytes):
+    """Writes and bytes the old save-at-0, check, re-save-at-2, check, delete sequence would have spent on this target."""
+    if raw <= max_bytes:
+        return 1, raw
+    retry_bytes = written_sizes.get(2)  # the old re-save always used compress_level=2
+    if retry_bytes is None:
+        low, high = estimates.get(2, (raw, raw))
+        retry_bytes = (low + high) // 2
+    return 2, raw + retry_bytes
+
+def output_name(base_name, width, height, dpi, fmt):
+    return f"{base_name}_{width}x{height}_{dpi}dpi{FORMAT_EXTENSIONS[fmt]}"
+
+def remove_output(out_path):
+    """Remove a previous output before writing a new one, it may be a hard link to a render cache entry."""
+    if os.path.lexists(out_path):
+        os.remove(out_path)
+
+def link_into_groups(out_path, out_name, groups):
+    """
+    Give every other group of a shared size the file written to the first group's folder, as a hard
+    link where the filesystem allows it, else a copy. Returns the paths created.
+    """
+    linked = []
+    for group in groups[1:]:
+        link_path = os.path.join(OUTPUT_FOLDER, group, out_name)
+        if os.path.lexists(link_path):
+            os.remove(link_path)
+        try:
+            os.link(out_path, link_path)
+        except OSError:
+            shutil.copy2(out_path, link_path)
+        linked.append(link_path)
+    return linked
+
+def job_result(target, fmt, out_name, out_path, phases, linked_paths=(), skip_reason=None, compress_level=None,
+               writes=0, bytes_written=0, legacy_writes=0, legacy_bytes=0, cache=None):
+    """One (target, format) entry of a job's results, skipped when there is a skip_reason."""
+    width, height = target[:2]
+    return {
+        "target": target,
+        "format": fmt,
+        "out_name": out_name,
+        "out_path": out_path,
+        "linked_paths": list(linked_paths),
+        "skipped": skip_reason is not None,
+        "pixels": width * height,
+        "skip_reason": skip_reason,
+        "compress_level": compress_level,
+        "writes": writes,
+        "bytes_written": bytes_written,
+        "legacy_writes": legacy_writes,
+        "legacy_bytes": legacy_bytes,
+        "cache": cache,
+        "phases": phases,
+    }
+
+def save_png(resized, out_path, options, max_size_mb):
+    """
+    Save a resized frame as PNG at the cheapest compress level estimated to stay under max_size_mb.
+    Frames that can't fit at any level are skipped before anything is written; the saved file is still
+    checked and the next level tried when the estimate was off. Returns the job_result() fields of the save.
+    """
+    options = dict(options)
+    levels = (options.pop("compress_level"),) if "compress_level" in options else PNG_COMPRESS_LEVELS
+    timer = PhaseTimer()
+    with timer.phase("estimate"):
+        level, estimates = pick_compress_level(resized, max_size_mb * 1024 * 1024, levels)
+    written_sizes = {}
+    skip_reason = "estimated too large at every compress level, nothing written" if level is None else None
+    if level is not None:
+        for level in levels[levels.index(level):]:
+            with timer.phase("save"):
+                resized.save(out_path, format="PNG", compress_level=level, **options)
+            written_sizes[level] = os.path.getsize(out_path)
+            # Check file size
+            if not is_file_too_large(out_path, max_size_mb):
+                break
+        else:
+            os.remove(out_path)
+            skip_reason = "file still too large after compression"
+
+    raw = raw_png_size(resized.width, resized.height, resized.mode)
+    legacy_writes, legacy_bytes = legacy_write_cost(raw, estimates, written_sizes, max_size_mb * 1024 * 1024)
+    return {
+        "skip_reason": skip_reason,
+        "compress_level": None if skip_reason else level,
+        "writes": len(written_sizes),
+        "bytes_written": sum(written_sizes.values()),
+        "legacy_writes": legacy_writes,
+        "legacy_bytes": legacy_bytes,
+        "phases": timer.seconds,
+    }
 
-with open(SKIPPED_LOG, "w") as skipped_log:
-    for filename in os.listdir(WATCH_FOLDER):
-        if filename.lower().endswith(".tif"): #this can be substituted with .webp, .jpg, .png, no vector files such as svg's, just 2D images only.
-            input_path = os.path.join(WATCH_FOLDER, filename)
-            base_name = os.path.splitext(filename)[0]
+def save_encoded(resized, fmt, options, dpi, out_path, max_size_mb):
+    """
+    Encode a resized frame to a non-PNG format in memory and only write it when it fits max_size_mb.
+    Returns the job_result() fields of the save, like save_png.
+    """
+    timer = PhaseTimer()
+    try:
+        with timer.phase("encode"):
+            data = encode_frame(resized, fmt, options, dpi)
+    except (OSError, ValueError) as e:
+        return {"skip_reason": f"{fmt} encoder failed: {e}", "phases": timer.seconds}
+    if len(data) > max_size_mb * 1024 * 1024:
+        return {"skip_reason": f"encoded {fmt} too large, nothing written", "phases": timer.seconds}
+    with timer.phase("write"):
+        with open(out_path, "wb") as f:
+            f.write(data)
+    return {"writes": 1, "bytes_written": len(data), "legacy_writes": 1, "legacy_bytes": len(data), "phases": timer.seconds}
 
+def save_target(resized, base_name, target, phases=None):
+    """
+    Encode one resized frame to every format its target asks for, in the first group's folder, and link
+    the files into the other groups. Returns one result per format, the first one also carrying the
+    phases (decode, resample, ...) spent on the frame itself.
+    """
+    width, height, dpi, formats, max_size_mb, groups = target
+    resized.info['dpi'] = (dpi, dpi)
+    results = []
+    for fmt, options in formats:
+        out_name = output_name(base_name, width, height, dpi, fmt)
+        out_path = os.path.join(OUTPUT_FOLDER, groups[0], out_name)
+        remove_output(out_path)
+        if fmt == "png":
+            saved = save_png(resized, out_path, options, max_size_mb)
+        else:
+            saved = save_encoded(resized, fmt, options, dpi, out_path, max_size_mb)
+        timer = PhaseTimer()
+        with timer.phase("link"):
+            linked_paths = [] if saved.get("skip_reason") else link_into_groups(out_path, out_name, groups)
+        add_phases(saved["phases"], timer.seconds)
+        if not results and phases:
+            add_phases(saved["phases"], phases)
+        results.append(job_result(target, fmt, out_name, out_path, linked_paths=linked_paths, **saved))
+    return results
+
+def stream_target(reader, base_name, target):
+    """Streaming counterpart of save_target for PNG-only targets: resample and write one target band by band."""
+    width, height, dpi, formats, max_size_mb, groups = target
+    out_name = output_name(base_name, width, height, dpi, "png")
+    out_path = os.path.join(OUTPUT_FOLDER, groups[0], out_name)
+    options = dict(formats[0][1])
+    levels = (options["compress_level"],) if "compress_level" in options else PNG_COMPRESS_LEVELS
+    max_bytes = max_size_mb * 1024 * 1024
+    remove_output(out_path)
+    timer = PhaseTimer()
+    level, written_sizes = stream_resize_to_png(reader, width, height, dpi, out_path, max_bytes, levels, timer=timer)
+    raw = raw_png_size(width, height, png_mode(reader.mode))
+    legacy_writes, legacy_bytes = legacy_write_cost(raw, {}, written_sizes, max_bytes)
+    skip_reason = None
+    if level is None:
+        skip_reason = "file still too large after compression" if written_sizes else "estimated too large at every compress level, nothing written"
+    with timer.phase("link"):
+        linked_paths = [] if level is None else link_into_groups(out_path, out_name, groups)
+    return [job_result(
+        target, "png", out_name, out_path, timer.seconds, linked_paths, skip_reason, level,
+        len(written_sizes), sum(written_sizes.values()), legacy_writes, legacy_bytes,
+    )]
+
+def source_pixels(cache, input_path, reader, timer):
+    """Pixel hash of a master for the render cache, read band by band from the reader when it can stream."""
+    def compute():
+        if reader is not None and reader.streaming:
+            with timer.phase("hash"):
+                return pixel_hash(reader.size, reader.mode, reader.read_rows)
+        with timer.phase("decode"):
+            img = load_source(input_path)
+        with timer.phase("hash"):
+            return pixel_hash(img.size, img.mode, lambda y0, y1: img.crop((0, y0, img.width, y1)))
+    return cache.source_pixels(input_path, compute)
+
+def render_cache_key(pixels, target, fmt, options, pipeline):
+    width, height, dpi, _, max_size_mb, _ = target
+    return render_key({
+        "pixels": pixels,
+        "size": [width, height],
+        "dpi": dpi,
+        "filter": "LANCZOS",
+        "pipeline": pipeline,
+        "format": fmt,
+        "options": options,
+        "max_size_mb": max_size_mb,
+        "compress_levels": PNG_COMPRESS_LEVELS if fmt == "png" else None,
+    })
+
+def serve_cached(cache, pixels, base_name, targets, pipeline):
+    """
+    Serve every (target, format) the render cache has, linking cached files into place and repeating
+    cached skips. Returns (results, targets narrowed to the formats still to render, cache key of each
+    (size, format) still to render).
+    """
+    results, remaining, keys = [], [], {}
+    for target in targets:
+        width, height, dpi, formats, max_size_mb, groups = target
+        missing = []
+        for fmt, options in formats:
+            key = render_cache_key(pixels, target, fmt, options, pipeline)
+            hit = cache.lookup(key, FORMAT_EXTENSIONS[fmt])
+            if hit is None:
+                keys[(target[:3], fmt)] = key
+                missing.append((fmt, options))
+                continue
+            kind, value = hit
+            out_name = output_name(base_name, width, height, dpi, fmt)
+            out_path = os.path.join(OUTPUT_FOLDER, groups[0], out_name)
+            timer = PhaseTimer()
+            with timer.phase("cache"):
+                if kind == "file":
+                    cache.serve(value, out_path)
+                linked_paths = [] if kind == "skipped" else link_into_groups(out_path, out_name, groups)
+            results.append(job_result(
+                target, fmt, out_name, out_path, timer.seconds, linked_paths,
+                skip_reason=value if kind == "skipped" else None, cache="hit",
+            ))
+        if missing:
+            remaining.append(target[:3] + (tuple(missing),) + target[4:])
+    return results, remaining, keys
+
+def process_job(job):
+    """Worker entry point for one job: a source file and the target sizes to render from it."""
+    input_path, targets = job["input_path"], job["targets"]
+    # The streaming writer only does PNG, targets that want other formats need a whole frame
+    streamable = [target for target in targets if [fmt for fmt, _ in target[3]] == ["png"]] if job["streaming"] else []
+    targets = [target for target in targets if target not in streamable]
+    reader = BandReader(input_path) if streamable else None
+    cache = RenderCache(job["cache"]) if job["cache"] else None
+    results, rendered, keys = [], [], {}
+    # Work shared by every target of the job (decoding the master, hashing it) is logged on its first result
+    job_timer = PhaseTimer()
+    try:
+        if cache is not None:
+            pixels = source_pixels(cache, input_path, reader, job_timer)
+            hits, streamable, stream_keys = serve_cached(cache, pixels, job["base_name"], streamable, "streaming")
+            results.extend(hits)
+            keys.update(stream_keys)
+            pipeline = f"pyramid x{PYRAMID_HEADROOM}" if job["pyramid"] else "direct"
+            hits, targets, direct_keys = serve_cached(cache, pixels, job["base_name"], targets, pipeline)
+            results.extend(hits)
+            keys.update(direct_keys)
+        for target in streamable:
+            rendered.extend(stream_target(reader, job["base_name"], target))
+    finally:
+        if reader is not None:
+            reader.close()
+    if targets:
+        with job_timer.phase("decode"):
+            img = load_source(input_path)
+        if job["pyramid"]:
+            resized_targets = iter(render_pyramid(img, targets, PYRAMID_HEADROOM))
+        else:
+            resized_targets = ((target, img.resize(target[:2], Image.LANCZOS)) for target in targets)
+        while True:
+            # Resampling happens inside the generators, so time each step of them
+            timer = PhaseTimer()
+            with timer.phase("resample"):
+                step = next(resized_targets, None)
+            if step is None:
+                break
+            target, resized = step
+            rendered.extend(save_target(resized, job["base_name"], target, timer.seconds))
+
+    for result in rendered:
+        if cache is not None:
+            key = keys[(result["target"][:3], result["format"])]
+            if result["skipped"]:
+                cache.store_skipped(key, result["skip_reason"])
+            else:
+                cache.store(key, FORMAT_EXTENSIONS[result["format"]], result["out_path"])
+            result["cache"] = "miss"
+    results.extend(rendered)
+    if results:
+        add_phases(results[0]["phases"], job_timer.seconds)
+    for result in results:
+        result["source"] = input_path
+        result["peak_rss_mb"] = peak_rss_mb()
+    return results
+
+def process_job_in_worker(job):
+    """
+    process_job() in a pool worker: (worker pid, bytes of the master it keeps for its next job, results).
+    The master is only kept when job["keep_source"] says the next job reads the same file.
+    """
+    results = process_job(job)
+    if not job.get("keep_source"):
+        release_source()
+    return os.getpid(), held_source_bytes(), results
+
+def estimate_job_memory(job):
+    """
+    Rough bytes held by one job: the decoded master, its pyramid intermediates and the largest resized
+    frame plus encode buffer, or when streaming one source band and one output band.
+    """
+    targets = job["targets"]
+    if job["streaming"]:
+        reader = BandReader(job["input_path"])
+        (source_width, source_height), bands = reader.size, Image.getmodebands(reader.mode)
+        largest_band = 0
+        for width, height, *_ in targets:
+            first, last = source_rows_for(0, BAND_ROWS, source_height / height, source_height)
+            largest_band = max(largest_band, source_width * (last - first) + width * BAND_ROWS * OUTPUT_BAND_COPIES)
+        source_bytes = 0 if reader.streaming else source_width * source_height * bands
+        return source_bytes + largest_band * bands
+
+    with Image.open(job["input_path"]) as img:
+        bands = len(img.getbands())
+        source_bytes = img.width * img.height * bands
+    largest_target = max(width * height for width, height, *_ in targets)
+    intermediate_bytes = source_bytes // 3 if job["pyramid"] else 0  # 1/4 + 1/16 + ... of the master at most
+    return source_bytes + intermediate_bytes + 2 * largest_target * bands
+
+def build_jobs(sources, use_pyramid=False, streaming=False, cache=None):
+    """
+    Turn (filename, targets) pairs into jobs: one per (source file, target size), or with the pyramid
+    one per pyramid branch, so targets sharing an intermediate are rendered by the same worker.
+    Streaming jobs never use the pyramid, the intermediates would defeat the point. cache is the render
+    cache folder, or None to always render.
+    """
+    use_pyramid = use_pyramid and not streaming
+    jobs = []
+    for filename, source_targets in sources:
+        input_path = os.path.join(WATCH_FOLDER, filename)
+        base_name = os.path.splitext(filename)[0]
+        if use_pyramid:
             with Image.open(input_path) as img:
-                for width, height, dpi in RESIZE_SETTINGS:
-                    resized = img.resize((width, height), Image.LANCZOS)
-                    resized.info['dpi'] = (dpi, dpi)
-                    out_name = f"{base_name}_{width}x{height}_{dpi}dpi.png"
-                    out_path = os.path.join(OUTPUT_FOLDER, out_name)
-
-                    # Save with no compression
-                    resized.save(out_path, format="PNG", compress_level=0)
-
-                    # Check file size
-                    if is_file_too_large(out_path):
-                        # Try saving again with high compression
-                        resized.save(out_path, format="PNG", compress_level=2)
-
-                        # Re-check file size
-                        if is_file_too_large(out_path):
-                            os.remove(out_path)
-                            skipped_log.write(out_name + "\n")
-                            print(f"⚠️ Skipped {out_name}: file still too large after compression.")
-
-print("✅ Done: Converted and saved images to", OUTPUT_FOLDER)
-print("📝 Skipped files logged in:", SKIPPED_LOG)
+                groups = pyramid_branches(img.size, source_targets, PYRAMID_HEADROOM)
+        else:
+            groups = [[target] for target in source_targets]
+        for targets in groups:
+            jobs.append({
+                "input_path": input_path,
+                "base_name": base_name,
+                "targets": targets,
+                "pyramid": use_pyramid,
+                "streaming": streaming,
+                "cache": cache,
+            })
+    return jobs
+
+def record_result(result, skipped_log):
+    if result["skipped"]:
+        skipped_log.write(result["out_name"] + "\n")
+        skipped_log.flush()
+        print(f"⚠️ Skipped {result['out_name']}: {result['skip_reason']}.")
+
+def run_serial(jobs, skipped_log, on_result=None):
+    results = []
+    for job in jobs:
+        for result in process_job(job):
+            record_result(result, skipped_log)
+            if on_result:
+                on_result(result)
+            results.append(result)
+    return results
+
+def run_parallel(jobs, workers, max_memory_mb, skipped_log, on_result=None, mp_context=None):
+    """
+    Spread jobs over a process pool while keeping the estimated memory of in-flight jobs, plus the masters
+    workers keep decoded between jobs, under max_memory_mb. A job that doesn't fit still runs, but only
+    when nothing else is in flight. mp_context is the multiprocessing context of the pool, None for the default.
+    """
+    ceiling = max_memory_mb * 1024 * 1024
+    pending = [(job, estimate_job_memory(job)) for job in jobs]
+    pending.reverse()  # pop() from the end keeps the file-major job order
+    in_flight = {}
+    in_flight_bytes = 0
+    retained = {}  # worker pid -> bytes of the master it kept from its last job, counted until it switches masters
+    results = []
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context) as pool:
+        while pending or in_flight:
+            while pending and len(in_flight) < workers:
+                job, job_bytes = pending[-1]
+                if in_flight and in_flight_bytes + sum(retained.values()) + job_bytes > ceiling:
+                    break
+                pending.pop()
+                # Jobs are file-major, a worker only keeps the master when the next job reads it too
+                job = dict(job, keep_source=bool(pending) and pending[-1][0]["input_path"] == job["input_path"])
+                in_flight[pool.submit(process_job_in_worker, job)] = job_bytes
+                in_flight_bytes += job_bytes
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                in_flight_bytes -= in_flight.pop(future)
+                pid, kept_bytes, job_results = future.result()
+                retained[pid] = kept_bytes
+                for result in job_results:
+                    record_result(result, skipped_log)
+                    if on_result:
+                        on_result(result)
+                    results.append(result)
+    return results
+
+def run_jobs(jobs, args, skipped_log, on_result=None, mp_context=None):
+    if args.workers > 1:
+        return run_parallel(jobs, args.workers, args.max_memory_mb, skipped_log, on_result, mp_context)
+    return run_serial(jobs, skipped_log, on_result)
+
+def print_throughput(results, elapsed, workers):
+    images = len(results)
+    # A size encoded to several formats was only resampled once
+    resampled = {(r["source"], r["target"][:3]): r["pixels"] for r in results}
+    megapixels = sum(resampled.values()) / 1_000_000
+    elapsed = max(elapsed, 1e-9)
+    print(
+        f"📊 Throughput: {images} images in {elapsed:.1f}s with {workers} worker(s)"
+        f" → {images / elapsed * 60:.1f} images/minute, {megapixels / elapsed:.1f} MP/s"
+    )
+
+def print_write_savings(results):
+    writes_avoided = sum(r["legacy_writes"] - r["writes"] for r in results)
+    bytes_avoided = sum(r["legacy_bytes"] - r["bytes_written"] for r in results)
+    estimated_skips = sum(1 for r in results if r["skipped"] and not r["writes"])
+    print(
+        f"💾 Size estimation: {writes_avoided} writes and {bytes_avoided / (1024 * 1024):.1f} MB avoided,"
+        f" {estimated_skips} oversized targets skipped before writing"
+    )
+
+def print_peak_memory(results):
+    own = peak_rss_mb()
+    if own is None:
+        print("🧠 Peak memory: not reported on this OS")
+        return
+    workers = [r["peak_rss_mb"] for r in results if r["peak_rss_mb"] is not None]
+    largest_worker = max(max(workers, default=0), peak_rss_mb("children"))
+    print(f"🧠 Peak memory: {own:.0f} MB in this process, {largest_worker:.0f} MB in the largest worker")
+
+def cache_folder(args):
+    return RENDER_CACHE if args.cache else None
+
+def evict_cache(args):
+    """Trim the render cache to --cache-mb, returns render_cache.evict()'s (count, bytes, bytes left) or None when the cache is off."""
+    if not args.cache or not os.path.isdir(RENDER_CACHE):
+        return None
+    return evict(RENDER_CACHE, args.cache_mb * 1024 * 1024)
+
+def print_cache_stats(results, evicted):
+    if evicted is None:
+        return
+    hits = [r for r in results if r["cache"] == "hit"]
+    misses = sum(1 for r in results if r["cache"] == "miss")
+    skipped_hits = sum(1 for r in hits if r["skipped"])
+    count, evicted_bytes, left = evicted
+    print(
+        f"🗃️ Render cache: {len(hits)} hits ({skipped_hits} remembered skips), {misses} misses,"
+        f" {count} evicted ({evicted_bytes / (1024 * 1024):.1f} MB), {left / (1024 * 1024):.1f} MB cached"
+    )
+
+def phase_totals(results):
+    totals = {}
+    for result in results:
+        add_phases(totals, result["phases"])
+    return totals
+
+def print_phase_summary(results):
+    """Where the time went: seconds per phase over all outputs, then the slowest outputs with their phases."""
+    totals = phase_totals(results)
+    if not totals:
+        return
+    busy = sum(totals.values())
+    print("⏱️ Time per phase (summed over workers): " + ", ".join(
+        f"{name} {seconds:.1f}s ({seconds / max(busy, 1e-9):.0%})"
+        for name, seconds in sorted(totals.items(), key=lambda item: -item[1])
+    ))
+    slowest = sorted(results, key=lambda r: -sum(r["phases"].values()))[:SLOWEST_TARGETS]
+    print(f"🐢 Slowest {len(slowest)} outputs:")
+    print(f"{'output':>44} {'total s':>8}  phases")
+    for result in slowest:
+        phases = " ".join(
+            f"{name}={seconds:.2f}" for name, seconds in sorted(result["phases"].items(), key=lambda item: -item[1])
+            if seconds >= 0.005
+        )
+        print(f"{result['out_name'][-44:]:>44} {sum(result['phases'].values()):>8.2f}  {phases}")
+
+def open_run_log(args, **fields):
+    """Start a run in the JSON-lines run log, None when logging is off."""
+    if not args.run_log:
+        return None
+    run_log = RunLog(args.run_log)
+    run_log.event(
+        "run_start", mode=args.mode, workers=args.workers, pyramid=args.pyramid, streaming=args.streaming,
+        cache=args.cache, profiles=args.profiles, groups=args.groups, **fields,
+    )
+    return run_log
+
+def log_result(run_log, result):
+    width, height, dpi = result["target"][:3]
+    run_log.event(
+        "target",
+        source=result["source"],
+        target=f"{width}x{height}_{dpi}dpi",
+        format=result["format"],
+        out_name=result["out_name"],
+        groups=result["target"][5],
+        skipped=result["skipped"],
+        skip_reason=result["skip_reason"],
+        compress_level=result["compress_level"],
+        writes=result["writes"],
+        bytes_written=result["bytes_written"],
+        cache=result["cache"],
+        peak_rss_mb=result["peak_rss_mb"],
+        phases={name: round(seconds, 4) for name, seconds in result["phases"].items()},
+        total_s=round(sum(result["phases"].values()), 4),
+    )
+
+def close_run_log(run_log, results, elapsed):
+    if run_log is None:
+        return
+    run_log.event(
+        "run_end",
+        elapsed_s=round(elapsed, 3),
+        outputs=len(results),
+        skipped=sum(1 for r in results if r["skipped"]),
+        bytes_written=sum(r["bytes_written"] for r in results),
+        phases={name: round(seconds, 3) for name, seconds in phase_totals(results).items()},
+        peak_rss_mb=peak_rss_mb(),
+    )
+    run_log.close()
+
+def row_key(target, fmt):
+    width, height, dpi = target[:3]
+    return f"{width}x{height}_{dpi}dpi.{fmt}"
+
+def row_settings_hashes(args):
+    """
+    Hash everything that changes the output of each (target size, format) pair, so edited profiles,
+    encoder options or groups get rendered again.
+    """
+    use_pyramid = args.pyramid and not args.streaming
+    return {
+        row_key(target, fmt): settings_hash({
+            "target": target[:3],
+            "format": fmt,
+            "options": options,
+            "max_size_mb": target[4],
+            "groups": target[5],
+            "compress_levels": PNG_COMPRESS_LEVELS,
+            "pyramid_headroom": PYRAMID_HEADROOM if use_pyramid else None,
+            "streaming": args.streaming,
+        })
+        for target in resize_targets(args)
+        for fmt, options in target[3]
+    }
+
+def render_pending(state, filename, args, skipped_log, run_log=None):
+    """Render only the sizes/formats of one master that the state index doesn't have as finished with the current settings."""
+    input_path = os.path.join(WATCH_FOLDER, filename)
+    row_hashes = row_settings_hashes(args)
+    pending = set(state.pending_rows(input_path, row_hashes))
+    if not pending:
+        return []
+
+    pending_targets = []
+    for target in resize_targets(args):
+        formats = tuple((fmt, options) for fmt, options in target[3] if row_key(target, fmt) in pending)
+        if formats:
+            pending_targets.append(target[:3] + (formats,) + target[4:])
+
+    def on_result(result):
+        key = row_key(result["target"], result["format"])
+        state.mark_done(result["source"], key, row_hashes[key], result["out_path"], result["skipped"])
+        state.save()
+        if run_log:
+            log_result(run_log, result)
+
+    print(f"🖼️ {filename}: rendering {len(pending)} of {len(row_hashes)} outputs")
+    make_group_folders(pending_targets)
+    jobs = build_jobs([(filename, pending_targets)], args.pyramid, args.streaming, cache_folder(args))
+    results = run_jobs(jobs, args, skipped_log, on_result)
+    print_cache_stats(results, evict_cache(args))
+    return results
+
+def run_watch(args):
+    """
+    Long-running mode: catch up on anything the state index doesn't have yet, then render masters as they
+    are closed after writing or moved into WATCH_FOLDER, once they stop changing.
+    """
+    state = StateIndex(STATE_INDEX)
+    run_log = open_run_log(args)
+    results = []
+    start = time.perf_counter()
+    watcher = make_watcher(WATCH_FOLDER)
+    debouncer = Debouncer()
+    for filename in list_source_files(WATCH_FOLDER, args.input_glob):
+        debouncer.touch(os.path.join(WATCH_FOLDER, filename))
+    print(f"👀 Watching {WATCH_FOLDER} (Ctrl+C to stop)")
+
+    with open(SKIPPED_LOG, "a") as skipped_log:
+        try:
+            while True:
+                for filename in watcher.read_events(POLL_SECONDS):
+                    if is_source_file(filename, args.input_glob):
+                        debouncer.touch(os.path.join(WATCH_FOLDER, filename))
+                for input_path in debouncer.ready():
+                    filename = os.path.basename(input_path)
+                    try:
+                        results.extend(render_pending(state, filename, args, skipped_log, run_log))
+                    except Exception as e:
+                        print(f"❌ Failed to render {filename}: {e}")
+        except KeyboardInterrupt:
+            print("🛑 Stopped watching.")
+        finally:
+            watcher.close()
+            state.save()
+            close_run_log(run_log, results, time.perf_counter() - start)
+
+def make_group_folders(targets):
+    for group in sorted({group for target in targets for group in target[5]}):
+        os.makedirs(os.path.join(OUTPUT_FOLDER, group), exist_ok=True)
+
+def print_catalog(args, targets):
+    """Summary of what the selected profiles render: profiles, distinct sizes and how many renders sharing saves."""
+    profiles = selected_profiles(args)
+    shared = [target for target in targets if len(target[5]) > 1]
+    print(
+        f"📋 {len(profiles)} profiles in {len(profile_groups(profiles))} group(s) → {len(targets)} sizes to render,"
+        f" {len(profiles) - len(targets)} duplicate renders saved by linking {len(shared)} shared size(s)"
+    )
+
+def list_groups(args):
+    profiles = load_profiles(args.profiles)
+    print(f"📋 Groups in {args.profiles}:")
+    for group, names in profile_groups(profiles).items():
+        print(f"  {group} ({len(names)}): {', '.join(names)}")
+    for width, height, dpi, _, _, groups in merge_profiles(profiles, normalize_formats(OUTPUT_FORMATS), MAX_SIZE_MB):
+        if len(groups) > 1:
+            print(f"🔗 {width}x{height} {dpi}dpi is rendered once and linked into {', '.join(groups)}")
+
+def group_list(value):
+    return [group.strip() for group in value.split(",") if group.strip()]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Resize every master in WATCH_FOLDER to the sizes in the resize profile catalog.")
+    parser.add_argument("mode", nargs="?", choices=["run", "watch"], default="run",
+                        help="run: one pass over the folder (default), watch: keep running and render new or changed masters")
+    parser.add_argument("--profiles", default=RESIZE_PROFILES,
+                        help="resize profile catalog, .toml or .json (default: resize_profiles.toml next to this script)")
+    parser.add_argument("--groups", action="extend", type=group_list, default=PROFILE_GROUPS,
+                        help="comma separated product groups to render, can be repeated (default: every group in the catalog)")
+    parser.add_argument("--list-groups", action="store_true",
+                        help="print the groups and profiles in the catalog, and which sizes they share, then exit")
+    parser.add_argument("--input-glob", action="append",
+                        help=f"pattern of masters to pick up from the watch folder, repeat for more than one (default: {' '.join(INPUT_GLOBS)})")
+    parser.add_argument("--workers", type=int, default=WORKERS,
+                        help="number of worker processes for (source file, target size) jobs, 1 runs everything in this process")
+    parser.add_argument("--max-memory-mb", type=int, default=MAX_MEMORY_MB,
+                        help="ceiling for the estimated memory of jobs running at the same time")
+    parser.add_argument("--pyramid", action="store_true", default=USE_PYRAMID,
+                        help="resample smaller targets from shared box-reduced intermediates instead of the full-res master")
+    parser.add_argument("--no-cache", dest="cache", action="store_false", default=USE_RENDER_CACHE,
+                        help="always resample and encode instead of serving identical earlier renders from the render cache")
+    parser.add_argument("--cache-mb", type=int, default=RENDER_CACHE_MB,
+                        help="size cap of the render cache, least recently used renders are evicted past it")
+    parser.add_argument("--run-log", default=RUN_LOG,
+                        help="JSON-lines file every output's phase timings, bytes and skip reason are appended to")
+    parser.add_argument("--no-run-log", dest="run_log", action="store_const", const=None,
+                        help="don't write the run log")
+    parser.add_argument("--streaming", action="store_true", default=USE_STREAMING,
+                        help="read masters and write PNGs band by band so peak memory scales with one band (ignores --pyramid)")
+    parser.add_argument("--quality-check", action="store_true",
+                        help="compare pyramid and direct LANCZOS output (PSNR/SSIM, time) for every master without writing files")
+    return parser.parse_args()
+
+def run_quality_check(filenames, targets):
+    for filename in filenames:
+        print(f"🔍 {filename}")
+        with Image.open(os.path.join(WATCH_FOLDER, filename)) as img:
+            img.load()
+            quality_report(img, targets, PYRAMID_HEADROOM)
+
+def main():
+    args = parse_args()
+    try:
+        if args.list_groups:
+            list_groups(args)
+            return
+        targets = resize_targets(args)
+    except ValueError as e:
+        raise SystemExit(f"❌ {e}")
+
+    filenames = list_source_files(WATCH_FOLDER, args.input_glob)
+    if args.quality_check:
+        run_quality_check(filenames, targets)
+        return
+
+    os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+    if args.mode == "watch":
+        run_watch(args)
+        return
+
+    print_catalog(args, targets)
+    make_group_folders(targets)
+    jobs = build_jobs([(filename, targets) for filename in filenames], args.pyramid, args.streaming, cache_folder(args))
+
+    run_log = open_run_log(args, masters=len(filenames), targets=len(targets))
+    start = time.perf_counter()
+    with open(SKIPPED_LOG, "w") as skipped_log:
+        results = run_jobs(jobs, args, skipped_log, (lambda result: log_result(run_log, result)) if run_log else None)
+    elapsed = time.perf_counter() - start
+    close_run_log(run_log, results, elapsed)
+
+    print("✅ Done: Converted and saved images to", OUTPUT_FOLDER)
+    print("📝 Skipped files logged in:", SKIPPED_LOG)
+    print_throughput(results, elapsed, max(args.workers, 1))
+    print_write_savings(results)
+    print_peak_memory(results)
+    print_cache_stats(results, evict_cache(args))
+    print_phase_summary(results)
+    if run_log:
+        print("🧾 Run log appended to:", args.run_log)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Output formats for image-size-conversion.py
+
+Each resize profile can ask for several formats, each with its own Pillow encoder options,
+e.g. {"png": {}, "webp": {"quality": 90}, "jpeg": {"quality": 95, "subsampling": 0}}.
+The resized frame is encoded to every format from memory, so decode and resample are paid
+once per size no matter how many formats a print provider wants.
+"""
+import io
+
+FORMAT_EXTENSIONS = {"png": ".png", "jpeg": ".jpg", "webp": ".webp", "tiff": ".tif"}
+_PIL_FORMATS = {"png": "PNG", "jpeg": "JPEG", "webp": "WEBP", "tiff": "TIFF"}
+_ALIASES = {"jpg": "jpeg", "tif": "tiff"}
+# Modes each format can store, anything else is converted to the first entry (or RGBA when the frame has alpha and that is allowed)
+_FORMAT_MODES = {
+    "png": ("RGB", "RGBA", "L", "LA", "P", "1", "I;16"),
+    "jpeg": ("RGB", "L", "CMYK"),
+    "webp": ("RGB", "RGBA"),
+    "tiff": None,
+}
+WEBP_MAX_SIDE = 16383 # WebP can't store anything wider or taller than this
+
+def normalize_format(name):
+    fmt = _ALIASES.get(name.lower().lstrip("."), name.lower().lstrip("."))
+    if fmt not in FORMAT_EXTENSIONS:
+        raise ValueError(f"unsupported output format {name!r}, use one of {', '.join(FORMAT_EXTENSIONS)}")
+    return fmt
+
+def normalize_formats(formats):
+    """
+    Turn a format list ("png", ["png", "webp"]) or a format -> encoder options dict into a hashable
+    tuple of (format, ((option, value), ...)) pairs, in the order given.
+    """
+    if isinstance(formats, str):
+        formats = [formats]
+    if not isinstance(formats, dict):
+        formats = {name: {} for name in formats}
+    return tuple(
+        (normalize_format(name), tuple(sorted((options or {}).items())))
+        for name, options in formats.items()
+    )
+
+def frame_for_format(img, fmt):
+    """Convert a frame to a mode the format can store."""
+    allowed = _FORMAT_MODES[fmt]
+    if allowed is None or img.mode in allowed:
+        return img
+    has_alpha = "A" in img.getbands() or "transparency" in img.info
+    if has_alpha and "RGBA" in allowed:
+        return img.convert("RGBA")
+    return img.convert(allowed[0])
+
+def encode_frame(img, fmt, options, dpi):
+    """Encode a frame into memory and return the bytes."""
+    if fmt == "webp" and max(img.size) > WEBP_MAX_SIDE:
+        raise ValueError(f"WebP is limited to {WEBP_MAX_SIDE}px per side")
+    buffer = io.BytesIO()
+    frame_for_format(img, fmt).save(buffer, format=_PIL_FORMATS[fmt], dpi=(dpi, dpi), **dict(options))
+    return buffer.getvalue()
@@ -0,0 +1,72 @@
+"""
+Predict PNG file sizes for image-size-conversion.py before anything is written to disk.
+
+Level 0 PNGs are stored uncompressed, so their size follows from width, height and pixel
+format alone. For higher levels a grid of tiles is cut out of the resized image, encoded
+in memory at that level, and the compression ratio of that sample is applied to the raw
+size. pick_compress_level() uses these numbers to go straight to the cheapest level that
+fits, or to skip a target that cannot fit at any level without saving it first.
+"""
+import io
+import math
+from PIL import Image
+
+SAMPLE_GRID = 4 # tiles per side sampled from the resized image for compression ratio estimates
+SAMPLE_TILE = 256 # tile edge in pixels
+ESTIMATE_MARGIN = 0.15 # sampled ratios are trusted to +/- this fraction, anything closer to the limit gets written and checked
+
+# Bits per pixel as Pillow writes them to PNG
+_PNG_BITS = {"1": 1, "L": 8, "P": 8, "LA": 16, "I": 16, "I;16": 16, "RGB": 24, "RGBA": 32}
+
+def raw_png_size(width, height, mode):
+    """Exact-ish size of a compress_level=0 PNG: filter byte per row, stored deflate blocks and chunk overhead."""
+    bits = _PNG_BITS.get(mode, 8 * Image.getmodebands(mode))
+    data = (1 + math.ceil(width * bits / 8)) * height
+    stored_blocks = math.ceil(data / 16384) * 5  # zlib emits stored blocks of at most 16-64 KB, 5 header bytes each
+    idat_chunks = math.ceil(data / 65536) * 12
+    return data + stored_blocks + idat_chunks + 6 + 1024  # zlib header/adler + IHDR/pHYs/IEND and friends
+
+def sample_mosaic(img, grid=SAMPLE_GRID, tile=SAMPLE_TILE):
+    """Stitch a grid of tiles spread evenly over the image into one small image for test encodes."""
+    if img.width <= grid * tile and img.height <= grid * tile:
+        return img
+    tw, th = min(tile, img.width), min(tile, img.height)
+    mosaic = Image.new(img.mode, (tw * grid, th * grid))
+    for row in range(grid):
+        for col in range(grid):
+            x = (img.width - tw) * col // max(grid - 1, 1)
+            y = (img.height - th) * row // max(grid - 1, 1)
+            mosaic.paste(img.crop((x, y, x + tw, y + th)), (col * tw, row * th))
+    return mosaic
+
+def estimate_png_size(img, compress_level, mosaic=None):
+    """Return (low, high) byte estimates for saving img as PNG at compress_level."""
+    raw = raw_png_size(img.width, img.height, img.mode)
+    if compress_level == 0:
+        return raw, raw
+    mosaic = mosaic if mosaic is not None else sample_mosaic(img)
+    buffer = io.BytesIO()
+    mosaic.save(buffer, format="PNG", compress_level=compress_level)
+    ratio = buffer.tell() / raw_png_size(mosaic.width, mosaic.height, mosaic.mode)
+    return int(raw * ratio * (1 - ESTIMATE_MARGIN)), int(raw * ratio * (1 + ESTIMATE_MARGIN))
+
+def pick_compress_level(img, max_bytes, levels):
+    """
+    Decide how to save img given the levels to try, cheapest first.
+
+    Returns (level, estimates): level is the first one whose high estimate fits, else the first
+    one whose low estimate fits (too close to call, the saved file has to be checked), else None
+    when every level is estimated to stay above max_bytes. estimates maps each level tried to (low, high).
+    """
+    estimates = {}
+    mosaic = None
+    for level in levels:
+        if level != 0 and mosaic is None:
+            mosaic = sample_mosaic(img)
+        estimates[level] = estimate_png_size(img, level, mosaic)
+        if estimates[level][1] <= max_bytes:
+            return level, estimates
+    for level in levels:
+        if estimates[level][0] <= max_bytes:
+            return level, estimates
+    return None, estimates
@@ -0,0 +1,140 @@
+"""
+Content-addressed render cache for image-size-conversion.py
+
+Every output is filed under a key built from the hash of the master's decoded pixels and
+everything that decides the rendered file (size, dpi, filter, resample path, format, encoder
+options, size limit). A master dropped again under another name, or a rerun after one size was
+tweaked, finds the unchanged renders here and gets them as hard links (copies across
+filesystems) instead of resampling and encoding again. Sizes that were skipped leave a small
+marker, so they are skipped again without rendering.
+
+Layout of the cache folder:
+    entries/ab/abcdef....png      a rendered file, hard-linked with the output it came from
+    entries/ab/abcdef....skipped  the skip reason of a size that couldn't be saved
+    sources/<path hash>.json      size, mtime and pixel hash of a master, so unchanged masters aren't hashed again
+
+The cache is an LRU on disk: hits touch the entry's mtime and evict() drops the least recently
+used entries once the folder is over its size cap.
+"""
+import hashlib
+import json
+import os
+import shutil
+
+PIXEL_HASH_ROWS = 512 # rows of the master hashed at a time, so hashing never copies the whole image
+
+def pixel_hash(size, mode, read_rows, band_rows=PIXEL_HASH_ROWS):
+    """Hash of an image's mode, size and pixels, read band by band through read_rows(y0, y1)."""
+    width, height = size
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(f"{mode} {width}x{height}".encode("ascii"))
+    for y0 in range(0, height, band_rows):
+        band = read_rows(y0, min(height, y0 + band_rows))
+        digest.update(band.tobytes())
+        band.close()
+    return digest.hexdigest()
+
+def render_key(settings):
+    """Cache key of a render, settings being anything JSON serialisable that includes the pixel hash."""
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()[:40]
+
+def _replace_with_link(entry_path, out_path):
+    """Make out_path the same file as entry_path: a hard link, or a copy where links aren't possible."""
+    if os.path.lexists(out_path):
+        os.remove(out_path)
+    try:
+        os.link(entry_path, out_path)
+    except OSError:
+        shutil.copy2(entry_path, out_path)
+
+class RenderCache:
+    """One process's handle on the cache folder; several processes can share the folder."""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self._entries = os.path.join(folder, "entries")
+        self._sources = os.path.join(folder, "sources")
+        os.makedirs(self._entries, exist_ok=True)
+        os.makedirs(self._sources, exist_ok=True)
+
+    def _entry_path(self, key, suffix):
+        return os.path.join(self._entries, key[:2], key + suffix)
+
+    def source_pixels(self, path, compute):
+        """Pixel hash of a master, from the sources memo while its size and mtime are unchanged, else compute()."""
+        stat = os.stat(path)
+        memo_name = hashlib.sha256(os.path.abspath(path).encode("utf-8")).hexdigest()[:32] + ".json"
+        memo_path = os.path.join(self._sources, memo_name)
+        try:
+            with open(memo_path, "r", encoding="utf-8") as f:
+                memo = json.load(f)
+            if memo["size"] == stat.st_size and memo["mtime_ns"] == stat.st_mtime_ns:
+                return memo["pixels"]
+        except (OSError, ValueError, KeyError):
+            pass
+        pixels = compute()
+        tmp_path = f"{memo_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"path": path, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "pixels": pixels}, f)
+        os.replace(tmp_path, memo_path)
+        return pixels
+
+    def lookup(self, key, extension):
+        """
+        Return ("file", entry path) for a cached render, ("skipped", reason) for a cached skip, or None.
+        Hits are touched so eviction sees them as recently used.
+        """
+        for kind, suffix in (("file", extension), ("skipped", ".skipped")):
+            entry_path = self._entry_path(key, suffix)
+            try:
+                os.utime(entry_path)
+            except FileNotFoundError:
+                continue
+            if kind == "file":
+                return kind, entry_path
+            with open(entry_path, "r", encoding="utf-8") as f:
+                return kind, f.read().strip()
+        return None
+
+    def serve(self, entry_path, out_path):
+        _replace_with_link(entry_path, out_path)
+
+    def store(self, key, extension, out_path):
+        """File a freshly written output under key."""
+        entry_path = self._entry_path(key, extension)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        _replace_with_link(out_path, entry_path)
+
+    def store_skipped(self, key, reason):
+        entry_path = self._entry_path(key, ".skipped")
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        with open(entry_path, "w", encoding="utf-8") as f:
+            f.write(reason + "\n")
+
+def evict(folder, max_bytes):
+    """
+    Delete least recently used entries until the entries in folder take at most max_bytes.
+    Returns (entries evicted, bytes evicted, bytes left).
+    """
+    entries = []
+    for root, _, files in os.walk(os.path.join(folder, "entries")):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    evicted, evicted_bytes = 0, 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        evicted += 1
+        evicted_bytes += size
+    return evicted, evicted_bytes, total
@@ -0,0 +1,135 @@
+"""
+Resize profile catalog for image-size-conversion.py
+
+Profiles live in resize_profiles.toml (or a .json file with the same layout), one entry per
+product size with its product group. load_profiles() validates the catalog, select_groups()
+narrows it down to the groups asked for on the command line, and merge_profiles() folds
+profiles sharing a width, height and dpi into one target, so a size used by several products
+is decoded, resized and encoded once and then linked into each group's output folder.
+"""
+import json
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    try:
+        import tomli as tomllib
+    except ImportError:
+        tomllib = None
+from output_formats import normalize_formats
+
+_REQUIRED = {"name": str, "width": int, "height": int, "dpi": int, "group": str}
+_OPTIONAL = {"formats", "max_size_mb"}
+
+def _read_catalog(path):
+    if path.lower().endswith(".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    if tomllib is None:
+        raise ValueError(f"{path}: reading TOML needs Python 3.11+ or the tomli package, or use a .json catalog")
+    with open(path, "rb") as f:
+        return tomllib.load(f)
+
+def validate_profile(raw, where):
+    """Check one catalog entry and return it as a clean dict, raising ValueError that says which entry is wrong."""
+    if not isinstance(raw, dict):
+        raise ValueError(f"{where}: expected a table of settings, got {type(raw).__name__}")
+    unknown = set(raw) - set(_REQUIRED) - _OPTIONAL
+    if unknown:
+        raise ValueError(f"{where}: unknown setting(s) {', '.join(sorted(unknown))}")
+    for key, kind in _REQUIRED.items():
+        if key not in raw:
+            raise ValueError(f"{where}: missing {key!r}")
+        value = raw[key]
+        if not isinstance(value, kind) or isinstance(value, bool):
+            raise ValueError(f"{where}: {key!r} must be a {kind.__name__}, got {value!r}")
+        if kind is int and value <= 0:
+            raise ValueError(f"{where}: {key!r} must be positive, got {value}")
+        if kind is str and not value.strip():
+            raise ValueError(f"{where}: {key!r} can't be empty")
+    group = raw["group"]
+    if group in (".", "..") or "/" in group or "\\" in group:
+        raise ValueError(f"{where}: group {group!r} has to work as a folder name")
+
+    profile = {key: raw[key] for key in _REQUIRED}
+    profile["formats"] = None
+    if "formats" in raw:
+        formats = raw["formats"]
+        if not isinstance(formats, (str, list, dict)) or not formats:
+            raise ValueError(f"{where}: 'formats' must be a format name, a list of them or a table of encoder options")
+        if isinstance(formats, dict) and not all(isinstance(options, dict) for options in formats.values()):
+            raise ValueError(f"{where}: every format in 'formats' needs a table of encoder options, use {{}} for none")
+        try:
+            profile["formats"] = normalize_formats(formats)
+        except ValueError as e:
+            raise ValueError(f"{where}: {e}") from e
+    profile["max_size_mb"] = None
+    if "max_size_mb" in raw:
+        max_size_mb = raw["max_size_mb"]
+        if not isinstance(max_size_mb, (int, float)) or isinstance(max_size_mb, bool) or max_size_mb <= 0:
+            raise ValueError(f"{where}: 'max_size_mb' must be a positive number, got {max_size_mb!r}")
+        profile["max_size_mb"] = max_size_mb
+    return profile
+
+def load_profiles(path):
+    """Read and validate every profile of a catalog, in file order."""
+    try:
+        catalog = _read_catalog(path)
+    except (OSError, ValueError) as e:  # tomllib.TOMLDecodeError and json.JSONDecodeError are ValueErrors
+        raise ValueError(f"can't read resize profiles from {path}: {e}") from e
+    entries = catalog.get("profile") if isinstance(catalog, dict) else None
+    if not isinstance(entries, list) or not entries:
+        raise ValueError(f"{path}: no [[profile]] entries found")
+
+    profiles = []
+    for index, raw in enumerate(entries, 1):
+        name = raw.get("name") if isinstance(raw, dict) else None
+        where = f"{path}: profile #{index}" + (f" ({name})" if name else "")
+        profiles.append(validate_profile(raw, where))
+    return profiles
+
+def profile_groups(profiles):
+    """Map each group to the names of its profiles, groups in the order they first appear."""
+    groups = {}
+    for profile in profiles:
+        groups.setdefault(profile["group"], []).append(profile["name"])
+    return groups
+
+def select_groups(profiles, groups):
+    """Keep the profiles of the given groups, all of them when groups is empty or None."""
+    if not groups:
+        return list(profiles)
+    unknown = [group for group in groups if group not in profile_groups(profiles)]
+    if unknown:
+        known = ", ".join(profile_groups(profiles))
+        raise ValueError(f"unknown group(s) {', '.join(unknown)}, the catalog has: {known}")
+    return [profile for profile in profiles if profile["group"] in groups]
+
+def merge_profiles(profiles, default_formats, default_max_size_mb):
+    """
+    Fold profiles into targets, one per (width, height, dpi):
+    (width, height, dpi, formats, max_size_mb, groups). formats is the union of the profiles' formats,
+    max_size_mb the smallest limit among them and groups the groups in catalog order, the first one
+    being where the files are written and the rest getting links.
+    """
+    merged = {}
+    for profile in profiles:
+        size = (profile["width"], profile["height"], profile["dpi"])
+        formats = profile["formats"] or default_formats
+        max_size_mb = profile["max_size_mb"] or default_max_size_mb
+        entry = merged.setdefault(size, {"formats": {}, "max_size_mb": max_size_mb, "groups": [], "names": []})
+        for fmt, options in formats:
+            if entry["formats"].setdefault(fmt, options) != options:
+                raise ValueError(
+                    f"{profile['name']} ({size[0]}x{size[1]} {size[2]}dpi) asks for {fmt} with different encoder"
+                    f" options than {', '.join(entry['names'])}, the output file would be the same"
+                )
+        entry["max_size_mb"] = min(entry["max_size_mb"], max_size_mb)
+        if profile["group"] not in entry["groups"]:
+            entry["groups"].append(profile["group"])
+        entry["names"].append(profile["name"])
+
+    return [
+        size + (tuple(entry["formats"].items()), entry["max_size_mb"], tuple(entry["groups"]))
+        for size, entry in merged.items()
+    ]
+
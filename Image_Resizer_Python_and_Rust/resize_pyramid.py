@@ -0,0 +1,137 @@
+"""
+Resize pyramid for image-size-conversion.py
+
+Instead of resampling every target straight from the full resolution master, targets are
+sorted from largest to smallest and each one is resampled with LANCZOS from the smallest
+box-reduced intermediate that is still at least PYRAMID_HEADROOM times the target on both
+sides. Intermediates are made with Image.reduce (an integer box filter, the same trick
+Pillow uses for resize(..., reducing_gap=...)) and are shared by every target that fits
+under them, so similar sizes and aspect ratios pay for one reduction instead of one full
+resolution filter pass each.
+
+quality_report() renders each target both ways and prints PSNR/SSIM and timings, so the
+pyramid output can be checked against the direct path before it is switched on.
+"""
+import math
+import time
+from PIL import Image, ImageChops, ImageMath
+
+PYRAMID_HEADROOM = 2.0 # an intermediate must stay at least this many times larger than the target on both sides before LANCZOS
+SSIM_BLOCK = 8 # SSIM is computed over non-overlapping blocks of this many pixels
+
+def safe_factor(source_size, target_size, headroom=PYRAMID_HEADROOM):
+    """Largest integer box reduction of the source that keeps headroom x the target on both sides."""
+    sw, sh = source_size
+    tw, th = target_size
+    return max(1, int(min(sw / (headroom * tw), sh / (headroom * th))))
+
+def plan_pyramid(source_size, targets, headroom=PYRAMID_HEADROOM):
+    """
+    Plan which intermediate each target is resampled from.
+
+    Returns (targets_in_render_order, steps, parents): steps maps a target to the box factor of
+    the intermediate it is resampled from, parents maps each factor to the factor it is reduced
+    from (factor 1 is the master itself).
+    """
+    ordered = sorted(targets, key=lambda t: t[0] * t[1], reverse=True)
+    parents = {1: None}
+    steps = {}
+    for target in ordered:
+        wanted = safe_factor(source_size, target[:2], headroom)
+        # Start from the most reduced intermediate this target can still be made from
+        base = max(f for f in parents if f <= wanted)
+        factor = base * (wanted // base) if wanted // base >= 2 else base
+        parents.setdefault(factor, base)
+        steps[target] = factor
+    return ordered, steps, parents
+
+def pyramid_branches(source_size, targets, headroom=PYRAMID_HEADROOM):
+    """
+    Split targets into independent branches of the pyramid, one per first-level intermediate,
+    so a process pool can still share out a master's targets while each branch reuses its intermediates.
+    """
+    ordered, steps, parents = plan_pyramid(source_size, targets, headroom)
+    branches = {}
+    for target in ordered:
+        root = steps[target]
+        while parents[root] not in (None, 1):
+            root = parents[root]
+        branches.setdefault(root, []).append(target)
+    return list(branches.values())
+
+def render_pyramid(img, targets, headroom=PYRAMID_HEADROOM):
+    """Yield (target, resized image) for every target, largest first, resampling from shared intermediates."""
+    ordered, steps, parents = plan_pyramid(img.size, targets, headroom)
+    intermediates = {1: img}
+    for target in ordered:
+        factor = steps[target]
+        if factor not in intermediates:
+            parent = parents[factor]
+            intermediates[factor] = intermediates[parent].reduce(factor // parent)
+        width, height = target[:2]
+        # Map the master's full extent into the intermediate so partially covered edge pixels line up
+        box = (0, 0, img.width / factor, img.height / factor)
+        yield target, intermediates[factor].resize((width, height), Image.LANCZOS, box=box)
+
+def _math(func, expression, **images):
+    if hasattr(ImageMath, "lambda_eval"):
+        return ImageMath.lambda_eval(lambda args: func(**{k: args[k] for k in images}), **images)
+    return ImageMath.eval(expression, **images)  # Pillow < 10.3
+
+def psnr(a, b):
+    """Peak signal-to-noise ratio in dB between two same-sized 8-bit images (inf when identical)."""
+    if a.mode not in ("L", "RGB", "RGBA"):
+        a, b = a.convert("RGB"), b.convert("RGB")
+    histogram = ImageChops.difference(a, b).histogram()
+    squared_error = sum(count * (i % 256) ** 2 for i, count in enumerate(histogram))
+    mse = squared_error / (a.width * a.height * len(a.getbands()))
+    if mse == 0:
+        return float("inf")
+    return 10 * math.log10(255 ** 2 / mse)
+
+def ssim(a, b, block=SSIM_BLOCK):
+    """Mean structural similarity of the luminance of two same-sized images, using block-wise statistics."""
+    x = a.convert("L").convert("F")
+    y = b.convert("L").convert("F")
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    mx, my = x.reduce(block), y.reduce(block)
+    mxx = _math(lambda x: x * x, "x * x", x=x).reduce(block)
+    myy = _math(lambda y: y * y, "y * y", y=y).reduce(block)
+    mxy = _math(lambda x, y: x * y, "x * y", x=x, y=y).reduce(block)
+    ssim_map = _math(
+        lambda mx, my, mxx, myy, mxy: ((mx * my * 2 + c1) * ((mxy - mx * my) * 2 + c2))
+        / ((mx * mx + my * my + c1) * ((mxx - mx * mx) + (myy - my * my) + c2)),
+        f"((mx * my * 2 + {c1}) * ((mxy - mx * my) * 2 + {c2}))"
+        f" / ((mx * mx + my * my + {c1}) * ((mxx - mx * mx) + (myy - my * my) + {c2}))",
+        mx=mx, my=my, mxx=mxx, myy=myy, mxy=mxy,
+    )
+    return ssim_map.resize((1, 1), Image.BOX).getpixel((0, 0))
+
+def quality_report(img, targets, headroom=PYRAMID_HEADROOM):
+    """
+    Render every target directly and through the pyramid, print PSNR/SSIM per target and the
+    total resample time of each path. Returns a list of per-target dicts.
+    """
+    start = time.perf_counter()
+    direct = {target: img.resize(target[:2], Image.LANCZOS) for target in targets}
+    direct_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    pyramid = dict(render_pyramid(img, targets, headroom))
+    pyramid_seconds = time.perf_counter() - start
+
+    _, steps, _ = plan_pyramid(img.size, targets, headroom)
+    rows = []
+    print(f"{'target':>22} {'factor':>6} {'PSNR dB':>8} {'SSIM':>7}")
+    for target in targets:
+        row = {
+            "target": target,
+            "factor": steps[target],
+            "psnr": psnr(direct[target], pyramid[target]),
+            "ssim": ssim(direct[target], pyramid[target]),
+        }
+        rows.append(row)
+        label = f"{target[0]}x{target[1]}_{target[2]}dpi"
+        print(f"{label:>22} {row['factor']:>6} {row['psnr']:>8.2f} {row['ssim']:>7.4f}")
+    print(f"⏱️ Direct LANCZOS: {direct_seconds:.2f}s, pyramid: {pyramid_seconds:.2f}s")
+    return rows
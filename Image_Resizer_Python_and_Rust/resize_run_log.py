@@ -0,0 +1,52 @@
+"""
+Run log for image-size-conversion.py
+
+PhaseTimer adds up wall time per phase (decode, hash, resample, estimate, save, encode, write,
+link, cache) with two perf_counter calls per phase, and RunLog appends one JSON line per
+event to a log file: a run_start line with the settings, one target line per (master, size,
+format) with its phase durations, bytes, compress level, peak RSS and skip reason, and a run_end
+line with the totals. Only the main process writes to the log, workers send their timings back
+with their results, so it is cheap enough to leave on.
+
+    jq -s 'map(select(.event == "target")) | sort_by(-.total_s) | .[:10]' resize_run.jsonl
+"""
+import json
+import os
+import time
+from contextlib import contextmanager
+
+class PhaseTimer:
+    """Adds up seconds per phase name: with timer.phase("resample"): ..."""
+
+    def __init__(self):
+        self.seconds = {}
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] = self.seconds.get(name, 0.0) + time.perf_counter() - start
+
+def add_phases(phases, seconds):
+    """Add the seconds of another timer (a phase -> seconds dict) into phases, in place."""
+    for name, value in seconds.items():
+        phases[name] = phases.get(name, 0.0) + value
+    return phases
+
+class RunLog:
+    """Appends JSON lines to path, every line tagged with the run id and a timestamp."""
+
+    def __init__(self, path):
+        self.path = path
+        self.run_id = time.strftime("%Y%m%dT%H%M%S") + f"-{os.getpid()}"
+        self._file = open(path, "a", encoding="utf-8")
+
+    def event(self, kind, **fields):
+        line = json.dumps({"ts": round(time.time(), 3), "run": self.run_id, "event": kind, **fields}, default=str)
+        self._file.write(line + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
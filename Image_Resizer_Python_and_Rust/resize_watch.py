@@ -0,0 +1,192 @@
+"""
+Watch-folder support for image-size-conversion.py
+
+- InotifyWatcher reports files that were closed after writing or moved into the folder (Linux),
+  PollingWatcher does the same by comparing folder snapshots on other systems.
+- Debouncer holds a reported file back until its size and mtime stop changing, so half
+  uploaded masters are not rendered.
+- StateIndex remembers, per master, its size, mtime, content hash and the settings hash each
+  target row was rendered with, so a restarted daemon only renders new or changed work.
+"""
+import ctypes
+import ctypes.util
+import hashlib
+import json
+import os
+import select
+import struct
+import sys
+import time
+
+DEBOUNCE_SECONDS = 5 # a file has to keep the same size and mtime for this long before it is rendered
+POLL_SECONDS = 2 # how often the polling watcher rescans the folder, and how often the debouncer is checked
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+_EVENT_HEADER = struct.Struct("iIII")
+
+class InotifyWatcher:
+    """Reports file names closed after writing or moved into a folder, using Linux inotify through libc."""
+
+    def __init__(self, folder):
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(folder), IN_CLOSE_WRITE | IN_MOVED_TO)
+        if wd < 0:
+            os.close(self._fd)
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {folder}")
+
+    def read_events(self, timeout):
+        """Wait up to timeout seconds and return the set of file names that had events."""
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return set()
+        try:
+            buffer = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+        names = set()
+        offset = 0
+        while offset < len(buffer):
+            _, _, _, name_length = _EVENT_HEADER.unpack_from(buffer, offset)
+            offset += _EVENT_HEADER.size
+            name = buffer[offset:offset + name_length].rstrip(b"\0")
+            offset += name_length
+            if name:
+                names.add(os.fsdecode(name))
+        return names
+
+    def close(self):
+        os.close(self._fd)
+
+class PollingWatcher:
+    """Fallback for systems without inotify: reports file names whose size or mtime changed since the last scan."""
+
+    def __init__(self, folder):
+        self._folder = folder
+        self._snapshot = self._scan()
+
+    def _scan(self):
+        snapshot = {}
+        with os.scandir(self._folder) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    stat = entry.stat()
+                    snapshot[entry.name] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def read_events(self, timeout):
+        time.sleep(timeout)
+        snapshot = self._scan()
+        names = {name for name, sig in snapshot.items() if self._snapshot.get(name) != sig}
+        self._snapshot = snapshot
+        return names
+
+    def close(self):
+        pass
+
+def make_watcher(folder):
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(folder)
+        except (OSError, AttributeError) as e:
+            print(f"⚠️ inotify unavailable ({e}), falling back to polling every {POLL_SECONDS}s")
+    return PollingWatcher(folder)
+
+class Debouncer:
+    """Holds file paths back until their size and mtime have been stable for DEBOUNCE_SECONDS."""
+
+    def __init__(self, quiet_seconds=None):
+        self._quiet_seconds = DEBOUNCE_SECONDS if quiet_seconds is None else quiet_seconds
+        self._pending = {}
+
+    def touch(self, path):
+        self._pending[path] = (None, time.monotonic())
+
+    def ready(self):
+        """Return paths that stopped changing, forgetting ones that disappeared."""
+        now = time.monotonic()
+        done = []
+        for path, (signature, since) in list(self._pending.items()):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                del self._pending[path]
+                continue
+            current = (stat.st_size, stat.st_mtime_ns)
+            if current != signature:
+                self._pending[path] = (current, now)
+            elif now - since >= self._quiet_seconds:
+                del self._pending[path]
+                done.append(path)
+        return done
+
+def content_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def settings_hash(settings):
+    """Stable hash of anything JSON serialisable that decides how a target row gets rendered."""
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+class StateIndex:
+    """
+    JSON index of finished work, keyed by master path:
+    {"size", "mtime_ns", "sha256", "rows": {row_key: {"settings": hash, "out_path": path, "skipped": bool}}}
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.sources = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.sources = json.load(f).get("sources", {})
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"sources": self.sources}, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def refresh_source(self, path):
+        """
+        Bring the stored size/mtime/hash of a master up to date, hashing only when size or mtime moved.
+        Rows rendered from different content are dropped.
+        """
+        stat = os.stat(path)
+        entry = self.sources.get(path)
+        if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            return entry
+        digest = content_hash(path)
+        if not entry or entry["sha256"] != digest:
+            entry = {"rows": {}}
+        entry.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns, sha256=digest)
+        self.sources[path] = entry
+        return entry
+
+    def pending_rows(self, path, rows):
+        """Return the row keys of rows (row_key -> settings hash) that still have to be rendered for a master."""
+        done = self.refresh_source(path)["rows"]
+        pending = []
+        for row_key, row_hash in rows.items():
+            record = done.get(row_key)
+            if (
+                record is None
+                or record["settings"] != row_hash
+                or (not record["skipped"] and not os.path.exists(record["out_path"]))
+            ):
+                pending.append(row_key)
+        return pending
+
+    def mark_done(self, path, row_key, row_hash, out_path, skipped):
+        self.sources[path]["rows"][row_key] = {"settings": row_hash, "out_path": out_path, "skipped": skipped}
+
+    def forget(self, path):
+        self.sources.pop(path, None)
@@ -0,0 +1,279 @@
+"""
+Memory-bounded streaming resize for image-size-conversion.py
+
+BandReader pulls horizontal bands of rows out of a master without decoding the rest of it.
+That works for uncompressed TIFFs (strip or single block), whose rows sit at known offsets in
+the file. Compressed TIFFs are decoded by libtiff as one block, so for those the master is
+decoded once and only the output side is streamed.
+
+stream_resize_to_png() resamples one target band by band: for every band of output rows it
+reads just the source rows under the LANCZOS filter support (plus one row of slack) and lets
+Pillow resample that band with a fractional source box. The pixels match resizing the whole
+image, at most one level apart where float rounding differs. Rows go straight into a PNG file
+as they are produced, so peak memory is one source band plus one output band instead of the
+master plus a full frame.
+
+The writer filters each band with whichever of the None, Sub and Up filters leaves the smallest
+bytes over the band (libpng's heuristic, per band instead of per row), and the compress level is
+picked from small sample bands spread from the top to the bottom of the target.
+"""
+import math
+import os
+import struct
+import zlib
+from PIL import Image, ImageChops, ImageStat
+from png_size_estimate import ESTIMATE_MARGIN, raw_png_size
+from resize_run_log import PhaseTimer
+
+BAND_ROWS = 256 # output rows resampled and written per band
+LANCZOS_SUPPORT = 3.0 # Pillow's LANCZOS filter reaches 3 source pixels either side, scaled up when downsampling
+OUTPUT_BAND_COPIES = 8 # copies of an output band held at once while its rows are resampled, filtered and compressed
+SAMPLE_BANDS = 8 # output bands spread over the target whose compressed size decides the compress level
+SAMPLE_ROWS = 16 # output rows per sample band
+
+# Bits per pixel of the raw layouts uncompressed TIFFs are read with, anything else is decoded whole
+_RAW_BITS = {
+    "1": 1, "1;I": 1, "L": 8, "L;I": 8, "P": 8, "LA": 16, "I;16": 16, "I;16B": 16, "I;16S": 16,
+    "I;16BS": 16, "RGB": 24, "RGBA": 32, "RGBa": 32, "RGBX": 32, "CMYK": 32, "F;32F": 32, "F;32BF": 32,
+}
+# PNG colour type and bytes per pixel of the modes the streaming writer handles directly
+_PNG_COLOR_TYPES = {"L": (0, 1), "LA": (4, 2), "RGB": (2, 3), "RGBA": (6, 4)}
+
+class BandReader:
+    """Reads bands of full-width rows from an image file, decoding only those rows when the file allows it."""
+
+    def __init__(self, path):
+        self.path = path
+        with Image.open(path) as img:
+            self.size = img.size
+            self.mode = img.mode
+            self._tiles = list(img.tile)
+        self.streaming = bool(self._tiles) and all(self._row_stride(tile) for tile in self._tiles)
+        self._full = None
+
+    def _row_stride(self, tile):
+        """Bytes per row of a raw, full-width, top-down tile, or None if rows can't be addressed directly."""
+        codec, extents, _, args = tile
+        if codec != "raw" or extents[0] != 0 or extents[2] != self.size[0]:
+            return None
+        rawmode = args[0] if isinstance(args, tuple) else args
+        stride = args[1] if isinstance(args, tuple) and len(args) > 1 else 0
+        orientation = args[2] if isinstance(args, tuple) and len(args) > 2 else 1
+        if orientation != 1 or rawmode not in _RAW_BITS:
+            return None
+        return stride or math.ceil(self.size[0] * _RAW_BITS[rawmode] / 8)
+
+    def read_rows(self, y0, y1):
+        """Return rows y0 (inclusive) to y1 (exclusive) as an image."""
+        width = self.size[0]
+        if not self.streaming:
+            if self._full is None:
+                self._full = Image.open(self.path)
+                self._full.load()
+            return self._full.crop((0, y0, width, y1))
+
+        parts = []
+        with open(self.path, "rb") as f:
+            for tile in self._tiles:
+                _, (_, top, _, bottom), offset, args = tile
+                first, last = max(top, y0), min(bottom, y1)
+                if first >= last:
+                    continue
+                stride = self._row_stride(tile)
+                rawmode = args[0] if isinstance(args, tuple) else args
+                f.seek(offset + (first - top) * stride)
+                data = f.read((last - first) * stride)
+                parts.append((first - y0, Image.frombytes(self.mode, (width, last - first), data, "raw", rawmode, stride, 1)))
+        if len(parts) == 1 and parts[0][1].height == y1 - y0:
+            return parts[0][1]
+        band = Image.new(self.mode, (width, y1 - y0))
+        for y, part in parts:
+            band.paste(part, (0, y))
+        return band
+
+    def close(self):
+        if self._full is not None:
+            self._full.close()
+            self._full = None
+
+def source_rows_for(out_y0, out_y1, scale, source_height):
+    """Source rows LANCZOS needs to produce output rows out_y0..out_y1 at the given source/output scale."""
+    support = LANCZOS_SUPPORT * max(scale, 1.0)
+    first = max(0, math.floor(out_y0 * scale - support) - 1)
+    last = min(source_height, math.ceil(out_y1 * scale + support) + 1)
+    return first, last
+
+def resized_rows(reader, width, height, out_y0, out_y1, timer):
+    """Output rows out_y0..out_y1 of the target, reading only the source rows under them."""
+    source_width, source_height = reader.size
+    scale = source_height / height
+    first, last = source_rows_for(out_y0, out_y1, scale, source_height)
+    with timer.phase("decode"):
+        source = reader.read_rows(first, last)
+    box = (0, out_y0 * scale - first, source_width, out_y1 * scale - first)
+    with timer.phase("resample"):
+        band = source.resize((width, out_y1 - out_y0), Image.LANCZOS, box=box)
+    source.close()
+    return band
+
+def resized_bands(reader, width, height, band_rows=BAND_ROWS, timer=None):
+    """Yield the target as consecutive bands of at most band_rows output rows, timing decode and resample on timer."""
+    timer = timer or PhaseTimer()
+    for out_y0 in range(0, height, band_rows):
+        yield resized_rows(reader, width, height, out_y0, min(height, out_y0 + band_rows), timer)
+
+def sample_bands(reader, width, height, timer, samples=SAMPLE_BANDS, rows=SAMPLE_ROWS):
+    """A few bands of rows spread evenly from the top to the bottom of the target, the whole target when it is that small."""
+    if height <= samples * rows:
+        return [resized_rows(reader, width, height, 0, height, timer)]
+    starts = sorted({round(i * (height - rows) / (samples - 1)) for i in range(samples)})
+    return [resized_rows(reader, width, height, y0, y0 + rows, timer) for y0 in starts]
+
+def png_mode(mode):
+    """Mode the streaming writer saves a source mode as."""
+    if mode in _PNG_COLOR_TYPES:
+        return mode
+    return "RGBA" if "A" in mode or mode == "P" else "RGB"
+
+def _chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+def scanlines(filtered, kind):
+    """Rows of an 8-bit image as PNG scanlines, each led by the filter type byte kind."""
+    lines = Image.new("L", (filtered.width + 1, filtered.height), kind)
+    lines.paste(filtered, (1, 0))
+    return lines.tobytes()
+
+def filtered_rows(band, mode, previous=None, adaptive=True):
+    """
+    PNG scanlines (filter type byte + filtered row) of band saved as mode, and the band's last row for the
+    next call. The whole band gets whichever of the None, Sub and Up filters leaves the smallest bytes
+    (summed as signed values, the heuristic libpng uses per row); previous is the last row of the band
+    before, for Up. adaptive=False leaves every row unfiltered.
+    """
+    if band.mode != mode:
+        band = band.convert(mode)
+    bytes_per_pixel = _PNG_COLOR_TYPES[mode][1]
+    stride = band.width * bytes_per_pixel
+    # The band's bytes as one 8-bit image, so the filters below are plain byte arithmetic whatever the mode
+    rows = Image.frombytes("L", (stride, band.height), band.tobytes())
+    last = rows.crop((0, band.height - 1, stride, band.height))
+    if not adaptive:
+        return scanlines(rows, 0), last
+
+    left = Image.new("L", rows.size)
+    if stride > bytes_per_pixel:
+        left.paste(rows.crop((0, 0, stride - bytes_per_pixel, rows.height)), (bytes_per_pixel, 0))
+    up = Image.new("L", rows.size)
+    if previous is not None:
+        up.paste(previous, (0, 0))
+    if rows.height > 1:
+        up.paste(rows.crop((0, 0, stride, rows.height - 1)), (0, 1))
+    candidates = [rows, ImageChops.subtract_modulo(rows, left), ImageChops.subtract_modulo(rows, up)]
+    zero = Image.new("L", rows.size)
+    costs = []
+    for filtered in candidates:
+        # |byte| as a signed value is min(v, 256 - v)
+        magnitude = ImageChops.darker(filtered, ImageChops.subtract_modulo(zero, filtered))
+        costs.append(ImageStat.Stat(magnitude).sum[0])
+    best = costs.index(min(costs))
+    return scanlines(candidates[best], best), last
+
+class PngStreamWriter:
+    """
+    Writes an 8-bit PNG row band by row band, without ever holding the whole image. Use it as a context
+    manager: the file is finished on the way out, or just closed when something went wrong.
+    """
+
+    def __init__(self, path, width, height, mode, dpi, compress_level):
+        self._file = open(path, "wb")
+        self._compressor = zlib.compressobj(compress_level)
+        self._mode = mode
+        # Stored (level 0) data is as big whatever the filter, so don't spend time choosing one
+        self._adaptive = compress_level > 0
+        self._previous = None
+        color_type, _ = _PNG_COLOR_TYPES[mode]
+        pixels_per_meter = int(dpi / 0.0254 + 0.5)
+        self._file.write(b"\x89PNG\r\n\x1a\n")
+        self._file.write(_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0)))
+        self._file.write(_chunk(b"pHYs", struct.pack(">IIB", pixels_per_meter, pixels_per_meter, 1)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+
+    def write_band(self, band):
+        """Append a band of rows."""
+        rows, self._previous = filtered_rows(band, self._mode, self._previous, self._adaptive)
+        compressed = self._compressor.compress(rows)
+        if compressed:
+            self._file.write(_chunk(b"IDAT", compressed))
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._file.write(_chunk(b"IDAT", self._compressor.flush()))
+        self._file.write(_chunk(b"IEND", b""))
+        self._file.close()
+
+def band_compression_ratio(bands, mode, compress_level):
+    """Compressed/raw ratio of sample bands the way PngStreamWriter would filter and encode them."""
+    data = b"".join(filtered_rows(band, mode, adaptive=compress_level > 0)[0] for band in bands)
+    compressed = zlib.compress(data, compress_level)
+    return len(compressed) / max(len(data), 1)
+
+def write_png(reader, width, height, dpi, out_path, mode, level, band_rows, timer):
+    """Resample and write the whole target at one compress level, returns the bytes written. No partial file is left behind on errors."""
+    try:
+        with PngStreamWriter(out_path, width, height, mode, dpi, level) as writer:
+            for band in resized_bands(reader, width, height, band_rows, timer):
+                with timer.phase("save"):
+                    writer.write_band(band)
+            with timer.phase("save"):
+                writer.close()
+    except BaseException:
+        if os.path.exists(out_path):
+            os.remove(out_path)
+        raise
+    return os.path.getsize(out_path)
+
+def stream_resize_to_png(reader, width, height, dpi, out_path, max_bytes, levels, band_rows=BAND_ROWS, timer=None):
+    """
+    Resample one target band by band straight into a PNG at out_path.
+
+    The compress level is picked like png_size_estimate.pick_compress_level: level 0 sizes are exact,
+    higher levels are estimated from SAMPLE_BANDS bands spread over the target. When the written file is
+    still over max_bytes the next level is tried, like save_png. Returns (level, {level: bytes written});
+    level is None and nothing is left on disk when the target can't fit under max_bytes. Seconds spent on
+    decode, resample, estimate and save (compress + write) are added up on timer when given.
+    """
+    timer = timer or PhaseTimer()
+    mode = png_mode(reader.mode)
+    raw = raw_png_size(width, height, mode)
+    samples = sample_bands(reader, width, height, timer) if any(levels) else []
+
+    estimates = {}
+    with timer.phase("estimate"):
+        for candidate in levels:
+            estimate = raw if candidate == 0 else raw * band_compression_ratio(samples, mode, candidate)
+            margin = ESTIMATE_MARGIN if candidate else 0
+            estimates[candidate] = (estimate * (1 - margin), estimate * (1 + margin))
+    samples.clear()
+    level = next((c for c in levels if estimates[c][1] <= max_bytes), None)
+    if level is None:
+        level = next((c for c in levels if estimates[c][0] <= max_bytes), None)
+    if level is None:
+        return None, {}
+
+    written_sizes = {}
+    for level in levels[levels.index(level):]:
+        written_sizes[level] = write_png(reader, width, height, dpi, out_path, mode, level, band_rows, timer)
+        if written_sizes[level] <= max_bytes:
+            return level, written_sizes
+    os.remove(out_path)
+    return None, written_sizes
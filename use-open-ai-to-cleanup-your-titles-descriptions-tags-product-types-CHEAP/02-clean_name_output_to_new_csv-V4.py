@@ -1,28 +1,56 @@
 # === Final Version: CSV Normalizer with Polished Cleanup, JSON-Safe Escaping, and Clean Numeric Ranges ===
 import csv
 import re
-import time
-import openai
 import os
+import sys
+import catalog_pipeline
+from openai_response_cache import estimate_cost
+from openai_prompt_packing import Packing
+from text_rules import keyword_pattern
 
 # === Immutable Variables ===
 INPUT_CSV: str = "name_cleanup_prep.csv"
 OUTPUT_CSV: str = "cleaned_name_outputs.csv"
 MAX_INPUT_LENGTH = 250  # read at most 250 chars, or change accordingly for your product title/name
 MAX_TITLE_LENGTH = 90   # final title limit, or change accordingly for your product title/name
+GENDERED_TERMS = ["teen boy", "teen girl", "boys", "girls", "boy", "girl"] # removed from every title, pay attention to this list and substitute as you see fit depending on your product
+COLLAPSE_KEYWORDS = ["Bedspread Coverlet Bedding", "Quilt Bedding Set", "Bedspread Coverlet", "Bedspread", "Coverlet", "Bedding"] # a phrase from this list is cut down to its first word so you don't get e.g. "Bedspread Coverlet" twice over, pay attention to this list and substitute as you see fit depending on your product name/titles listings
+LOCAL_PREFILTER = True # titles that clean_title alone already gets right are written without asking OpenAI, False sends every row like before
+LOCAL_QUALITY_THRESHOLD = 0.8 # score (0-1) a locally cleaned title needs to skip OpenAI, raise it to send more rows, lower it to send fewer, tune it with LOCAL_ROUTE_LOG
+BANNED_TERMS = ["free shipping", "hot sale", "new arrival", "best seller", "dropshipping", "wholesale", "cheap", "high quality", "brand new", "2024", "2025"] # supplier filler that only the model rewrites well, a title with one of these always goes to OpenAI
+LOCAL_ROUTE_LOG = "name_routes.csv" # which way each row went (local or openai), with its score and why, None turns it off
 
 OPENAI_API_KEY: str = "sk-proj-LONGSTRINGHERE" # Replace LONGSTRINGHERE with whatever is in your OpenAI account
 OPENAI_ORG_ID: str = "org-SHORTSTRINGHERE" # Replace SHORTSTRINGHERE with whatever is in your OpenAI account
 OPENAI_ENGINE: str = "gpt-3.5-turbo"
 
-WAIT_TIMER = 600 # if you hit a 429 due to hitting request limitations, it will auto sleep for 600 seconds and pick back up where it left off
-PICKUP_TEXT_FILE = "last_attempted_tags_product_type_completed_successfully.txt" # this is a failsafe in case your script fails, or you hit 429 or need to just break out of it, and still pick up where you left off
-SLEEP_BETWEEN_CALLS = 1 # seconds, in order to play friendly with openAI's platform and not get your account block for pounding their servers with too many requests
-
-# === OpenAI Setup ===
-openai.api_key = OPENAI_API_KEY
-if OPENAI_ORG_ID:
-    openai.organization = OPENAI_ORG_ID
+MODE = "live" # "live" sends the requests right away, "batch" hands the whole CSV to the OpenAI Batch API: half the price, answers within 24 hours, see openai_batch.py
+BATCH_STATE_FILE = "name_cleanup_batch.json" # ids of submitted batches, so a restart picks them up instead of paying for them twice
+BATCH_POLL_SECONDS = 60 # how often to ask OpenAI whether a batch is done
+BATCH_MAX_WAIT_HOURS = 0 # stop waiting after this many hours, the batches stay in BATCH_STATE_FILE and the next run picks them up, 0 waits until OpenAI is done (up to 24 hours)
+RESPONSE_CACHE = "openai_response_cache.sqlite" # answers already paid for, None turns it off (shared settings: see catalog_pipeline.py)
+CACHE_TTL_DAYS = 30 # answers older than this are asked again
+CACHE_MAX_MB = 200 # the least recently used answers are dropped when the cache grows over this
+NEAR_DUPLICATES = True # send one row per group of listings that only differ in size/color words and fill the others in from its answer (see near_duplicates.py), False sends every row
+NEAR_DUPLICATE_THRESHOLD = 0.9 # how alike the rest of the text must be (Jaccard of 3-word shingles), 1.0 = identical apart from size/color words
+NEAR_DUPLICATE_LOG = "near_duplicate_names.csv" # which rows were filled in from which, with the words that were swapped, check it after a run
+
+OPENAI_BASE_URL = None # leave None for OpenAI, or e.g. "http://127.0.0.1:8765/v1" to test against mock_openai_server.py
+
+DEAD_LETTER_CSV = "failed_name_cleanups.csv" # rows OpenAI rejects for good (bad request, no quota...) or that keep failing after every retry land here instead of stopping the run, see openai_retry_policy.py for the retry rules
+CHECKPOINT_DB = "cleanup_checkpoints.sqlite" # finished rows, a restart skips them (shared settings: see catalog_pipeline.py)
+CHECKPOINT_STAGE = "clean_name" # this script's name in CHECKPOINT_DB
+TELEMETRY_LOG = "openai_calls.jsonl" # one line per request, None turns it off (shared settings: see catalog_pipeline.py)
+TOKEN_BUDGET = 0 # stop sending once this run spent this many tokens on this script's requests, rows left over are done by the next run, 0 for no cap
+DOLLAR_BUDGET = 0 # same in dollars (estimated from the prices in openai_response_cache.py), 0 for no cap
+DRY_RUN = False # True only reports how many rows would be sent and roughly what they would cost, nothing is sent
+CONCURRENCY = 8 # requests in flight at the same time, 1 sends them one at a time like the old version
+REQUESTS_PER_MINUTE = 500 # set to your account's requests per minute limit for OPENAI_ENGINE (platform.openai.com/settings/organization/limits), 0 for no limit
+TOKENS_PER_MINUTE = 60000 # set to your account's tokens per minute limit for OPENAI_ENGINE, 0 for no limit
+MAX_OUTPUT_TOKENS = 60 # expected size of one answer, reserved against TOKENS_PER_MINUTE before each request
+PACK_SIZE = 20 # titles sent together in one request so the system prompt is paid once per pack instead of once per title, 1 sends one title per request like before (live mode only)
+PACK_TOKEN_BUDGET = 12000 # most tokens (prompt + expected answers) one packed request may use, keep it well under the context window of OPENAI_ENGINE (16k for gpt-3.5-turbo)
+OUTPUT_ORDER = "ordered" # or "keyed" (shared settings: see catalog_pipeline.py)
 
 # === Helper Functions ===
 def truncate_input(name: str, max_length: int) -> str:
@@ -32,130 +60,209 @@ def truncate_input(name: str, max_length: int) -> str:
     truncated = name[:max_length].rsplit(" ", 1)[0]
     return truncated.strip()
 
+def normalize_range(match) -> str:
+    """14x14/15*15/12*12 → 14x14, 15x15, 12x12"""
+    parts = RANGE_SEPARATOR.split(match.group(0))
+    cleaned_parts = [p.replace(' ', '').replace('X', 'x') for p in parts]
+    return ', '.join(cleaned_parts)
+
+def strip_trailing_punctuation(title: str) -> str:
+    """Remove trailing punctuation (-–/:;,. and spaces), without a regex that scans the whole title for it."""
+    end = len(title)
+    while end and (title[end - 1] in "-–/:;,." or title[end - 1].isspace()):
+        end -= 1
+    return title[:end]
+
+def title_case(title: str) -> str:
+    """Enforce consistent title casing, words in all caps stay that way."""
+    return " ".join(word.capitalize() if not word.isupper() else word for word in title.split())
+
+# Comprehensive cleanup, JSON-safe, and clean numeric ranges, compiled once instead of looked up in the re cache on every title
+GENDERED = re.compile(r'\b(?:' + keyword_pattern(GENDERED_TERMS) + r')\b', re.I)
+COLLAPSE = re.compile(r'\b(?:' + keyword_pattern(COLLAPSE_KEYWORDS) + r')\b', re.I)
+SPACES = re.compile(r'\s{2,}')
+FRACTION_UNITS = re.compile(r'(\d+/\d+)([a-zA-Z]+)')
+NUMERIC_RANGE = re.compile(r'(\d+\s*[xX]\s*\d+(?:[/\*]\s*\d+\s*[xX]\s*\d+)+)')
+RANGE_SEPARATOR = re.compile(r'[/\*]')
+SPACE_BEFORE_PUNCTUATION = re.compile(r"\s+([,.:;!?])")
+
 def clean_title(title: str) -> str:
     """Comprehensive cleanup, JSON-safe, and clean numeric ranges."""
-    # Remove gendered terms
-    title = re.sub(r'\b(teen boy|teen girl|boys|girls|boy|girl)\b', '', title, flags=re.I)  # pay attention to this string and substitute as you see fit depending on your product
-    title = re.sub(r'\s{2,}', ' ', title).strip()
-
-    # Remove duplicated keywords
-    title = re.sub(
-        r'\b(Bedspread Coverlet Bedding|Quilt Bedding Set|Bedspread Coverlet|Bedspread|Coverlet|Bedding)\b', #pay attention to this string and substitute as you see fit depending on your product name/titles listings
-        lambda m: m.group(0).split()[0],
-        title,
-        flags=re.I
-    )
-
-    # Normalize quotes
+    title = GENDERED.sub('', title)
+    title = SPACES.sub(' ', title).strip()
+    title = COLLAPSE.sub(lambda m: m.group(0).split()[0], title)
     title = title.replace('""', '"')
-
-    # Fix fractions: ensure space before units (e.g., 5/8cm → 5/8 cm)
-    title = re.sub(r'(\d+/\d+)([a-zA-Z]+)', r'\1 \2', title)
-
-    # --- Clean numeric ranges ---
-    # Convert 14x14/15*15/12*12 → 14x14, 15x15, 12x12
-    def normalize_range(match):
-        parts = re.split(r'[/\*]', match.group(0))
-        cleaned_parts = [p.replace(' ', '').replace('X', 'x') for p in parts]
-        return ', '.join(cleaned_parts)
-
-    title = re.sub(r'(\d+\s*[xX]\s*\d+(?:[/\*]\s*\d+\s*[xX]\s*\d+)+)', normalize_range, title)
-
-    # Remove trailing punctuation
-    title = re.sub(r"[-–/:;,.\s]+$", "", title)
-
-    # Enforce consistent title casing
-    title = " ".join(word.capitalize() if not word.isupper() else word for word in title.split())
-
-    # Clean spacing and punctuation
-    title = re.sub(r"\s{2,}", " ", title)
-    title = re.sub(r"\s+([,.:;!?])", r"\1", title)
-
+    if "/" in title or "*" in title:
+        # Fix fractions: ensure space before units (e.g., 5/8cm → 5/8 cm)
+        title = FRACTION_UNITS.sub(r'\1 \2', title)
+        title = NUMERIC_RANGE.sub(normalize_range, title)
+    title = strip_trailing_punctuation(title)
+    title = title_case(title)
+    title = SPACES.sub(" ", title)
+    title = SPACE_BEFORE_PUNCTUATION.sub(r"\1", title)
     # JSON-safe escape
     title = title.replace('"', r'\"')
-
     return title.strip()
 
+# === Local Pre-filter ===
+BANNED = re.compile(r'\b(?:' + keyword_pattern(BANNED_TERMS) + r')\b', re.I)
+WORD = re.compile(r"[A-Za-z]+")
+
+def score_title(name: str):
+    """
+    (locally cleaned title, quality score 0-1, reasons it lost points) for a raw name.
+    The title is what finish_title would make of the model's answer, so a title that scores well is one
+    the model would only have to give back as it is.
+    """
+    title = finish_title(truncate_input(name, MAX_INPUT_LENGTH))
+    score, reasons = 1.0, []
+    if not title:
+        return title, 0.0, ["empty"]
+    if len(clean_title(name.strip())) > MAX_TITLE_LENGTH:
+        # Only the model can shorten it without cutting off details
+        score -= 1.0
+        reasons.append(f"longer than {MAX_TITLE_LENGTH}")
+    words = [word.lower() for word in WORD.findall(title) if len(word) > 2]
+    repeated = len(words) - len(set(words))
+    if repeated:
+        score -= 0.25 * repeated
+        reasons.append(f"{repeated} repeated words")
+    shouting = [word for word in WORD.findall(title) if len(word) > 3 and word.isupper()]
+    if shouting:
+        # clean_title leaves words in all caps as they are
+        score -= 0.5 * len(shouting) / len(title.split())
+        reasons.append(f"{len(shouting)} words in capitals")
+    if len(title.split()) < 3:
+        score -= 0.5
+        reasons.append("fewer than 3 words")
+    banned = BANNED.findall(name)
+    if banned:
+        score -= 1.0
+        reasons.append("banned terms: " + ", ".join(sorted({term.lower() for term in banned})))
+    return title, max(score, 0.0), reasons
+
+def prefilter(rows: list, log: bool = True):
+    """
+    ([(row, local title)] clean enough to skip OpenAI, [rows to send]), all rows to send when LOCAL_PREFILTER is off.
+    log appends every row's route to LOCAL_ROUTE_LOG.
+    """
+    if not LOCAL_PREFILTER:
+        return [], rows
+    local, remote, routes = [], [], []
+    for row in rows:
+        title, score, reasons = score_title(row["name"])
+        route = "local" if score >= LOCAL_QUALITY_THRESHOLD else "openai"
+        if route == "local":
+            local.append((row, title))
+        else:
+            remote.append(row)
+        routes.append([row["filename"], row["name"], title, route, f"{score:.2f}", "; ".join(reasons)])
+    if log and LOCAL_ROUTE_LOG and routes:
+        # Appended to like the output CSVs, so runs done in chunks (catalog_pipeline.py) keep every row
+        new_file = not os.path.exists(LOCAL_ROUTE_LOG) or os.stat(LOCAL_ROUTE_LOG).st_size == 0
+        with open(LOCAL_ROUTE_LOG, "a", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            if new_file:
+                writer.writerow(["filename", "name", "local_title", "route", "score", "reasons"])
+            writer.writerows(routes)
+    return local, remote
+
+# === OpenAI Requests ===
+SYSTEM_PROMPT = (
+    "You are an expert e-commerce content editor."
+    " Rewrite product titles to be ultra-concise, professional, neutral."
+    " Avoid gendered terms unless present in the original."
+    " Collapse redundant descriptors into one clear term."
+    " Keep essential details: size, color, material, quantity."
+    " Prefer titles under 90 characters. Capitalize properly."
+    " Never invent details or output partial words."
+)
+
+def build_messages(row: dict) -> list:
+    # Smart truncate input
+    input_name = truncate_input(row["name"], MAX_INPUT_LENGTH)
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": f"Normalize this product title: {input_name}"}
+    ]
+
+def request_body(messages: list) -> dict:
+    """Parameters of one chat.completions request, the same for live and batch mode."""
+    return {
+        "model": OPENAI_ENGINE,
+        "messages": messages,
+        "temperature": 0.4,
+    }
+
+async def call_openai(client, messages: list):
+    return await client.chat.completions.create(**request_body(messages))
+
+def finish_title(normalized_name: str) -> str:
+    normalized_name = normalized_name.strip()
+
+    # Enforce MAX_TITLE_LENGTH
+    if len(normalized_name) > MAX_TITLE_LENGTH:
+        normalized_name = normalized_name[:MAX_TITLE_LENGTH].rsplit(" ", 1)[0].strip()
+
+    # Post-process
+    return clean_title(normalized_name)
+
+def parse_response(row: dict, response) -> str:
+    return finish_title(response.choices[0].message.content)
+
+# === Packed Requests ===
+def pack_item(row: dict) -> dict:
+    return {"title": truncate_input(row["name"], MAX_INPUT_LENGTH)}
+
+def parse_pack_item(row: dict, answer: dict) -> str:
+    title = answer["title"]
+    if not isinstance(title, str) or not title.strip():
+        raise ValueError("empty title")
+    return finish_title(title)
+
+def make_packing():
+    """PACK_SIZE titles per request, None when packing is off."""
+    if PACK_SIZE <= 1:
+        return None
+    return Packing(
+        instructions=SYSTEM_PROMPT + " Each item's title is one product title to normalize.",
+        item=pack_item,
+        fields='"title": "<the normalized title>"',
+        parse_item=parse_pack_item,
+        max_items=PACK_SIZE,
+        token_budget=PACK_TOKEN_BUDGET,
+    )
+
+OUTPUT_FIELDS = ["filename", "name", "clean_name"]
+
+def output_row(row: dict, normalized_name) -> dict:
+    """One line of OUTPUT_CSV."""
+    return {
+        "filename": row["filename"],
+        "name": row["name"],
+        "clean_name": normalized_name
+    }
+
+def send(rows: list, write) -> dict:
+    """
+    Clean rows with OpenAI as set up above (MODE, cache, near-duplicates), write(row, output) once per row. Returns the run stats.
+    Rows the local pre-filter passes are written first, without a request.
+    """
+    local, rows = prefilter(rows)
+    for row, title in local:
+        write(row, title)
+    stats = catalog_pipeline.send(sys.modules[__name__], rows, write, lambda row: [row["name"]], make_packing())
+    stats["local"] = len(local)
+    if local:
+        tokens, cost = estimate_cost([row for row, _ in local], build_messages, OPENAI_ENGINE, MAX_OUTPUT_TOKENS, batch=MODE == "batch")
+        asked = stats["rows"] - stats["cached"] - stats["near_duplicates"]
+        latency = f", ~{len(local) * stats['seconds'] / asked:.0f}s at this run's pace" if asked and MODE != "batch" else ""
+        print(f"🏠 {len(local)} of {len(local) + len(rows)} titles were clean enough locally (score >= {LOCAL_QUALITY_THRESHOLD}): {len(local)} OpenAI calls avoided, ~{tokens} tokens (~${cost:.4f}){latency}, see {LOCAL_ROUTE_LOG}")
+    return stats
+
 # === Main Script ===
-last_processed_file = None
-if os.path.exists(PICKUP_TEXT_FILE):
-    with open(PICKUP_TEXT_FILE, "r", encoding="utf-8") as f:
-        content = f.read().strip()
-        if content:
-            last_processed_file = content
-
-# Open CSVs
-with open(INPUT_CSV, "r", encoding="utf-8", newline="") as infile, \
-     open(OUTPUT_CSV, "a", encoding="utf-8", newline="") as outfile:
-
-    reader = csv.DictReader(infile)
-    writer = csv.DictWriter(outfile, fieldnames=["filename", "name", "clean_name"])
-
-    # Write header if file is empty
-    if os.stat(OUTPUT_CSV).st_size == 0:
-        writer.writeheader()
-
-    start_processing = last_processed_file is None
-    for row in reader:
-        filename = row["filename"]
-        original_name = row["name"]
-
-        # Resume logic only if last_processed_file is set
-        if not start_processing:
-            if filename == last_processed_file:
-                start_processing = True
-            continue  # skip until we reach last processed file
-
-        # Smart truncate input
-        input_name = truncate_input(original_name, MAX_INPUT_LENGTH)
-
-        # Retry logic for API/network errors
-        while True:
-            try:
-                response = openai.chat.completions.create(
-                    model=OPENAI_ENGINE,
-                    messages=[
-                        {"role": "system", "content": (
-                            "You are an expert e-commerce content editor."
-                            " Rewrite product titles to be ultra-concise, professional, neutral."
-                            " Avoid gendered terms unless present in the original."
-                            " Collapse redundant descriptors into one clear term."
-                            " Keep essential details: size, color, material, quantity."
-                            " Prefer titles under 90 characters. Capitalize properly."
-                            " Never invent details or output partial words."
-                        )},
-                        {"role": "user", "content": f"Normalize this product title: {input_name}"}
-                    ],
-                    temperature=0.4,
-                )
-
-                normalized_name = response.choices[0].message.content.strip()
-
-                # Enforce MAX_TITLE_LENGTH
-                if len(normalized_name) > MAX_TITLE_LENGTH:
-                    normalized_name = normalized_name[:MAX_TITLE_LENGTH].rsplit(" ", 1)[0].strip()
-
-                # Post-process
-                normalized_name = clean_title(normalized_name)
-                break  # success
-
-            except Exception as e:
-                print(f"API/network error: {e}. Backing off for {WAIT_TIMER} seconds...")
-                time.sleep(WAIT_TIMER)
-
-        # Write to output CSV
-        writer.writerow({
-            "filename": filename,
-            "name": original_name,
-            "clean_name": normalized_name
-        })
-        outfile.flush()
-
-        # Update pickup file
-        with open(PICKUP_TEXT_FILE, "w", encoding="utf-8") as f:
-            f.write(filename)
-
-        print(f"Processed: {filename} -> {normalized_name}")
-        time.sleep(SLEEP_BETWEEN_CALLS)
-
-print("All titles processed successfully.")
+def main():
+    catalog_pipeline.run_script(sys.modules[__name__], ["name"], "All titles processed successfully.", show_output=True)
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,17 @@
 import json
 import csv
 import os
+from checkpoint_store import CheckpointStore, content_hash
+from json_bulk_writer import BulkWriter
+from catalog_pipeline import apply_clean_name
 
 # === Input/Output paths ===
 INPUT_JSON_FOLDER = "./01_RAW_JSON_DUMPS"
 INPUT_CSV = "cleaned_name_outputs.csv"
 OUTPUT_JSON_FOLDER = "./02_JSON_DUMPS_CLEANED_TITLES"
+CHECKPOINT_DB = "cleanup_checkpoints.sqlite" # files merged before are skipped unless the source JSON or the cleaned text changed since, None merges everything every time
+JSON_INDENT = 4 # indent of the written JSON files, None writes compact one-line JSON (much quicker to write on big catalogs, and smaller)
+WRITE_POOL = "thread" # "thread" serializes and writes files in a few worker threads while the next ones are read, "none" one at a time
 LOG_FILE = "cleaned_names_update_log.txt"
 
 os.makedirs(OUTPUT_JSON_FOLDER, exist_ok=True)
@@ -17,12 +23,22 @@ with open(INPUT_CSV, "r", encoding="utf-8") as f:
     for row in reader:
         csv_lookup[row["filename"]] = row["clean_name"]
 
-# === Prepare logging ===
-log_entries = []
-
 # === Process each JSON file ===
-processed_count = 0
 skipped_count = 0
+unchanged_count = 0
+store = CheckpointStore(CHECKPOINT_DB, "merge_clean_name", ["source", "clean_name"]) if CHECKPOINT_DB else None
+
+def written(filename: str, merged: dict, error):
+    """Called by the writer once a file is on disk (error None) or couldn't be written."""
+    if error:
+        writer.log(f"{filename}: ERROR writing JSON - {error}")
+        return
+    writer.log(f"{filename}: UPDATED successfully")
+    if store:
+        store.done(merged)
+
+# Log lines are appended in batches, LOG_FILE is started over like before
+writer = BulkWriter(OUTPUT_JSON_FOLDER, indent=JSON_INDENT, done=written, log_file=LOG_FILE, log_mode="w", pool=WRITE_POOL)
 
 for filename in os.listdir(INPUT_JSON_FOLDER):
     if not filename.lower().endswith(".json"):
@@ -30,43 +46,50 @@ for filename in os.listdir(INPUT_JSON_FOLDER):
 
     json_path = os.path.join(INPUT_JSON_FOLDER, filename)
     try:
-        with open(json_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        with open(json_path, "rb") as f:
+            raw = f.read()
     except Exception as e:
-        log_entries.append(f"{filename}: ERROR reading JSON - {e}")
+        writer.log(f"{filename}: ERROR reading JSON - {e}")
         skipped_count += 1
         continue
 
     if filename not in csv_lookup:
-        log_entries.append(f"{filename}: NOT FOUND in CSV, skipped")
+        writer.log(f"{filename}: NOT FOUND in CSV, skipped")
+        skipped_count += 1
+        continue
+
+    # Skip files whose source JSON and cleaned text are the same as when they were last merged
+    output_path = os.path.join(OUTPUT_JSON_FOLDER, filename)
+    merged = {"filename": filename, "source": content_hash(raw), "clean_name": csv_lookup[filename]}
+    if store and store.is_finished(merged) and os.path.exists(output_path):
+        unchanged_count += 1
+        continue
+
+    try:
+        data = json.loads(raw)
+    except Exception as e:
+        writer.log(f"{filename}: ERROR reading JSON - {e}")
         skipped_count += 1
         continue
 
     # Replace the product name
     clean_name = csv_lookup[filename]
     try:
-        data["data"]["product"]["name"] = clean_name
+        apply_clean_name(data["data"]["product"], clean_name)
     except KeyError:
-        log_entries.append(f"{filename}: ERROR - 'data.product.name' path not found")
+        writer.log(f"{filename}: ERROR - 'data.product.name' path not found")
         skipped_count += 1
         continue
 
-    # Write updated JSON
-    output_path = os.path.join(OUTPUT_JSON_FOLDER, filename)
-    try:
-        with open(output_path, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
-        log_entries.append(f"{filename}: UPDATED successfully")
-        processed_count += 1
-    except Exception as e:
-        log_entries.append(f"{filename}: ERROR writing JSON - {e}")
-        skipped_count += 1
+    # Write updated JSON (in the writer's workers, through a temp file and a rename)
+    writer.write(filename, data, merged)
 
-# === Write log file ===
-with open(LOG_FILE, "w", encoding="utf-8") as f:
-    for entry in log_entries:
-        f.write(entry + "\n")
+write_stats = writer.close()
+processed_count = write_stats["written"]
+skipped_count += write_stats["failed"]
+if store:
+    store.close()
 
 # === Summary ===
-print(f"Processing complete. {processed_count} files updated, {skipped_count} files skipped.")
+print(f"Processing complete. {processed_count} files updated, {unchanged_count} unchanged since the last run, {skipped_count} files skipped.")
 print(f"Log written to {LOG_FILE}")
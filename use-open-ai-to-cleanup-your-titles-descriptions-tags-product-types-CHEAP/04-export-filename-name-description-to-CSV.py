@@ -1,30 +1,18 @@
-import json
-import csv
-import os
+from json_csv_export import export
 
 # Immutable variable holding the directory with JSON files
 json_dumps = "./02_JSON_DUMPS_CLEANED_TITLES"  # replace with your folder path
 
 # Output CSV file
 output_csv = "descriptions_cleanup_prep.csv"
+FIELDS = ["name", "description"]  # columns after filename, read from data.product
+FILENAME_PREFIX = "zendrop_product_"  # only export files whose name starts with this (the Zendrop dumps), "" exports every .json file, e.g. the sample dumps
+POOL = "process"  # files are parsed in parallel ("process", "thread"), "none" reads them one at a time like the old version, see json_csv_export.py
 
-# Open CSV for writing
-with open(output_csv, "w", newline="", encoding="utf-8") as csvfile:
-    writer = csv.writer(csvfile)
-    writer.writerow(["filename", "name", "description"])  # header, now includes "description"
+def main():
+    stats = export(json_dumps, output_csv, FIELDS, prefix=FILENAME_PREFIX, pool=POOL)
+    print(f"CSV exported to {output_csv}: {stats['rows']} rows in {stats['seconds']:.1f}s, {stats['failed']} files failed.")
 
-    # Loop through all JSON files in the directory, one at a time
-    for filename in os.listdir(json_dumps):
-        if filename.startswith("zendrop_product_") and filename.endswith(".json"):
-            filepath = os.path.join(json_dumps, filename)
-            try:
-                with open(filepath, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-                    # Safely get the product name and description
-                    product_name = data.get("data", {}).get("product", {}).get("name", "")
-                    product_description = data.get("data", {}).get("product", {}).get("description", "")
-                    writer.writerow([filename, product_name, product_description])  # Add description to CSV
-            except Exception as e:
-                print(f"Failed to read {filename}: {e}")
-
-print(f"CSV exported to {output_csv}.")
+# The worker processes import this file again on Windows/macOS, only the main process may export
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,11 @@
 # === GPT-3.5 Turbo: Product Description Cleanup (Hybrid with HTML Unescape & Empty List Cleanup) ===
 import csv
 import re
-import time
 import os
+import sys
 from html import unescape
-import openai
+import catalog_pipeline
+from description_compaction import compact, count_tokens, restore, trim_to_budget
 
 # === Immutable Variables ===
 INPUT_CSV: str = "descriptions_cleanup_prep.csv"
@@ -14,16 +15,44 @@ OPENAI_API_KEY: str = "sk-proj-LONGSTRINGHERE" # Replace LONGSTRINGHERE with wha
 OPENAI_ORG_ID: str = "org-SHORTSTRINGHERE" # Replace SHORTSTRINGHERE with whatever is in your OpenAI account
 OPENAI_ENGINE: str = "gpt-3.5-turbo" # or choose whatever engine you want to use, but 3.5 turbo is fine for titles, descriptions, tags and product_types
 
-WAIT_TIMER = 600 #if you hit a http/429, this will allow the script to sleep for 600 seconds till it picks back up where it left off in the PICKUP_TEXT_FILE
-PICKUP_TEXT_FILE = "last_item_successfully_completed.txt" #since the descriptions can get long at times, this is in case you hit your limit while making a HUGE list of requests
-SLEEP_BETWEEN_CALLS = 1 # number of seconds between calls
-
-# === OpenAI Setup ===
-openai.api_key = OPENAI_API_KEY
-if OPENAI_ORG_ID:
-    openai.organization = OPENAI_ORG_ID
+MODE = "live" # "live" sends the requests right away, "batch" hands the whole CSV to the OpenAI Batch API: half the price, answers within 24 hours, see openai_batch.py
+BATCH_STATE_FILE = "description_cleanup_batch.json" # ids of submitted batches, so a restart picks them up instead of paying for them twice
+BATCH_POLL_SECONDS = 60 # how often to ask OpenAI whether a batch is done
+BATCH_MAX_WAIT_HOURS = 0 # stop waiting after this many hours, the batches stay in BATCH_STATE_FILE and the next run picks them up, 0 waits until OpenAI is done (up to 24 hours)
+RESPONSE_CACHE = "openai_response_cache.sqlite" # answers already paid for, None turns it off (shared settings: see catalog_pipeline.py)
+CACHE_TTL_DAYS = 30 # answers older than this are asked again
+CACHE_MAX_MB = 200 # the least recently used answers are dropped when the cache grows over this
+NEAR_DUPLICATES = True # send one row per group of listings that only differ in size/color words and fill the others in from its answer (see near_duplicates.py), False sends every row
+NEAR_DUPLICATE_THRESHOLD = 0.9 # how alike the rest of the text must be (Jaccard of 3-word shingles), 1.0 = identical apart from size/color words
+NEAR_DUPLICATE_LOG = "near_duplicate_descriptions.csv" # which rows were filled in from which, with the words that were swapped, check it after a run
+
+OPENAI_BASE_URL = None # leave None for OpenAI, or e.g. "http://127.0.0.1:8765/v1" to test against mock_openai_server.py
+
+DEAD_LETTER_CSV = "failed_description_cleanups.csv" # rows OpenAI rejects for good (bad request, no quota...) or that keep failing after every retry land here instead of stopping the run, see openai_retry_policy.py for the retry rules
+CHECKPOINT_DB = "cleanup_checkpoints.sqlite" # finished rows, a restart skips them (shared settings: see catalog_pipeline.py)
+CHECKPOINT_STAGE = "clean_description" # this script's name in CHECKPOINT_DB
+TELEMETRY_LOG = "openai_calls.jsonl" # one line per request, None turns it off (shared settings: see catalog_pipeline.py)
+TOKEN_BUDGET = 0 # stop sending once this run spent this many tokens on this script's requests, rows left over are done by the next run, 0 for no cap
+DOLLAR_BUDGET = 0 # same in dollars (estimated from the prices in openai_response_cache.py), 0 for no cap
+DRY_RUN = False # True only reports how many rows would be sent and roughly what they would cost, nothing is sent
+CONCURRENCY = 4 # requests in flight at the same time, 1 sends them one at a time like the old version
+REQUESTS_PER_MINUTE = 500 # set to your account's requests per minute limit for OPENAI_ENGINE (platform.openai.com/settings/organization/limits), 0 for no limit
+TOKENS_PER_MINUTE = 60000 # set to your account's tokens per minute limit for OPENAI_ENGINE, descriptions are big so this is usually the limit you hit, 0 for no limit
+MAX_OUTPUT_TOKENS = 700 # expected size of one cleaned description, reserved against TOKENS_PER_MINUTE before each request
+OUTPUT_ORDER = "ordered" # or "keyed" (shared settings: see catalog_pipeline.py)
+COMPACT_DESCRIPTIONS = True # send <img> tags as [IMG1] placeholders (put back in the answer) and strip style/class attributes, see description_compaction.py, False sends the description as it is
+DESCRIPTION_TOKEN_BUDGET = 0 # most tokens of description sent per request (with COMPACT_DESCRIPTIONS), longer ones are cut at the last paragraph that fits and GPT never sees the rest, e.g. 1500, 0 for no limit
+TRIMMED_LOG = "trimmed_descriptions.csv" # rows DESCRIPTION_TOKEN_BUDGET cut short, with their tokens before and after, check their clean_description after a run
 
 # === Helper Functions ===
+# Compiled once instead of looked up in the re cache on every description
+DESCRIPTION_LABEL = re.compile(r'^\s*(Product\s*Description|description)\s*[:\-]?\s*', re.I)
+REPEATED_P = re.compile(r'(<p>\s*){2,}', re.I)
+REPEATED_BR = re.compile(r'(<br>\s*){2,}', re.I)
+WHITESPACE = re.compile(r'\s{2,}')
+EMPTY_LI = re.compile(r'<li>\s*</li>', re.I)
+EMPTY_UL = re.compile(r'<ul>\s*</ul>', re.I)
+
 def pre_clean_description(desc: str) -> str:
     """
     Light pre-cleaning to reduce GPT tokens and improve output consistency:
@@ -35,12 +64,12 @@ def pre_clean_description(desc: str) -> str:
     if not desc:
         return ""
     # Remove “Product Description” or “description” labels at start
-    desc = re.sub(r'^\s*(Product\s*Description|description)\s*[:\-]?\s*', '', desc, flags=re.I)
+    desc = DESCRIPTION_LABEL.sub('', desc)
     # Remove repeated <p> or <br> tags
-    desc = re.sub(r'(<p>\s*){2,}', '<p>', desc, flags=re.I)
-    desc = re.sub(r'(<br>\s*){2,}', '<br>', desc, flags=re.I)
+    desc = REPEATED_P.sub('<p>', desc)
+    desc = REPEATED_BR.sub('<br>', desc)
     # Collapse multiple spaces/newlines
-    desc = re.sub(r'\s{2,}', ' ', desc)
+    desc = WHITESPACE.sub(' ', desc)
     return desc.strip()
 
 def collapse_empty_lists(html: str) -> str:
@@ -52,103 +81,118 @@ def collapse_empty_lists(html: str) -> str:
     if not html:
         return ""
     # Remove empty <li>
-    html = re.sub(r'<li>\s*</li>', '', html, flags=re.I)
+    html = EMPTY_LI.sub('', html)
     # Remove empty <ul> (after <li> cleanup)
-    html = re.sub(r'<ul>\s*</ul>', '', html, flags=re.I)
+    html = EMPTY_UL.sub('', html)
     return html
 
-def gpt_generate_clean_description(title: str, raw_description: str) -> str:
-    """
-    Sends the product title and pre-cleaned description to GPT for cleanup.
-    Returns cleaned HTML description with unescaped entities and empty lists removed.
-    Retries automatically on network/rate-limit errors.
-    """
-    while True:
-        try:
-            response = openai.chat.completions.create(
-                model=OPENAI_ENGINE,
-                messages=[
-                    {"role": "system", "content": (
-                        "You are an expert e-commerce content editor."
-                        " Rewrite product descriptions to be customer-friendly,"
-                        " visually clean, HTML-ready, with paragraph first and bullet points"
-                        " for specifications. Retain all valid data (sizes, colors, quantities)."
-                        " Keep images intact at the end inside a <div class='product-images'> block."
-                        " Do not invent features; use only information provided."
-                    )},
-                    {"role": "user", "content": (
-                        f"Product Name: {title}\n"
-                        f"Current Description: {raw_description}\n\n"
-                        "Please output a clean, well-formatted HTML description with paragraph first,"
-                        " bullet points for specifications, and any <img> tags at the end."
-                    )}
-                ],
-                temperature=0.4,
-            )
-            cleaned_html = response.choices[0].message.content.strip()
-            # Unescape HTML entities
-            cleaned_html = unescape(cleaned_html)
-            # Remove empty lists
-            cleaned_html = collapse_empty_lists(cleaned_html)
-            return cleaned_html
-
-        except Exception as e:
-            print(f"⚠️ API/network error: {e}\n→ Waiting {WAIT_TIMER} seconds before retry...")
-            time.sleep(WAIT_TIMER)
+# === OpenAI Requests ===
+SYSTEM_PROMPT = (
+    "You are an expert e-commerce content editor."
+    " Rewrite product descriptions to be customer-friendly,"
+    " visually clean, HTML-ready, with paragraph first and bullet points"
+    " for specifications. Retain all valid data (sizes, colors, quantities)."
+    " Keep images intact at the end inside a <div class='product-images'> block."
+    " Do not invent features; use only information provided."
+)
+# Added to SYSTEM_PROMPT only for descriptions that had <img> tags, the others are sent exactly as before
+PLACEHOLDER_PROMPT = " Image placeholders like [IMG1] stand for <img> tags, keep every one of them exactly as written."
+
+# description -> what compacted_description() returns, so each description is compacted and counted once per send()
+_compacted = {}
+
+def compacted_description(row: dict):
+    """(pre-cleaned description as sent to GPT, the <img> tags it stands for, (tokens, tokens sent) when DESCRIPTION_TOKEN_BUDGET cut it else None)."""
+    description = (row.get("description") or "").strip()
+    if description not in _compacted:
+        cleaned_input_desc = pre_clean_description(description)
+        if not COMPACT_DESCRIPTIONS:
+            _compacted[description] = cleaned_input_desc, [], None
+        else:
+            full, images = compact(cleaned_input_desc, 0, OPENAI_ENGINE)
+            sent = trim_to_budget(full, DESCRIPTION_TOKEN_BUDGET, OPENAI_ENGINE)
+            trimmed = (count_tokens(full, OPENAI_ENGINE), count_tokens(sent, OPENAI_ENGINE)) if sent != full else None
+            _compacted[description] = sent, images, trimmed
+    return _compacted[description]
+
+def log_trimmed(rows: list):
+    """Append the rows whose description DESCRIPTION_TOKEN_BUDGET cuts short to TRIMMED_LOG."""
+    if not (COMPACT_DESCRIPTIONS and DESCRIPTION_TOKEN_BUDGET and TRIMMED_LOG):
+        return
+    trimmed = []
+    for row in rows:
+        cut = compacted_description(row)[2]
+        if cut:
+            trimmed.append([row["filename"].strip(), *cut])
+    if not trimmed:
+        return
+    new_file = not os.path.exists(TRIMMED_LOG) or os.stat(TRIMMED_LOG).st_size == 0
+    with open(TRIMMED_LOG, "a", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        if new_file:
+            writer.writerow(["filename", "description_tokens", "tokens_sent"])
+        writer.writerows(trimmed)
+    print(f"✂️ {len(trimmed)} descriptions are longer than DESCRIPTION_TOKEN_BUDGET ({DESCRIPTION_TOKEN_BUDGET}) and are sent cut short, GPT won't see their end, see {TRIMMED_LOG}")
+
+def build_messages(row: dict) -> list:
+    """Product title and pre-cleaned description for GPT."""
+    title = row["name"].strip()
+    # Pre-clean (and compact) the description
+    cleaned_input_desc, images, _ = compacted_description(row)
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT + (PLACEHOLDER_PROMPT if images else "")},
+        {"role": "user", "content": (
+            f"Product Name: {title}\n"
+            f"Current Description: {cleaned_input_desc}\n\n"
+            "Please output a clean, well-formatted HTML description with paragraph first,"
+            " bullet points for specifications, and any <img> tags at the end."
+        )}
+    ]
+
+def request_body(messages: list) -> dict:
+    """Parameters of one chat.completions request, the same for live and batch mode."""
+    return {
+        "model": OPENAI_ENGINE,
+        "messages": messages,
+        "temperature": 0.4,
+    }
+
+async def call_openai(client, messages: list):
+    return await client.chat.completions.create(**request_body(messages))
+
+def parse_response(row: dict, response) -> str:
+    """Cleaned HTML description with unescaped entities and empty lists removed."""
+    cleaned_html = response.choices[0].message.content.strip()
+    # Unescape HTML entities
+    cleaned_html = unescape(cleaned_html)
+    # Remove empty lists
+    cleaned_html = collapse_empty_lists(cleaned_html)
+    # Original <img> tags back in for their placeholders, after unescaping so their URLs stay as they were
+    if COMPACT_DESCRIPTIONS:
+        cleaned_html = restore(cleaned_html, compacted_description(row)[1])
+    return cleaned_html
+
+OUTPUT_FIELDS = ["filename", "name", "description", "clean_description"]
+
+def output_row(row: dict, final_cleaned_description) -> dict:
+    """One line of OUTPUT_CSV."""
+    return {
+        "filename": row["filename"].strip(),
+        "name": row["name"].strip(),
+        "description": (row.get("description") or "").strip(),
+        "clean_description": final_cleaned_description
+    }
+
+def send(rows: list, write) -> dict:
+    """Clean rows with OpenAI as set up above (MODE, cache, near-duplicates), write(row, output) once per row. Returns the run stats."""
+    log_trimmed(rows)
+    stats = catalog_pipeline.send(sys.modules[__name__], rows, write, lambda row: [row["name"], row.get("description") or ""])
+    _compacted.clear()
+    return stats
 
 # === Main Processing ===
 def main():
-    last_processed_file = None
-    if os.path.exists(PICKUP_TEXT_FILE):
-        with open(PICKUP_TEXT_FILE, "r", encoding="utf-8") as f:
-            content = f.read().strip()
-            if content:
-                last_processed_file = content
-                print(f"⏸️ Resuming after last processed filename: {last_processed_file}")
-
-    with open(INPUT_CSV, "r", encoding="utf-8", newline="") as infile, \
-         open(OUTPUT_CSV, "a", encoding="utf-8", newline="") as outfile:
-
-        reader = csv.DictReader(infile)
-        writer = csv.DictWriter(outfile, fieldnames=["filename", "name", "description", "clean_description"])
-        if os.stat(OUTPUT_CSV).st_size == 0:
-            writer.writeheader()
-
-        start_processing = last_processed_file is None
-        for row in reader:
-            filename = row["filename"].strip()
-            title = row["name"].strip()
-            raw_description = (row.get("description") or "").strip()
-
-            # Skip until we reach resume point
-            if not start_processing:
-                if filename == last_processed_file:
-                    start_processing = True
-                continue
-
-            # Pre-clean the description
-            cleaned_input_desc = pre_clean_description(raw_description)
-
-            # GPT cleanup
-            final_cleaned_description = gpt_generate_clean_description(title, cleaned_input_desc)
-
-            # Write to CSV
-            writer.writerow({
-                "filename": filename,
-                "name": title,
-                "description": raw_description,
-                "clean_description": final_cleaned_description
-            })
-            outfile.flush()
-
-            # Update pickup file
-            with open(PICKUP_TEXT_FILE, "w", encoding="utf-8") as f:
-                f.write(filename)
-
-            print(f"✅ Processed: {filename}")
-            time.sleep(SLEEP_BETWEEN_CALLS)
-
-    print("🎉 All descriptions processed successfully.")
+    catalog_pipeline.run_script(sys.modules[__name__], ["name", "description"], "🎉 All descriptions processed successfully.")
 
 if __name__ == "__main__":
     main()
@@ -1,12 +1,17 @@
 import json
 import csv
 import os
-import re
+from checkpoint_store import CheckpointStore, content_hash
+from json_bulk_writer import BulkWriter
+from catalog_pipeline import apply_clean_description
 
 # === Input/Output paths ===
 INPUT_JSON_FOLDER = "./02_JSON_DUMPS_CLEANED_TITLES"
 INPUT_CSV = "cleaned_descriptions_with_html_coding.csv"
 OUTPUT_JSON_FOLDER = "./03_JSON_DUMPS_CLEANED_DESCRIPTIONS"
+CHECKPOINT_DB = "cleanup_checkpoints.sqlite" # files merged before are skipped unless the source JSON or the cleaned text changed since, None merges everything every time
+JSON_INDENT = 4 # indent of the written JSON files, None writes compact one-line JSON (much quicker to write on big catalogs, and smaller)
+WRITE_POOL = "thread" # "thread" serializes and writes files in a few worker threads while the next ones are read, "none" one at a time
 LOG_FILE = "cleaned_descriptions_update_log.txt"
 
 os.makedirs(OUTPUT_JSON_FOLDER, exist_ok=True)
@@ -18,12 +23,22 @@ with open(INPUT_CSV, "r", encoding="utf-8") as f:
     for row in reader:
         csv_lookup[row["filename"]] = row["clean_description"]
 
-# === Prepare logging ===
-log_entries = []
-
 # === Process each JSON file ===
-processed_count = 0
 skipped_count = 0
+unchanged_count = 0
+store = CheckpointStore(CHECKPOINT_DB, "merge_clean_description", ["source", "clean_description"]) if CHECKPOINT_DB else None
+
+def written(filename: str, merged: dict, error):
+    """Called by the writer once a file is on disk (error None) or couldn't be written."""
+    if error:
+        writer.log(f"{filename}: ERROR writing JSON - {error}")
+        return
+    writer.log(f"{filename}: DESCRIPTION UPDATED successfully")
+    if store:
+        store.done(merged)
+
+# Log lines are appended in batches, LOG_FILE is started over like before
+writer = BulkWriter(OUTPUT_JSON_FOLDER, indent=JSON_INDENT, done=written, log_file=LOG_FILE, log_mode="w", pool=WRITE_POOL)
 
 for filename in os.listdir(INPUT_JSON_FOLDER):
     if not filename.lower().endswith(".json"):
@@ -31,58 +46,49 @@ for filename in os.listdir(INPUT_JSON_FOLDER):
 
     json_path = os.path.join(INPUT_JSON_FOLDER, filename)
     try:
-        with open(json_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        with open(json_path, "rb") as f:
+            raw = f.read()
     except Exception as e:
-        log_entries.append(f"{filename}: ERROR reading JSON - {e}")
+        writer.log(f"{filename}: ERROR reading JSON - {e}")
         skipped_count += 1
         continue
 
     if filename not in csv_lookup:
-        log_entries.append(f"{filename}: NOT FOUND in CSV, skipped")
+        writer.log(f"{filename}: NOT FOUND in CSV, skipped")
         skipped_count += 1
         continue
 
-    # Extract original <img> tags from the old description
+    # Skip files whose source JSON and cleaned text are the same as when they were last merged
+    output_path = os.path.join(OUTPUT_JSON_FOLDER, filename)
+    merged = {"filename": filename, "source": content_hash(raw), "clean_description": csv_lookup[filename]}
+    if store and store.is_finished(merged) and os.path.exists(output_path):
+        unchanged_count += 1
+        continue
+
     try:
-        original_desc = data["data"]["product"]["description"]
-        img_tags = re.findall(r'<img [^>]+>', original_desc)
-    except KeyError:
-        log_entries.append(f"{filename}: ERROR - 'data.product.description' path not found")
+        data = json.loads(raw)
+    except Exception as e:
+        writer.log(f"{filename}: ERROR reading JSON - {e}")
         skipped_count += 1
         continue
 
-    # Replace the product description with the cleaned version
-    clean_desc = csv_lookup[filename].strip()
-
-    # Append original <img> tags at the end if not already present
-    for img in img_tags:
-        if img not in clean_desc:
-            clean_desc += "\n" + img
-
+    # Replace the product description with the cleaned version, original <img> tags appended if GPT dropped them
     try:
-        data["data"]["product"]["description"] = clean_desc
+        apply_clean_description(data["data"]["product"], csv_lookup[filename])
     except KeyError:
-        log_entries.append(f"{filename}: ERROR - 'data.product.description' path not found during assignment")
+        writer.log(f"{filename}: ERROR - 'data.product.description' path not found")
         skipped_count += 1
         continue
 
-    # Write updated JSON
-    output_path = os.path.join(OUTPUT_JSON_FOLDER, filename)
-    try:
-        with open(output_path, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
-        log_entries.append(f"{filename}: DESCRIPTION UPDATED successfully")
-        processed_count += 1
-    except Exception as e:
-        log_entries.append(f"{filename}: ERROR writing JSON - {e}")
-        skipped_count += 1
+    # Write updated JSON (in the writer's workers, through a temp file and a rename)
+    writer.write(filename, data, merged)
 
-# === Write log file ===
-with open(LOG_FILE, "w", encoding="utf-8") as f:
-    for entry in log_entries:
-        f.write(entry + "\n")
+write_stats = writer.close()
+processed_count = write_stats["written"]
+skipped_count += write_stats["failed"]
+if store:
+    store.close()
 
 # === Summary ===
-print(f"Processing complete. {processed_count} files updated, {skipped_count} files skipped.")
+print(f"Processing complete. {processed_count} files updated, {unchanged_count} unchanged since the last run, {skipped_count} files skipped.")
 print(f"Log written to {LOG_FILE}")
@@ -1,31 +1,53 @@
 # === GPT-3.5 Turbo: Generate Product Type & Tags with Custom Tags ===
-import csv
-import time
-import os
-from openai import OpenAI
+import sys
+import catalog_pipeline
+from openai_prompt_packing import Packing
 
 # ==== Immutable variables ====
-INPUT_CSV = "tags_product_types_cleanup_prep.csv" # don't forget to add ,custom_tags to the end of the header list at the top before using the next script, and any custom tags separated by |, i.e. ,kitchen|living room
+INPUT_CSV = "tags_product_types_cleanup_prep.csv" # 07 exports it with an empty custom_tags column, fill in any custom tags separated by |, i.e. kitchen|living room
 OUTPUT_CSV = "tags_product_types_added.csv"
 
 OPENAI_API_KEY: str = "sk-proj-LONGSTRINGHERE" # # Replace LONGSTRINGHERE with whatever is in your OpenAI account
 OPENAI_ORG_ID: str = "org-SHORTSTRINGHERE" # Replace SHORTSTRINGHERE with whatever is in your OpenAI account
 OPENAI_ENGINE: str = "gpt-3.5-turbo" #you will have to change this if you want to use a newer version, 3.5 works fine for titles, descriptions, tags and product_types
 
-WAIT_TIMER = 600
-PICKUP_TEXT_FILE = "last_successful_tags_type_update_written.txt"
-SLEEP_BETWEEN_CALLS = 1 # seconds, in order to be kind to the system and not get your requests dropped
+MODE = "live" # "live" sends the requests right away, "batch" hands the whole CSV to the OpenAI Batch API: half the price, answers within 24 hours, see openai_batch.py
+BATCH_STATE_FILE = "tags_product_types_batch.json" # ids of submitted batches, so a restart picks them up instead of paying for them twice
+BATCH_POLL_SECONDS = 60 # how often to ask OpenAI whether a batch is done
+BATCH_MAX_WAIT_HOURS = 0 # stop waiting after this many hours, the batches stay in BATCH_STATE_FILE and the next run picks them up, 0 waits until OpenAI is done (up to 24 hours)
+RESPONSE_CACHE = "openai_response_cache.sqlite" # answers already paid for, None turns it off (shared settings: see catalog_pipeline.py)
+CACHE_TTL_DAYS = 30 # answers older than this are asked again
+CACHE_MAX_MB = 200 # the least recently used answers are dropped when the cache grows over this
+NEAR_DUPLICATES = True # send one row per group of listings that only differ in size/color words and fill the others in from its answer (see near_duplicates.py), False sends every row
+NEAR_DUPLICATE_THRESHOLD = 0.9 # how alike the rest of the text must be (Jaccard of 3-word shingles), 1.0 = identical apart from size/color words
+NEAR_DUPLICATE_LOG = "near_duplicate_tags_product_types.csv" # which rows were filled in from which, with the words that were swapped, check it after a run
+
+OPENAI_BASE_URL = None # leave None for OpenAI, or e.g. "http://127.0.0.1:8765/v1" to test against mock_openai_server.py
+
+DEAD_LETTER_CSV = "failed_tags_product_types.csv" # rows OpenAI rejects for good (bad request, no quota...) or that keep failing after every retry land here instead of stopping the run, see openai_retry_policy.py for the retry rules
+CHECKPOINT_DB = "cleanup_checkpoints.sqlite" # finished rows, a restart skips them (shared settings: see catalog_pipeline.py)
+CHECKPOINT_STAGE = "tags_product_type" # this script's name in CHECKPOINT_DB
+TELEMETRY_LOG = "openai_calls.jsonl" # one line per request, None turns it off (shared settings: see catalog_pipeline.py)
+TOKEN_BUDGET = 0 # stop sending once this run spent this many tokens on this script's requests, rows left over are done by the next run, 0 for no cap
+DOLLAR_BUDGET = 0 # same in dollars (estimated from the prices in openai_response_cache.py), 0 for no cap
+DRY_RUN = False # True only reports how many rows would be sent and roughly what they would cost, nothing is sent
+CONCURRENCY = 8 # requests in flight at the same time, 1 sends them one at a time like the old version
+REQUESTS_PER_MINUTE = 500 # set to your account's requests per minute limit for OPENAI_ENGINE (platform.openai.com/settings/organization/limits), 0 for no limit
+TOKENS_PER_MINUTE = 60000 # set to your account's tokens per minute limit for OPENAI_ENGINE, 0 for no limit
+MAX_OUTPUT_TOKENS = 80 # expected size of one product_type + tags answer, reserved against TOKENS_PER_MINUTE before each request
+PACK_SIZE = 8 # products sent together in one request so the instructions are paid once per pack instead of once per product, 1 sends one product per request like before (live mode only)
+PACK_TOKEN_BUDGET = 12000 # most tokens (prompt + expected answers) one packed request may use, keep it well under the context window of OPENAI_ENGINE (16k for gpt-3.5-turbo), long descriptions make packs smaller
+OUTPUT_ORDER = "ordered" # or "keyed" (shared settings: see catalog_pipeline.py)
 # ==== Immutable variables ====
 
-# Initialize OpenAI client
-client = OpenAI(api_key=OPENAI_API_KEY, organization=OPENAI_ORG_ID)
-
 # === Helper function ===
-def get_tags_product_type(name: str, description: str):
+def build_messages(row: dict) -> list:
     """
-    Generate product_type and tags using GPT-3.5-turbo.
-    Tags returned are pipe-separated.
+    Prompt for product_type and tags of one row.
+    Tags come back pipe-separated.
     """
+    name = row["name"].strip()
+    description = (row.get("description") or "").strip()
     prompt = f"""
     You are a product classification assistant.
     Based on the following product name and description, determine:
@@ -39,90 +61,94 @@ def get_tags_product_type(name: str, description: str):
     Product Name: {name}
     Description: {description}
     """
-
-    while True:
-        try:
-            response = client.chat.completions.create(
-                model=OPENAI_ENGINE,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0
-            )
-            content = response.choices[0].message.content.strip()
-
-            # Parse GPT response
-            product_type = ""
-            tags = ""
-            for line in content.splitlines():
-                if line.lower().startswith("product_type:"):
-                    product_type = line.split(":", 1)[1].strip()
-                elif line.lower().startswith("tags:"):
-                    tags = line.split(":", 1)[1].strip()
-
-            tags_list = [t.strip() for t in tags.split("|") if t.strip()]
-            return product_type, tags_list
-
-        except Exception as e:
-            print(f"⚠️ OpenAI/API error: {e}\n→ Waiting {WAIT_TIMER} seconds before retry...")
-            time.sleep(WAIT_TIMER)
+    return [{"role": "user", "content": prompt}]
+
+def request_body(messages: list) -> dict:
+    """Parameters of one chat.completions request, the same for live and batch mode."""
+    return {
+        "model": OPENAI_ENGINE,
+        "messages": messages,
+        "temperature": 0,
+    }
+
+async def call_openai(client, messages: list):
+    return await client.chat.completions.create(**request_body(messages))
+
+def parse_response(row: dict, response):
+    """Returns (product_type, tags_list) from the GPT answer."""
+    content = response.choices[0].message.content.strip()
+
+    # Parse GPT response
+    product_type = ""
+    tags = ""
+    for line in content.splitlines():
+        if line.lower().startswith("product_type:"):
+            product_type = line.split(":", 1)[1].strip()
+        elif line.lower().startswith("tags:"):
+            tags = line.split(":", 1)[1].strip()
+
+    tags_list = [t.strip() for t in tags.split("|") if t.strip()]
+    return product_type, tags_list
+
+# === Packed requests ===
+PACK_INSTRUCTIONS = (
+    "You are a product classification assistant."
+    " For each product, based on its name and description, determine:"
+    ' 1) A concise product_type (e.g., "Bar Stool", "Wardrobe", "Throw Pillow").'
+    " 2) 5–10 relevant SEO-friendly tags related to the product_type, name, and description."
+)
+
+def pack_item(row: dict) -> dict:
+    return {"name": row["name"].strip(), "description": (row.get("description") or "").strip()}
+
+def parse_pack_item(row: dict, answer: dict):
+    """(product_type, tags_list) like parse_response, tags may come back as a list or pipe-separated."""
+    product_type = answer["product_type"].strip()
+    if not product_type:
+        raise ValueError("empty product_type")
+    tags = answer["tags"]
+    if isinstance(tags, str):
+        tags = tags.split("|")
+    return product_type, [t.strip() for t in tags if isinstance(t, str) and t.strip()]
+
+def make_packing():
+    """PACK_SIZE products per request, None when packing is off."""
+    if PACK_SIZE <= 1:
+        return None
+    return Packing(
+        instructions=PACK_INSTRUCTIONS,
+        item=pack_item,
+        fields='"product_type": "<type>", "tags": ["tag1", "tag2", "tag3", "tag4", "tag5"]',
+        parse_item=parse_pack_item,
+        max_items=PACK_SIZE,
+        token_budget=PACK_TOKEN_BUDGET,
+    )
+
+OUTPUT_FIELDS = ['filename', 'name', 'description', 'product_type', 'tags']
+
+def output_row(row: dict, output) -> dict:
+    """One line of OUTPUT_CSV, GPT tags followed by the row's custom tags."""
+    product_type, gpt_tags = output
+    custom_tags_raw = row.get("custom_tags", "")
+    custom_tags_list = [t.strip() for t in custom_tags_raw.split("|") if t.strip()]
+
+    # Combine GPT tags with custom tags
+    all_tags = gpt_tags + custom_tags_list
+    return {
+        "filename": row["filename"].strip(),
+        "name": row["name"].strip(),
+        "description": (row.get("description") or "").strip(),
+        "product_type": product_type,
+        "tags": "|".join(all_tags)
+    }
+
+def send(rows: list, write) -> dict:
+    """Clean rows with OpenAI as set up above (MODE, cache, near-duplicates), write(row, output) once per row. Returns the run stats."""
+    return catalog_pipeline.send(sys.modules[__name__], rows, write, lambda row: [row["name"], row.get("description") or ""], make_packing())
 
 # === Main Processing ===
 def main():
-    last_processed_file = None
-    if os.path.exists(PICKUP_TEXT_FILE):
-        with open(PICKUP_TEXT_FILE, "r", encoding="utf-8") as f:
-            content = f.read().strip()
-            if content:
-                last_processed_file = content
-                print(f"⏸️ Resuming after last processed filename: {last_processed_file}")
-
-    with open(INPUT_CSV, "r", encoding="utf-8", newline="") as infile, \
-         open(OUTPUT_CSV, "a", encoding="utf-8", newline="") as outfile:
-
-        reader = csv.DictReader(infile)
-        fieldnames = ['filename', 'name', 'description', 'product_type', 'tags']
-        writer = csv.DictWriter(outfile, fieldnames=fieldnames)
-        if os.stat(OUTPUT_CSV).st_size == 0:
-            writer.writeheader()
-
-        start_processing = last_processed_file is None
-
-        for row in reader:
-            filename = row["filename"].strip()
-            name = row["name"].strip()
-            description = (row.get("description") or "").strip()
-            custom_tags_raw = row.get("custom_tags", "")
-            custom_tags_list = [t.strip() for t in custom_tags_raw.split("|") if t.strip()]
-
-            # Skip until we reach resume point
-            if not start_processing:
-                if filename == last_processed_file:
-                    start_processing = True
-                continue
-
-            # Generate GPT product_type and tags
-            product_type, gpt_tags = get_tags_product_type(name, description)
-
-            # Combine GPT tags with custom tags
-            all_tags = gpt_tags + custom_tags_list
-
-            # Write row to OUTPUT_CSV
-            writer.writerow({
-                "filename": filename,
-                "name": name,
-                "description": description,
-                "product_type": product_type,
-                "tags": "|".join(all_tags)
-            })
-            outfile.flush()
-
-            # Update PICKUP_TEXT_FILE
-            with open(PICKUP_TEXT_FILE, "w", encoding="utf-8") as f:
-                f.write(filename)
-
-            print(f"✅ Processed: {filename}")
-            time.sleep(SLEEP_BETWEEN_CALLS)
-
-    print("🎉 All rows processed successfully.")
+    catalog_pipeline.run_script(sys.modules[__name__], ["name", "description", "custom_tags"], "🎉 All rows processed successfully.")
 
 if __name__ == "__main__":
     main()
@@ -1,35 +1,45 @@
 import csv
 import json
 import os
-import time
+from checkpoint_store import CheckpointStore, content_hash
+from json_bulk_writer import BulkWriter
+from catalog_pipeline import apply_tags_product_type
 
 # === Immutable variables ===
 INPUT_JSON_FOLDER = "./03_JSON_DUMPS_CLEANED_DESCRIPTIONS"
 INPUT_CSV = "tags_product_types_added.csv"
 OUTPUT_JSON_FOLDER = "./04_JSON_DUMPS_CLEANED_TAGS_PRODUCT_TYPES"
+CHECKPOINT_DB = "cleanup_checkpoints.sqlite" # files merged before are skipped unless the source JSON, product_type or tags changed since, None merges everything every time
+JSON_INDENT = 2 # indent of the written JSON files, None writes compact one-line JSON (much quicker to write on big catalogs, and smaller)
+WRITE_POOL = "thread" # "thread" serializes and writes files in a few worker threads while the next ones are read, "none" one at a time
 LOG_FILE = "json_tags_type_update_log.txt"
-SLEEP_BETWEEN_FILES = 0.1  # Adjust if needed
 # === Immutable variables ===
 
 # Ensure output folder exists
 os.makedirs(OUTPUT_JSON_FOLDER, exist_ok=True)
 
-# Load list of already processed files from log
-processed_files = set()
-if os.path.exists(LOG_FILE):
-    with open(LOG_FILE, "r", encoding="utf-8") as f:
-        processed_files = set(line.strip() for line in f if line.strip())
+# Files merged before, with fingerprints of what they were merged from
+store = CheckpointStore(CHECKPOINT_DB, "merge_tags_product_type", ["source", "product_type", "tags"]) if CHECKPOINT_DB else None
+unchanged_count = 0
+
+def written(filename: str, merged: dict, error):
+    """Called by the writer once a file is on disk (error None) or couldn't be written."""
+    if error:
+        print(f"❌ Failed to process {filename}: {error}")
+        return
+    # Log success (appended in batches)
+    writer.log(filename)
+    if store:
+        store.done(merged)
+    print(f"✅ Updated JSON: {filename}")
+
+writer = BulkWriter(OUTPUT_JSON_FOLDER, indent=JSON_INDENT, done=written, log_file=LOG_FILE, log_mode="a", pool=WRITE_POOL)
 
 # Process CSV
 with open(INPUT_CSV, newline="", encoding="utf-8") as csvfile:
     reader = csv.DictReader(csvfile)
     for row in reader:
         filename = row["filename"].strip()
-
-        # Skip already processed files
-        if filename in processed_files:
-            continue
-
         input_json_path = os.path.join(INPUT_JSON_FOLDER, filename)
         output_json_path = os.path.join(OUTPUT_JSON_FOLDER, filename)
 
@@ -38,9 +48,17 @@ with open(INPUT_CSV, newline="", encoding="utf-8") as csvfile:
             continue
 
         try:
+            with open(input_json_path, "rb") as f:
+                raw = f.read()
+
+            # Skip files whose source JSON, product_type and tags are the same as when they were last merged
+            merged = {"filename": filename, "source": content_hash(raw), "product_type": row.get("product_type", ""), "tags": row.get("tags", "")}
+            if store and store.is_finished(merged) and os.path.exists(output_json_path):
+                unchanged_count += 1
+                continue
+
             # Load JSON
-            with open(input_json_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
+            data = json.loads(raw)
 
             # Navigate to product data
             product = data.get("data", {}).get("product", {})
@@ -48,31 +66,16 @@ with open(INPUT_CSV, newline="", encoding="utf-8") as csvfile:
                 print(f"⚠️ No product data in {filename}")
                 continue
 
-            # Update product_type
-            product_type = row.get("product_type", "").strip()
-            if product_type:
-                product["product_type"] = product_type
-
-                # Update all variant_product_type fields
-                variants = product.get("product_variant", [])
-                for variant in variants:
-                    variant["variant_product_type"] = product_type
-
-            # Update tags (split by pipe)
-            tags_str = row.get("tags", "").strip()
-            if tags_str:
-                product["tags"] = [tag.strip() for tag in tags_str.split("|") if tag.strip()]
+            # Update product_type (on all variants too) and tags (split by pipe)
+            apply_tags_product_type(product, row.get("product_type", ""), row.get("tags", ""))
 
-            # Write updated JSON to output folder
-            with open(output_json_path, "w", encoding="utf-8") as f:
-                json.dump(data, f, indent=2)
-
-            # Log success
-            with open(LOG_FILE, "a", encoding="utf-8") as f:
-                f.write(filename + "\n")
-
-            print(f"✅ Updated JSON: {filename}")
-            time.sleep(SLEEP_BETWEEN_FILES)
+            # Write updated JSON to output folder (in the writer's workers, through a temp file and a rename)
+            writer.write(filename, data, merged)
 
         except Exception as e:
             print(f"❌ Failed to process {filename}: {e}")
+
+writer.close()
+if store:
+    store.close()
+print(f"Done, {unchanged_count} files unchanged since the last run were skipped.")
@@ -0,0 +1,38 @@
+# === Single pass: titles, descriptions, tags and product_type in one go (instead of 01 through 09) ===
+import catalog_pipeline
+
+# === Immutable Variables ===
+INPUT_JSON_FOLDER = "./01_RAW_JSON_DUMPS" # replace with your folder path for wherever your dumps are
+OUTPUT_JSON_FOLDER = "./04_JSON_DUMPS_CLEANED_TAGS_PRODUCT_TYPES" # finished products land here, same folder 09 writes to
+STAGES = ["title", "description", "tags"] # the chain each product goes through, in order, drop the ones you don't want (the settings of each stage are in 02, 05 and 08)
+CUSTOM_TAGS_CSV = "custom_tags.csv" # optional, filename,custom_tags with tags separated by |, i.e. product_1.json,kitchen|living room (same as the custom_tags column of 08)
+CHUNK_SIZE = 1000 # products held in memory and sent to OpenAI together, bigger chunks group more near-duplicates and fill packs better
+WRITE_STAGE_CSVS = True # also append each stage's output to its usual CSV (cleaned_name_outputs.csv...) so you can review it, False skips them
+CHECKPOINT_DB = "cleanup_checkpoints.sqlite" # every stage's answers and fingerprints of the raw products are kept here, a rerun (e.g. on a new export from the supplier) only does products that failed or changed, None does everything every time
+DRY_RUN = False # True only reports how many products each stage would send and write and roughly what that costs, nothing is sent or written
+JSON_INDENT = 2 # indent of the written JSON files, None writes them on one line
+LOG_FILE = "single_pass_update_log.txt"
+
+# === Main Script ===
+def main():
+    stats = catalog_pipeline.run(
+        INPUT_JSON_FOLDER,
+        OUTPUT_JSON_FOLDER,
+        stages=STAGES,
+        chunk_size=CHUNK_SIZE,
+        custom_tags_csv=CUSTOM_TAGS_CSV,
+        write_stage_csvs=WRITE_STAGE_CSVS,
+        checkpoint_db=CHECKPOINT_DB,
+        json_indent=JSON_INDENT,
+        log_file=LOG_FILE,
+        dry_run=DRY_RUN,
+    )
+    if DRY_RUN:
+        return
+    if stats["failed"]:
+        print(f"⚠️ {stats['failed']} products were not written, see {LOG_FILE}, fix them and run again to do just those.")
+    else:
+        print(f"🎉 All products written to {OUTPUT_JSON_FOLDER}.")
+
+if __name__ == "__main__":
+    main()
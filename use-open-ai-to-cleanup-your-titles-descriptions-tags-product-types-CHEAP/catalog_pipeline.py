@@ -0,0 +1,412 @@
+# === Single-pass catalog pipeline (01 through 09 in one go) ===
+# Run one after the other, the nine scripts read and rewrite every product JSON three times (03, 06, 09)
+# and read it three more times to export the prep CSVs (01, 04, 07), with CSVs in between. Here every
+# product JSON is read once, goes through a chain of stages (title, description, tags/product_type) in
+# memory, and the finished JSON is written once.
+#
+# The stages are the existing scripts: the prompts, clean-up helpers and settings (MODE, cache,
+# near-duplicates, packing, limits...) of 02, 05 and 08 are used as they are, through their send() and
+# output_row() functions, and the JSON changes are the same ones 03, 06 and 09 make (the apply_*
+# functions below, which those scripts use too). Products are handled CHUNK_SIZE at a time, so memory
+# stays flat and each stage still sends a whole chunk at once (packing, near-duplicates, concurrency).
+# Each stage can still write its usual output CSV for review.
+#
+# With a CHECKPOINT_DB the run is incremental: every stage keeps its answer per product together with a
+# fingerprint of the raw fields it depends on (title: name; description: name and description; tags:
+# name, description and custom tags), and the JSON write a fingerprint of the whole raw product. When
+# the supplier re-exports the dumps, a stage only asks again for products whose fields changed, uses its
+# kept answer for the rest, and only files that changed (or whose answers did) are written. dry_run
+# reports what a run would do and roughly cost without sending or writing anything.
+import csv
+import importlib.util
+import json
+import os
+import re
+import sys
+import time
+import openai_async_engine as engine
+import openai_batch
+from checkpoint_store import CheckpointStore, connect
+from json_bulk_writer import BulkWriter
+from near_duplicates import NearDuplicates
+from openai_response_cache import estimate_cost, open_cache
+from openai_telemetry import open_telemetry
+
+# === Immutable Variables ===
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# === JSON changes (shared with 03, 06 and 09) ===
+def apply_clean_name(product: dict, clean_name: str):
+    product["name"] = clean_name
+
+def apply_clean_description(product: dict, clean_description: str):
+    """Cleaned description, with the <img> tags of the old one appended when GPT dropped them. KeyError without a description."""
+    img_tags = re.findall(r'<img [^>]+>', product["description"])
+    clean_desc = clean_description.strip()
+    for img in img_tags:
+        if img not in clean_desc:
+            clean_desc += "\n" + img
+    product["description"] = clean_desc
+
+def apply_tags_product_type(product: dict, product_type: str, tags: str):
+    """product_type on the product and all its variants, tags from a pipe-separated string (empty values leave them alone)."""
+    product_type = (product_type or "").strip()
+    if product_type:
+        product["product_type"] = product_type
+        for variant in product.get("product_variant", []):
+            variant["variant_product_type"] = product_type
+    tags = (tags or "").strip()
+    if tags:
+        product["tags"] = [tag.strip() for tag in tags.split("|") if tag.strip()]
+
+# === Running 02, 05 and 08 ===
+# The three OpenAI scripts have the same settings at the top and send their rows the same way, only the
+# prompt (build_messages, request_body, call_openai, parse_response, output_row) differs. Shared settings:
+# - RESPONSE_CACHE: sqlite file every answer is kept in, one file for 02, 05 and 08, so the same request is
+#   never paid twice (see openai_response_cache.py), None turns it off
+# - CHECKPOINT_DB: every finished filename with a fingerprint of its input, one file for all three (see
+#   checkpoint_store.py), a restart skips finished rows in any order and redoes rows whose text changed since
+# - TELEMETRY_LOG: every request (tokens, latency, tries, outcome) is appended here, one file for all three,
+#   python3 openai_telemetry.py report sums it up, None turns it off
+# - OUTPUT_ORDER: "ordered" writes rows in input order, "keyed" writes rows as soon as they finish, both
+#   resume from CHECKPOINT_DB
+def send(script, rows: list, write, near_duplicate_fields, packing=None) -> dict:
+    """
+    Send rows to OpenAI with the settings and prompt of script (02, 05 or 08: MODE, cache, near-duplicates,
+    limits...), write(row, output) once per row. Returns the run stats.
+    near_duplicate_fields(row) -> the texts near-duplicates are looked for in, packing is used in live mode only.
+    """
+    cache = open_cache(script.RESPONSE_CACHE, script.request_body, script.CACHE_TTL_DAYS, script.CACHE_MAX_MB)
+    telemetry = open_telemetry(script.TELEMETRY_LOG, script.CHECKPOINT_STAGE, script.OPENAI_ENGINE, script.MAX_OUTPUT_TOKENS,
+                               script.MODE == "batch", script.TOKEN_BUDGET, script.DOLLAR_BUDGET)
+    near_duplicates = None
+    if script.NEAR_DUPLICATES:
+        near_duplicates = NearDuplicates(near_duplicate_fields, script.NEAR_DUPLICATE_THRESHOLD, script.NEAR_DUPLICATE_LOG)
+    if script.MODE == "batch":
+        stats = openai_batch.run(
+            rows, script.build_messages, script.request_body, script.parse_response, write,
+            make_client=lambda: openai_batch.make_client(script.OPENAI_API_KEY, script.OPENAI_ORG_ID, script.OPENAI_BASE_URL),
+            state_file=script.BATCH_STATE_FILE,
+            dead_letter_csv=script.DEAD_LETTER_CSV,
+            poll_seconds=script.BATCH_POLL_SECONDS,
+            max_wait=script.BATCH_MAX_WAIT_HOURS * 3600,
+            cache=cache,
+            near_duplicates=near_duplicates,
+            telemetry=telemetry,
+        )
+    else:
+        stats = engine.run(
+            rows, script.build_messages, script.call_openai, script.parse_response, write,
+            make_client=lambda: engine.make_client(script.OPENAI_API_KEY, script.OPENAI_ORG_ID, script.OPENAI_BASE_URL),
+            concurrency=script.CONCURRENCY,
+            requests_per_minute=script.REQUESTS_PER_MINUTE,
+            tokens_per_minute=script.TOKENS_PER_MINUTE,
+            max_output_tokens=script.MAX_OUTPUT_TOKENS,
+            ordered=script.OUTPUT_ORDER != "keyed",
+            dead_letter_csv=script.DEAD_LETTER_CSV,
+            packing=packing,
+            cache=cache,
+            near_duplicates=near_duplicates,
+            telemetry=telemetry,
+        )
+    if cache:
+        cache.close()
+    if telemetry:
+        telemetry.close()
+    return stats
+
+def run_script(script, depends_on: list, finished: str, show_output: bool = False):
+    """
+    main() of 02, 05 and 08: the rows of script.INPUT_CSV that aren't done yet through script.send(), appended to
+    OUTPUT_CSV with script.output_row(). depends_on: the columns fingerprinted in CHECKPOINT_DB, finished is
+    printed when no row is left over, show_output prints every answer next to its filename.
+    """
+    store = CheckpointStore(script.CHECKPOINT_DB, script.CHECKPOINT_STAGE, depends_on)
+    with open(script.INPUT_CSV, "r", encoding="utf-8", newline="") as infile:
+        all_rows = list(csv.DictReader(infile))
+    # Drop rows finished by an earlier run, in any order, unless their input changed since
+    store.reconcile(script.OUTPUT_CSV)
+    rows = store.pending(all_rows)
+    if script.DRY_RUN:
+        local, remote, split = [], rows, ""
+        if hasattr(script, "prefilter"):
+            local, remote = script.prefilter(rows, log=False)
+            split = f", {len(local)} locally and {len(remote)} with OpenAI"
+        tokens, cost = estimate_cost(remote, script.build_messages, script.OPENAI_ENGINE, script.MAX_OUTPUT_TOKENS, batch=script.MODE == "batch")
+        print(f"🔎 Dry run: would process {len(rows)} of {len(all_rows)} rows{split}, ~{tokens} tokens (~${cost:.2f}) at most, before the cache, near-duplicates and packing save anything")
+        store.close()
+        return
+
+    with open(script.OUTPUT_CSV, "a", encoding="utf-8", newline="") as outfile:
+        writer = csv.DictWriter(outfile, fieldnames=script.OUTPUT_FIELDS)
+        if os.stat(script.OUTPUT_CSV).st_size == 0:
+            writer.writeheader()
+
+        def write(row: dict, output):
+            writer.writerow(script.output_row(row, output))
+            outfile.flush()
+            store.done(row)
+            print(f"✅ Processed: {row['filename'].strip()}" + (f" -> {output}" if show_output else ""))
+
+        stats = script.send(rows, write)
+    store.close()
+
+    if stats.get("pending"):
+        print(f"⏸️ Not done yet, run the script again to send the {stats['pending']} rows without an answer.")
+    elif stats["dead_letter"]:
+        print(f"⚠️ Finished, but {stats['dead_letter']} rows are waiting in {script.DEAD_LETTER_CSV}.")
+    else:
+        print(finished)
+
+# === Stages ===
+class Stage:
+    """
+    One step of the chain, backed by one of the OpenAI scripts.
+    - depends_on: the raw product fields its answer depends on, through the stages before it too
+    - row(filename, product, custom_tags) -> the prep CSV row the script expects
+    - apply(product, output_row) -> makes the script's output (one OUTPUT_CSV line) part of the product
+    """
+
+    def __init__(self, name: str, script: str, depends_on: list, row, apply):
+        self.name = name
+        self.script = script
+        self.depends_on = depends_on
+        self.row = row
+        self.apply = apply
+        self.module = None
+
+    def load(self):
+        """Import the script (its file name starts with a digit, so not with a plain import)."""
+        if self.module is None:
+            spec = importlib.util.spec_from_file_location(f"stage_{self.name}", os.path.join(HERE, self.script))
+            self.module = importlib.util.module_from_spec(spec)
+            # Registered like an imported module, its send() and main() look themselves up in sys.modules
+            sys.modules[spec.name] = self.module
+            spec.loader.exec_module(self.module)
+        return self.module
+
+STAGES = {
+    "title": Stage(
+        "title", "02-clean_name_output_to_new_csv-V4.py", ["name"],
+        lambda filename, product, custom_tags: {"filename": filename, "name": product.get("name", "")},
+        lambda product, out: apply_clean_name(product, out["clean_name"]),
+    ),
+    "description": Stage(
+        "description", "05-clean_descriptions_output_to_new_csv-V6.py", ["name", "description"],
+        lambda filename, product, custom_tags: {"filename": filename, "name": product.get("name", ""), "description": product.get("description", "")},
+        lambda product, out: apply_clean_description(product, out["clean_description"]),
+    ),
+    "tags": Stage(
+        "tags", "08-add-tags-and-type-output-to-new-CSV.py", ["name", "description", "custom_tags"],
+        lambda filename, product, custom_tags: {"filename": filename, "name": product.get("name", ""), "description": product.get("description", ""), "custom_tags": custom_tags},
+        lambda product, out: apply_tags_product_type(product, out["product_type"], out["tags"]),
+    ),
+}
+
+# === Helper Functions ===
+def load_custom_tags(path: str) -> dict:
+    """filename -> custom tags (pipe-separated) from a CSV with filename and custom_tags columns, {} without one."""
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        return {row["filename"].strip(): row.get("custom_tags") or "" for row in csv.DictReader(f)}
+
+def json_files(folder: str) -> list:
+    return sorted(entry.name for entry in os.scandir(folder) if entry.is_file() and entry.name.lower().endswith(".json"))
+
+def chunks(items: list, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def product_of(data: dict):
+    product = data.get("data", {}).get("product") if isinstance(data, dict) else None
+    return product if isinstance(product, dict) else None
+
+def source_row(filename: str, product: dict, custom_tags: str) -> dict:
+    """The raw fields of a product the manifest fingerprints, taken before any stage changes it."""
+    return {
+        "filename": filename,
+        "name": product.get("name", ""),
+        "description": product.get("description", ""),
+        "custom_tags": custom_tags,
+        "product": json.dumps(product, ensure_ascii=False, sort_keys=True),  # any field, variants included
+    }
+
+class StageCsv:
+    """The stage script's OUTPUT_CSV, appended to like the script does, None when stage CSVs are off."""
+
+    def __init__(self, module, enabled: bool):
+        self.module = module
+        self.file = None
+        if enabled:
+            self.file = open(module.OUTPUT_CSV, "a", encoding="utf-8", newline="")
+            self.writer = csv.DictWriter(self.file, fieldnames=module.OUTPUT_FIELDS)
+            if os.stat(module.OUTPUT_CSV).st_size == 0:
+                self.writer.writeheader()
+
+    def write(self, out: dict):
+        if self.file:
+            self.writer.writerow(out)
+
+    def close(self):
+        if self.file:
+            self.file.close()
+
+# === Pipeline ===
+def run(input_folder: str, output_folder: str, *, stages: list, chunk_size: int = 1000, custom_tags_csv: str = None,
+        write_stage_csvs: bool = True, checkpoint_db: str = None, json_indent: int = 2, log_file: str = None,
+        dry_run: bool = False):
+    """
+    Read every product JSON in input_folder once, run it through stages (names from STAGES, in order) and
+    write the finished JSON to output_folder once. Products a stage couldn't do (dead-lettered) are not
+    written; a rerun picks them up. With checkpoint_db only what changed since the last run is done.
+    Returns stats: products, written, unchanged, failed, reads, writes, asked and reused per stage, seconds.
+    """
+    start = time.perf_counter()
+    chain = [STAGES[name] for name in stages]
+    modules = [stage.load() for stage in chain]
+    stage_csvs = [StageCsv(module, write_stage_csvs and not dry_run) for module in modules]
+    custom_tags = load_custom_tags(custom_tags_csv)
+    db = connect(checkpoint_db) if checkpoint_db else None
+    stage_stores = [CheckpointStore(checkpoint_db, f"single_pass:{stage.name}", stage.depends_on, db=db) if db else None for stage in chain]
+    json_store = CheckpointStore(checkpoint_db, "single_pass:json:" + ",".join(stages), ["product", "custom_tags"], db=db) if db else None
+    os.makedirs(output_folder, exist_ok=True)
+    filenames = json_files(input_folder)
+    stats = {"products": len(filenames), "written": 0, "unchanged": 0, "failed": 0, "reads": 0, "writes": 0, "tokens": 0, "dollars": 0.0}
+    stats.update({f"asked_{stage.name}": 0 for stage in chain})
+    stats.update({f"reused_{stage.name}": 0 for stage in chain})
+    log_entries = []
+
+    def written(filename: str, source: dict, error):
+        if error:
+            log_entries.append(f"{filename}: ERROR writing JSON - {error}")
+            stats["failed"] += 1
+            return
+        stats["writes"] += 1
+        stats["written"] += 1
+        log_entries.append(f"{filename}: UPDATED successfully")
+        if json_store:
+            json_store.done(source)
+    # Files are written in worker threads through a temp file and a rename, each chunk is flushed before the next
+    writer = BulkWriter(output_folder, indent=json_indent, done=written)
+    print(f"🧵 {len(filenames)} products, stages: {' → '.join(stages)}, {chunk_size} at a time{', dry run' if dry_run else ''}")
+
+    try:
+        for chunk in chunks(filenames, chunk_size):
+            products = {}
+            for filename in chunk:
+                try:
+                    with open(os.path.join(input_folder, filename), "r", encoding="utf-8") as f:
+                        data = json.load(f)
+                except Exception as e:
+                    log_entries.append(f"{filename}: ERROR reading JSON - {e}")
+                    stats["failed"] += 1
+                    continue
+                stats["reads"] += 1
+                product = product_of(data)
+                if product is None:
+                    log_entries.append(f"{filename}: ERROR - 'data.product' path not found")
+                    stats["failed"] += 1
+                    continue
+                products[filename] = (data, product, source_row(filename, product, custom_tags.get(filename, "")))
+
+            # Every stage gets the products as the previous stage left them, like 04 and 07 exported them
+            alive = list(products)
+            ran = set()
+            for stage, module, stage_csv, store in zip(chain, modules, stage_csvs, stage_stores):
+                if not alive:
+                    break
+                outputs = {}
+                todo = alive
+                if store:
+                    changed = {source["filename"] for source in store.split([products[filename][2] for filename in alive])[0]}
+                    todo = []
+                    for filename in alive:
+                        kept = None if filename in changed else store.output_of(filename)
+                        if kept is None:
+                            todo.append(filename)
+                        else:
+                            outputs[filename] = kept
+                    stats[f"reused_{stage.name}"] += len(outputs)
+                rows = [stage.row(filename, products[filename][1], custom_tags.get(filename, "")) for filename in todo]
+                stats[f"asked_{stage.name}"] += len(rows)
+
+                if dry_run:
+                    if hasattr(module, "prefilter"):
+                        # Rows 02's local pre-filter cleans don't cost anything
+                        rows = module.prefilter(rows, log=False)[1]
+                    # Later stages would see this stage's answer, the raw text is close enough for an estimate
+                    tokens, cost = estimate_cost(rows, module.build_messages, module.OPENAI_ENGINE, module.MAX_OUTPUT_TOKENS, batch=module.MODE == "batch")
+                    stats["tokens"] += tokens
+                    stats["dollars"] += cost
+                    ran.update(todo)
+                    continue
+
+                def write(row: dict, output):
+                    filename = row["filename"].strip()
+                    out = module.output_row(row, output)
+                    outputs[filename] = out
+                    stage_csv.write(out)
+                    if store:
+                        store.done(products[filename][2], out)
+                sent = {}
+                if rows:
+                    print(f"▶️ {stage.name}: asking for {len(rows)} products, {len(alive) - len(rows)} unchanged")
+                    sent = module.send(rows, write)
+                ran.update(todo)
+
+                for filename in alive:
+                    if filename not in outputs:
+                        # Rows over the stage's budget (or in a batch that isn't done) aren't in the dead-letter CSV
+                        left = f" or left for the next run ({sent['pending']} over budget or waiting on a batch)" if sent.get("pending") else ""
+                        log_entries.append(f"{filename}: FAILED{left} in the {stage.name} stage, see {module.DEAD_LETTER_CSV}")
+                        stats["failed"] += 1
+                        continue
+                    try:
+                        stage.apply(products[filename][1], outputs[filename])
+                    except KeyError as e:
+                        log_entries.append(f"{filename}: ERROR - {e} not found in the {stage.name} stage")
+                        stats["failed"] += 1
+                        del outputs[filename]
+                alive = [filename for filename in alive if filename in outputs]
+
+            # Only files whose raw product, custom tags or answers changed are written again
+            if json_store:
+                changed = {source["filename"] for source in json_store.split([products[filename][2] for filename in alive])[0]}
+                unchanged = [
+                    filename for filename in alive
+                    if filename not in changed and filename not in ran and os.path.exists(os.path.join(output_folder, filename))
+                ]
+                stats["unchanged"] += len(unchanged)
+                alive = [filename for filename in alive if filename not in set(unchanged)]
+            if dry_run:
+                stats["written"] += len(alive)
+                continue
+
+            for filename in alive:
+                data, _, source = products[filename]
+                writer.write(filename, data, source)
+            writer.flush()
+            print(f"✅ {stats['written']} written, {stats['unchanged']} unchanged, {stats['failed']} failed of {stats['products']}")
+    finally:
+        writer.close()
+        for stage_csv in stage_csvs:
+            stage_csv.close()
+        for store in stage_stores + [json_store]:
+            if store:
+                store.close()
+        if db:
+            db.close()
+
+    stats["seconds"] = time.perf_counter() - start
+    if dry_run:
+        asked = ", ".join(f"{stage.name} {stats[f'asked_{stage.name}']} of {stats['products']}" for stage in chain)
+        print(f"🔎 Dry run: would process {asked}, and write {stats['written']} of {stats['products']} JSON files")
+        print(f"🔎 ~{stats['tokens']} tokens (~${stats['dollars']:.2f}) at most, before the cache, near-duplicates and packing save anything")
+        return stats
+    if log_file:
+        with open(log_file, "w", encoding="utf-8") as f:
+            for entry in log_entries:
+                f.write(entry + "\n")
+    print(f"📊 {stats['reads']} JSON reads and {stats['writes']} writes for {stats['products']} products in {stats['seconds']:.1f}s")
+    return stats
@@ -0,0 +1,148 @@
+# === Checkpoint store for the OpenAI cleanup scripts (02, 05, 08) ===
+# Replaces the PICKUP_TEXT_FILE: instead of remembering only the last filename written (which needs
+# strict input order, breaks when the prep CSV is exported in another order, and rewrites a file after
+# every single row), every finished filename is recorded in a SQLite table together with a fingerprint
+# of the input text it was made from. One file (CHECKPOINT_DB) holds the checkpoints of all three
+# scripts, each under its own stage name.
+#
+# - rows can finish in any order and several runs can share the file
+# - a restart skips finished rows with one dict lookup per row, in whatever order the CSV is in
+# - a finished row whose name/description changed since (the fingerprint differs) is stale and done again
+# - rows already in the output CSV are marked finished on start, so nothing is lost if a run is
+#   killed between writing a row and committing its checkpoint, and output from before this existed counts
+# - a stage can keep its output next to the fingerprint, so an unchanged row's answer can be used again
+#   without asking for it (catalog_pipeline.py does, to only redo products the supplier changed)
+import csv
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+COMMIT_EVERY = 100 # checkpoints are committed in groups, the output CSV covers the ones in between on a crash
+COMMIT_SECONDS = 2.0 # ...or at least this often
+
+def content_hash(raw: bytes) -> str:
+    """Fingerprint of a whole file's bytes, for stages whose input is a JSON file rather than CSV text."""
+    return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+def connect(path: str) -> sqlite3.Connection:
+    """A connection to the checkpoint file, to share between the stores of one run (one writer per process)."""
+    db = sqlite3.connect(path, timeout=30)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    return db
+
+class CheckpointStore:
+    """
+    Finished rows of one stage, by key (filename).
+    fields are the input columns a row's answer depends on, they make up its fingerprint.
+    Stores of several stages in one process share a connection (db from connect()), separate connections
+    would lock each other out while their checkpoints wait to be committed.
+    """
+
+    def __init__(self, path: str, stage: str, fields: list, key: str = "filename", db: sqlite3.Connection = None):
+        self.stage = stage
+        self.fields = fields
+        self.key = key
+        self.owns_db = db is None
+        self.db = db or connect(path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS checkpoints ("
+            " stage TEXT, key TEXT, fingerprint TEXT, finished_at REAL, output TEXT,"
+            " PRIMARY KEY (stage, key))"
+        )
+        # Files from before outputs were kept
+        if "output" not in [column[1] for column in self.db.execute("PRAGMA table_info(checkpoints)")]:
+            self.db.execute("ALTER TABLE checkpoints ADD COLUMN output TEXT")
+        self.db.commit()
+        self.finished = dict(self.db.execute("SELECT key, fingerprint FROM checkpoints WHERE stage = ?", (stage,)))
+        self.uncommitted = 0
+        self.last_commit = time.monotonic()
+
+    def fingerprint(self, row: dict):
+        """Hash of the row's input fields, None when the row doesn't have all of them (e.g. an output CSV row)."""
+        if any(field not in row for field in self.fields):
+            return None
+        text = json.dumps([(row[field] or "").strip() for field in self.fields], ensure_ascii=False)
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+    def reconcile(self, output_csv: str):
+        """
+        Mark rows that are in the output CSV but not checkpointed (older runs, or a crash before the commit) as finished,
+        and catch up finished rows that were redone but crashed before their new fingerprint was committed.
+        """
+        if not os.path.exists(output_csv) or os.stat(output_csv).st_size == 0:
+            return
+        written = {}
+        with open(output_csv, "r", encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                key = (row.get(self.key) or "").strip()
+                if key:
+                    # The output CSV repeats the input columns, so the fingerprint is the one of the input it was made
+                    # from; a row redone after its text changed is further down, and the last one counts
+                    written[key] = self.fingerprint(row)
+        written = {
+            key: fingerprint for key, fingerprint in written.items()
+            if key not in self.finished or (fingerprint is not None and fingerprint != self.finished[key])
+        }
+        for key, fingerprint in written.items():
+            self._record(key, fingerprint)
+        if written:
+            self.commit()
+            print(f"📌 {len(written)} rows already in {output_csv} marked as finished")
+
+    def split(self, rows: list):
+        """(rows to do, how many of those were finished but changed since), without printing anything."""
+        todo, stale = [], 0
+        for row in rows:
+            key = row[self.key].strip()
+            if key not in self.finished:
+                todo.append(row)
+                continue
+            known = self.finished[key]
+            if known is not None and known != self.fingerprint(row):
+                stale += 1
+                todo.append(row)
+        return todo, stale
+
+    def pending(self, rows: list) -> list:
+        """Rows that aren't finished, or whose input changed since they were."""
+        todo, stale = self.split(rows)
+        skipped = len(rows) - len(todo)
+        if skipped or stale:
+            print(f"⏸️ Resuming: {skipped} rows already finished, {stale} finished rows changed since and are done again, {len(todo) - stale} new")
+        return todo
+
+    def is_finished(self, row: dict) -> bool:
+        """Finished, and with the same input as now."""
+        return not self.split([row])[0]
+
+    def output_of(self, key: str):
+        """The output kept by done() for a finished row, None when there is none."""
+        found = self.db.execute("SELECT output FROM checkpoints WHERE stage = ? AND key = ?", (self.stage, key.strip())).fetchone()
+        return json.loads(found[0]) if found and found[0] is not None else None
+
+    def done(self, row: dict, output=None):
+        """Mark the row finished, keeping output (anything json can store) when given."""
+        self._record(row[self.key].strip(), self.fingerprint(row), output)
+        self.uncommitted += 1
+        if self.uncommitted >= COMMIT_EVERY or time.monotonic() - self.last_commit >= COMMIT_SECONDS:
+            self.commit()
+
+    def _record(self, key: str, fingerprint, output=None):
+        self.db.execute(
+            "INSERT OR REPLACE INTO checkpoints (stage, key, fingerprint, finished_at, output) VALUES (?, ?, ?, ?, ?)",
+            (self.stage, key, fingerprint, time.time(), None if output is None else json.dumps(output, ensure_ascii=False)),
+        )
+        self.finished[key] = fingerprint
+
+    def commit(self):
+        self.db.commit()
+        self.uncommitted = 0
+        self.last_commit = time.monotonic()
+
+    def close(self):
+        self.commit()
+        if self.owns_db:
+            self.db.close()
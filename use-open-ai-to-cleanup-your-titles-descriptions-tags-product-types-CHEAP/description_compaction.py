@@ -0,0 +1,146 @@
+# === Description compaction for 05 (fewer prompt tokens per description) ===
+# Supplier descriptions carry a lot GPT doesn't need to read: full <img> tags with long CDN URLs, style and
+# class attributes on every tag, <style>/<script> blocks, comments and &nbsp; runs. 06 puts the original
+# <img> tags back anyway, so before a description is sent:
+# - every <img ...> becomes a short placeholder ([IMG1], [IMG2]...) that is swapped back for the original
+#   tag in the answer (appended at the end when GPT dropped it)
+# - attributes are stripped from the other tags (href of links is kept), <style>/<script> and comments go
+# - when DESCRIPTION_TOKEN_BUDGET is set (it's 0, no limit, by default), what's left is cut at the last
+#   paragraph / list item / line break that fits it, and 05 lists the cut rows in its TRIMMED_LOG
+#
+# Tokens are counted with tiktoken when it's installed (pip install tiktoken), with the engine's rough
+# CHARS_PER_TOKEN estimate otherwise.
+#
+# Run it directly for before/after prompt token counts over a dump folder:
+#   python3 description_compaction.py --report 01_RAW_JSON_DUMPS
+import argparse
+import importlib.util
+import os
+import re
+from openai_async_engine import CHARS_PER_TOKEN
+from json_csv_export import iter_rows
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# === Immutable Variables ===
+_IMG = re.compile(r"<img\b[^>]*>", re.I)
+_DROPPED = re.compile(r"<(style|script)\b[^>]*>.*?</\1\s*>|<!--.*?-->", re.I | re.S)
+_TAG_WITH_ATTRIBUTES = re.compile(r"<([a-zA-Z][a-zA-Z0-9]*)\s+[^>]*?(/?)>")
+_HREF = re.compile(r"""\bhref\s*=\s*("[^"]*"|'[^']*'|[^\s>]+)""", re.I)
+_NBSP = re.compile(r"(?:&nbsp;|\xa0)+", re.I)
+_SPACES = re.compile(r"\s{2,}")
+_BLOCK_END = re.compile(r"(?<=</p>)|(?<=</li>)|(?<=</ul>)|(?<=</ol>)|(?<=</div>)|(?<=<br>)|(?<=<br/>)", re.I)
+_PLACEHOLDER = re.compile(r"\[IMG(\d+)\]")
+
+_encodings = {}
+
+# === Helper Functions ===
+def count_tokens(text: str, model: str = "gpt-3.5-turbo") -> int:
+    """Tokens of text for model, with tiktoken when it's installed."""
+    if tiktoken is None:
+        return len(text) // CHARS_PER_TOKEN
+    if model not in _encodings:
+        try:
+            _encodings[model] = tiktoken.encoding_for_model(model)
+        except KeyError:
+            _encodings[model] = tiktoken.get_encoding("cl100k_base")
+    return len(_encodings[model].encode(text, disallowed_special=()))
+
+def strip_attributes(match) -> str:
+    tag, self_closing = match.group(1), match.group(2)
+    href = _HREF.search(match.group(0)) if tag.lower() == "a" else None
+    return f"<{tag}{' href=' + href.group(1) if href else ''}{self_closing}>"
+
+def trim_to_budget(text: str, token_budget: int, model: str) -> str:
+    """text cut at the last block (paragraph, list item, line break) that keeps it within token_budget, 0 for no limit."""
+    if not token_budget or count_tokens(text, model) <= token_budget:
+        return text
+    kept, used = [], 0
+    for block in _BLOCK_END.split(text):
+        tokens = count_tokens(block, model)
+        if used + tokens > token_budget:
+            if not kept:
+                # The first block is over the budget on its own, cut it between words
+                words = block.split()
+                low, high = 0, len(words)
+                while low < high:
+                    middle = (low + high + 1) // 2
+                    if count_tokens(" ".join(words[:middle]), model) <= token_budget:
+                        low = middle
+                    else:
+                        high = middle - 1
+                kept.append(" ".join(words[:low]))
+            break
+        kept.append(block)
+        used += tokens
+    return "".join(kept).strip()
+
+# === Compaction ===
+def compact(html: str, token_budget: int = 0, model: str = "gpt-3.5-turbo"):
+    """(compacted text to send, [original <img> tags] for restore()), images cut off by the budget are still put back by restore()."""
+    images = []
+
+    def placeholder(match):
+        images.append(match.group(0))
+        return f"[IMG{len(images)}]"
+    text = _IMG.sub(placeholder, html or "")
+    text = _DROPPED.sub("", text)
+    text = _TAG_WITH_ATTRIBUTES.sub(strip_attributes, text)
+    text = _SPACES.sub(" ", _NBSP.sub(" ", text)).strip()
+    return trim_to_budget(text, token_budget, model), images
+
+def restore(text: str, images: list) -> str:
+    """Placeholders in GPT's answer back to the original <img> tags, images it left out appended at the end."""
+    used = set()
+
+    def original(match):
+        number = int(match.group(1))
+        if not 1 <= number <= len(images):
+            return ""
+        used.add(number)
+        return images[number - 1]
+    text = _PLACEHOLDER.sub(original, text)
+    for number, img in enumerate(images, 1):
+        if number not in used and img not in text:
+            text += "\n" + img
+    return text
+
+# === Report ===
+def report(folder: str):
+    """Prompt tokens of 05's requests for every description in folder, as before and with compaction."""
+    spec = importlib.util.spec_from_file_location("descriptions", os.path.join(os.path.dirname(os.path.abspath(__file__)), "05-clean_descriptions_output_to_new_csv-V6.py"))
+    descriptions = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(descriptions)
+    totals = {"before": 0, "after": 0, "rows": 0, "trimmed": 0, "images": 0}
+    for filename, values, error in iter_rows(folder, ["name", "description"]):
+        if error:
+            continue
+        row = {"filename": filename, "name": values[0] or "", "description": values[1] or ""}
+        descriptions.COMPACT_DESCRIPTIONS = False
+        before = sum(count_tokens(message["content"], descriptions.OPENAI_ENGINE) for message in descriptions.build_messages(row))
+        descriptions.COMPACT_DESCRIPTIONS = True
+        after = sum(count_tokens(message["content"], descriptions.OPENAI_ENGINE) for message in descriptions.build_messages(row))
+        cleaned = descriptions.pre_clean_description(row["description"].strip())
+        text, images = compact(cleaned)
+        totals["trimmed"] += text != compact(cleaned, descriptions.DESCRIPTION_TOKEN_BUDGET, descriptions.OPENAI_ENGINE)[0]
+        totals["images"] += len(images)
+        totals["before"] += before
+        totals["after"] += after
+        totals["rows"] += 1
+    if not totals["rows"]:
+        print(f"No descriptions found in {folder}")
+        return
+    saved = totals["before"] - totals["after"]
+    print(f"🔢 {totals['rows']} descriptions in {folder}, tokens counted with {'tiktoken' if tiktoken else f'{CHARS_PER_TOKEN} chars per token (pip install tiktoken for exact counts)'}")
+    print(f"   before: {totals['before']} prompt tokens ({totals['before'] / totals['rows']:.0f} per description)")
+    print(f"   after:  {totals['after']} prompt tokens ({totals['after'] / totals['rows']:.0f} per description), {saved} fewer ({saved / max(totals['before'], 1):.0%})")
+    print(f"   {totals['images']} <img> tags sent as placeholders, {totals['trimmed']} descriptions cut to DESCRIPTION_TOKEN_BUDGET ({descriptions.DESCRIPTION_TOKEN_BUDGET})")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prompt tokens of 05 with and without description compaction")
+    parser.add_argument("--report", default="01_RAW_JSON_DUMPS", help="folder of product JSON dumps")
+    args = parser.parse_args()
+    report(args.report)
@@ -0,0 +1,208 @@
+# === Shared JSON writer for 03, 06, 09 and 10 ===
+# The merge scripts used to json.dump(indent=4) every product straight over its destination file, one after
+# the other (09 also slept SLEEP_BETWEEN_FILES and re-opened its log for every file). Here:
+# - products are serialized and written in a pool of workers (threads, or processes with pool = "process"),
+#   with a bounded number in flight, and the results are handed back in submission order
+# - each file is written to a temp file next to it and renamed over the destination, so a crash or a full
+#   disk never leaves a half-written product JSON behind
+# - indent=None writes compact one-line JSON, by far the cheapest to produce (and smaller on disk)
+# - log lines are appended LOG_EVERY at a time instead of one open/write/close per file
+# orjson is used for serializing when it's installed and the indent is None or 2, the json module otherwise.
+#
+# Run it directly to time it on synthetic products:
+#   python3 json_bulk_writer.py --bench 10000
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# === Immutable Variables ===
+IN_FLIGHT_PER_WORKER = 16 # files queued per worker, the bound on products held in memory while they wait
+THREAD_WORKERS = 4 # threads overlap the disk writes, serializing holds the GIL so more don't help
+LOG_EVERY = 500 # log lines buffered before they're appended to the log file
+FSYNC = False # True also waits for every file to reach the disk before it's renamed, safest on power loss but a lot slower
+
+# mkstemp creates files as 0600, new files get what open() would have given them instead (read once, os.umask can only be read by setting it)
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+# === Helper Functions ===
+def dumps(data, indent=None) -> bytes:
+    """UTF-8 JSON of data (non-ASCII characters as they are), compact when indent is None."""
+    if orjson and indent in (None, 2):
+        try:
+            return orjson.dumps(data, option=orjson.OPT_INDENT_2 if indent else 0)
+        except TypeError:  # e.g. integers over 64 bits, which json handles
+            pass
+    return json.dumps(data, ensure_ascii=False, indent=indent).encode("utf-8")
+
+def write_atomic(path: str, content: bytes):
+    """Write content to path through a temp file in the same folder and a rename, so path is always whole."""
+    folder, name = os.path.split(path)
+    fd, tmp_path = tempfile.mkstemp(dir=folder or ".", prefix=f".{name}.", suffix=".tmp")
+    try:
+        # Same permissions as the file it replaces, or as a new file written with open() would get
+        try:
+            mode = os.stat(path).st_mode & 0o7777
+        except FileNotFoundError:
+            mode = 0o666 & ~_UMASK
+        if hasattr(os, "fchmod"):
+            os.fchmod(fd, mode)
+        else:  # Windows
+            os.chmod(tmp_path, mode)
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+            if FSYNC:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def write_json(path: str, data, indent) -> None:
+    """Serialize and write one file, runs in a worker."""
+    write_atomic(path, dumps(data, indent))
+
+# === Writer ===
+class BulkWriter:
+    """
+    Writes product JSON files into folder. done(filename, context, error) is called in the calling thread once
+    per file, in the order they were given to write(), error None when the file was written.
+    log_file gets the lines given to log(), "w" starts it over (like 03 and 06 did), "a" appends (like 09).
+    pool is "thread", "process" or "none"; a single-CPU machine uses threads instead of processes. "process"
+    needs the calling script's code under if __name__ == "__main__" on Windows and macOS.
+    """
+
+    def __init__(self, folder: str, indent=None, done=None, log_file: str = None, log_mode: str = "a",
+                 pool: str = "thread", workers: int = None):
+        self.folder = folder
+        self.indent = indent
+        self.done = done
+        self.log_file = log_file
+        self.log_lines = []
+        if log_file and log_mode == "w":
+            open(log_file, "w", encoding="utf-8").close()
+        os.makedirs(folder, exist_ok=True)
+        if pool == "process" and (workers or os.cpu_count() or 1) <= 1:
+            pool = "thread"
+        workers = workers or ((os.cpu_count() or 1) if pool == "process" else THREAD_WORKERS)
+        self.executor = None if pool == "none" else (ProcessPoolExecutor if pool == "process" else ThreadPoolExecutor)(max_workers=workers)
+        self.max_in_flight = workers * IN_FLIGHT_PER_WORKER
+        self.in_flight = deque()
+        self.stats = {"written": 0, "failed": 0}
+
+    def write(self, filename: str, data, context=None):
+        """Queue data to be written as folder/filename, context is passed on to done()."""
+        path = os.path.join(self.folder, filename)
+        if self.executor is None:
+            try:
+                write_json(path, data, self.indent)
+                self._finish(filename, context, None)
+            except Exception as e:
+                self._finish(filename, context, e)
+            return
+        self.in_flight.append((filename, context, self.executor.submit(write_json, path, data, self.indent)))
+        if len(self.in_flight) >= self.max_in_flight:
+            self._collect()
+
+    def _collect(self):
+        filename, context, future = self.in_flight.popleft()
+        try:
+            future.result()
+            self._finish(filename, context, None)
+        except Exception as e:
+            self._finish(filename, context, e)
+
+    def _finish(self, filename: str, context, error):
+        self.stats["failed" if error else "written"] += 1
+        if self.done:
+            self.done(filename, context, error)
+
+    def flush(self):
+        """Wait for every queued file and append the buffered log lines."""
+        while self.in_flight:
+            self._collect()
+        self._append_log()
+
+    def log(self, entry: str):
+        self.log_lines.append(entry)
+        if len(self.log_lines) >= LOG_EVERY:
+            self._append_log()
+
+    def _append_log(self):
+        if self.log_file and self.log_lines:
+            with open(self.log_file, "a", encoding="utf-8") as f:
+                f.write("\n".join(self.log_lines) + "\n")
+        self.log_lines.clear()
+
+    def close(self) -> dict:
+        """flush(), stop the workers and return stats: written, failed."""
+        try:
+            self.flush()
+        finally:
+            if self.executor:
+                self.executor.shutdown()
+        return self.stats
+
+# === Benchmark ===
+def synthetic_product(number: int) -> dict:
+    description = "<p>" + "Soft brushed microfiber, machine washable, fade resistant. " * 35 + "</p>"
+    return {"data": {"product": {
+        "id": number,
+        "name": f"Synthetic Comforter Set {number} Queen Grey",
+        "description": description,
+        "product_type": "Comforter Sets",
+        "tags": ["bedding", "comforter", "queen"],
+        "product_variant": [{"id": number * 10 + v, "variant_product_type": "Comforter Sets", "price": "39.99"} for v in range(4)],
+    }}}
+
+def write_like_before(folder: str, products: list, log_file: str) -> float:
+    """The old loop of 09: json.dump with an indent straight over the file, log re-opened for every file (without the sleep)."""
+    start = time.perf_counter()
+    for filename, data in products:
+        with open(os.path.join(folder, filename), "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=4, ensure_ascii=False)
+        with open(log_file, "a", encoding="utf-8") as f:
+            f.write(filename + "\n")
+    return time.perf_counter() - start
+
+def benchmark(count: int):
+    products = [(f"product_{number:07d}.json", synthetic_product(number)) for number in range(count)]
+    print(f"CPUs: {os.cpu_count()}, serializer: {'orjson' if orjson else 'json'}, {count} products")
+    timings = {}
+    for name, indent, pool in (("before (indent=4)", None, None), ("indent=4", 4, "thread"), ("indent=2", 2, "thread"),
+                               ("compact", None, "none"), ("compact, threads", None, "thread")):
+        folder = tempfile.mkdtemp(prefix="bulk_")
+        log_file = os.path.join(folder, "log.txt")
+        try:
+            if pool is None:
+                timings[name] = write_like_before(folder, products, log_file)
+                continue
+            start = time.perf_counter()
+            writer = BulkWriter(folder, indent=indent, log_file=log_file, pool=pool)
+            for filename, data in products:
+                writer.write(filename, data)
+                writer.log(filename)
+            writer.close()
+            timings[name] = time.perf_counter() - start
+        finally:
+            shutil.rmtree(folder)
+    for name, seconds in timings.items():
+        print(f"   {name:<18} {seconds:6.2f}s  {count / seconds:8.0f} files/s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the bulk writer on synthetic products")
+    parser.add_argument("--bench", type=int, default=10000, help="number of synthetic products")
+    args = parser.parse_args()
+    benchmark(args.bench)
@@ -0,0 +1,160 @@
+# === Shared JSON dump -> CSV exporter for 01, 04 and 07 ===
+# The three export scripts used to be the same loop: os.listdir the dump folder, then open and json.load
+# one file after the other on one thread, so a 50k file folder spends most of its time waiting on
+# opening and parsing files one by one. Here the folder is listed with os.scandir, the files are parsed
+# in a pool of worker processes (threads with POOL = "thread", or none for small folders) a chunk of
+# files at a time, and the rows are streamed to the CSV writer in the folder's listing order (the order
+# the old loop wrote them in) as the chunks come back. Only a bounded number of chunks is in flight, so memory doesn't grow with the folder.
+# orjson is used for parsing when it's installed (pip install orjson), the json module otherwise.
+#
+# Run it directly to time it on synthetic dump folders:
+#   python3 json_csv_export.py --bench 10000,100000
+import argparse
+import csv
+import json
+import os
+import shutil
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# === Immutable Variables ===
+FILES_PER_CHUNK = 256 # files parsed per task handed to a worker, big enough that handing it over costs little
+CHUNKS_PER_WORKER = 4 # chunks in flight per worker, the bounded queue between the pool and the CSV writer
+PARALLEL_MIN_FILES = 2000 # smaller folders are parsed in this process, starting a pool would cost more than it saves
+THREAD_WORKERS = 8 # threads only overlap the waiting on the disk, so a few are enough
+
+# === Helper Functions ===
+def loads(raw: bytes):
+    return orjson.loads(raw) if orjson else json.loads(raw)
+
+def json_filenames(folder: str, prefix: str = "") -> list:
+    """The .json files in folder whose name starts with prefix, in os.listdir order like the old loop, so the CSV comes out the same."""
+    with os.scandir(folder) as entries:
+        return [
+            entry.name for entry in entries
+            if entry.name.endswith(".json") and entry.name.startswith(prefix) and entry.is_file()
+        ]
+
+def product_values(data, fields: list) -> list:
+    """fields of data.product, "" for the ones it doesn't have (e.g. custom_tags, a column to fill in by hand)."""
+    product = data.get("data", {}).get("product", {}) if isinstance(data, dict) else {}
+    if not isinstance(product, dict):
+        product = {}
+    return [product.get(field, "") for field in fields]
+
+def parse_chunk(folder: str, filenames: list, fields: list) -> list:
+    """[(filename, values, error)] for a chunk of files, runs in a worker."""
+    rows = []
+    for filename in filenames:
+        try:
+            with open(os.path.join(folder, filename), "rb") as f:
+                rows.append((filename, product_values(loads(f.read()), fields), None))
+        except Exception as e:
+            rows.append((filename, None, f"{type(e).__name__}: {e}"))
+    return rows
+
+def iter_rows(folder: str, fields: list, prefix: str = "", pool: str = "process", workers: int = None):
+    """
+    Yields (filename, values, error) for every matching file in folder, in listing order.
+    pool is "process", "thread" or "none"; a single-CPU machine uses threads instead of processes.
+    """
+    filenames = json_filenames(folder, prefix)
+    if pool == "process" and (workers or os.cpu_count() or 1) <= 1:
+        pool = "thread"
+    workers = workers or ((os.cpu_count() or 1) if pool == "process" else THREAD_WORKERS)
+    if pool == "none" or len(filenames) < PARALLEL_MIN_FILES:
+        for filename in filenames:
+            yield from parse_chunk(folder, [filename], fields)
+        return
+
+    executor_class = ProcessPoolExecutor if pool == "process" else ThreadPoolExecutor
+    chunks = (filenames[start:start + FILES_PER_CHUNK] for start in range(0, len(filenames), FILES_PER_CHUNK))
+    with executor_class(max_workers=workers) as executor:
+        in_flight = deque()
+        for chunk in chunks:
+            in_flight.append(executor.submit(parse_chunk, folder, chunk, fields))
+            if len(in_flight) >= workers * CHUNKS_PER_WORKER:
+                yield from in_flight.popleft().result()
+        while in_flight:
+            yield from in_flight.popleft().result()
+
+# === Exporter ===
+def export(folder: str, output_csv: str, fields: list, prefix: str = "", pool: str = "process", workers: int = None) -> dict:
+    """
+    Write filename + fields (keys of data.product) of every .json file in folder to output_csv.
+    Files that can't be read are reported and left out. Returns stats: rows, failed, seconds.
+    """
+    start = time.perf_counter()
+    stats = {"rows": 0, "failed": 0}
+    with open(output_csv, "w", newline="", encoding="utf-8") as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(["filename"] + fields)  # header
+        for filename, values, error in iter_rows(folder, fields, prefix, pool, workers):
+            if error:
+                print(f"Failed to read {filename}: {error}")
+                stats["failed"] += 1
+                continue
+            writer.writerow([filename] + values)
+            stats["rows"] += 1
+    stats["seconds"] = time.perf_counter() - start
+    return stats
+
+# === Benchmark ===
+def make_synthetic_dumps(folder: str, count: int):
+    """count product JSON files shaped like the Zendrop dumps, with a ~2 KB description."""
+    os.makedirs(folder, exist_ok=True)
+    description = "<p>" + "Soft brushed microfiber, machine washable, fade resistant. " * 35 + "</p>"
+    for number in range(count):
+        data = {"data": {"product": {
+            "id": number,
+            "name": f"Synthetic Comforter Set {number} Queen Grey",
+            "description": description,
+            "product_type": "",
+            "tags": [],
+            "product_variant": [{"id": number * 10 + v, "variant_product_type": "", "price": "39.99"} for v in range(4)],
+        }}}
+        with open(os.path.join(folder, f"product_{number:07d}.json"), "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=4)
+
+def export_like_before(folder: str, output_csv: str, fields: list):
+    """The old loop of 01/04/07, for comparison."""
+    start = time.perf_counter()
+    with open(output_csv, "w", newline="", encoding="utf-8") as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(["filename"] + fields)
+        for filename in os.listdir(folder):
+            if filename.endswith(".json"):
+                with open(os.path.join(folder, filename), "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                    product = data.get("data", {}).get("product", {})
+                    writer.writerow([filename] + [product.get(field, "") for field in fields])
+    return time.perf_counter() - start
+
+def benchmark(counts: list, workers: int = None):
+    fields = ["name", "description"]
+    print(f"CPUs: {os.cpu_count()}, parser: {'orjson' if orjson else 'json'}")
+    for count in counts:
+        folder = tempfile.mkdtemp(prefix=f"dumps_{count}_")
+        try:
+            make_synthetic_dumps(folder, count)
+            output_csv = os.path.join(folder, "out.csv")
+            timings = {"before": export_like_before(folder, output_csv, fields)}
+            for pool in ("none", "thread", "process"):
+                timings[pool] = export(folder, output_csv, fields, pool=pool, workers=workers)["seconds"]
+            print(f"{count} files: " + ", ".join(f"{name} {seconds:.2f}s ({count / seconds:.0f} files/s)" for name, seconds in timings.items()))
+        finally:
+            shutil.rmtree(folder)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the exporter on synthetic dump folders")
+    parser.add_argument("--bench", default="10000,100000", help="comma separated file counts")
+    parser.add_argument("--workers", type=int, default=None, help="pool size, default one per CPU")
+    args = parser.parse_args()
+    benchmark([int(count) for count in args.bench.split(",")], args.workers)
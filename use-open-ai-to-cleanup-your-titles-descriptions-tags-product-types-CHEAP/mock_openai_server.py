@@ -0,0 +1,284 @@
+# === Local mock of the OpenAI chat completions endpoint, for trying the cleanup scripts for free ===
+# Standard library only. Answers POST /v1/chat/completions after a random latency, and returns 429s
+# at random and whenever more than --rpm requests arrive within a minute, the way the real API does
+# when you go over your limits (with the same retry-after-ms, Retry-After and x-ratelimit-* headers),
+# and 500s at --server-error-rate. Answers are shaped like the real thing for each script:
+# titles get a shortened title back, descriptions get HTML, tag requests get product_type/tags lines,
+# packed requests get a JSON list back with --pack-drop-rate of their items left out.
+#
+# It also fakes the Batch API (POST /v1/files, POST /v1/batches, GET /v1/batches/<id>,
+# GET /v1/files/<id>/content): a batch finishes --batch-seconds after it was created, with
+# --batch-error-rate of its rows failed and, to test resuming, --batch-expire-rate of them left unanswered.
+#
+#   python3 mock_openai_server.py --port 8765 --latency 0.3,1.5 --error-rate 0.05 --rpm 600
+#   then set OPENAI_BASE_URL = "http://127.0.0.1:8765/v1" in the script you want to test
+import argparse
+import email.parser
+import email.policy
+import json
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# === Helper Functions ===
+def fake_item(item: dict) -> dict:
+    """One entry of a packed answer (openai_prompt_packing.py)."""
+    if "title" in item:
+        return {"id": item["id"], "title": " ".join(str(item["title"]).split()[:8]) or "Mock Title"}
+    return {"id": item["id"], "product_type": "Mock Product", "tags": ["mock", "test", "sample", "catalog", "cleanup"]}
+
+def fake_answer(messages: list, pack_drop_rate: float = 0.0) -> str:
+    """Something the calling script can parse, based on what it asked for."""
+    prompt = "\n".join(message.get("content", "") for message in messages)
+    user = messages[-1].get("content", "") if messages else ""
+    if user.startswith('{"items"'):
+        items = json.loads(user)["items"]
+        return json.dumps({"items": [fake_item(item) for item in items if random.random() >= pack_drop_rate]})
+    if "product_type:" in prompt:
+        return "product_type: Mock Product\ntags: mock|test|sample|catalog|cleanup"
+    if "Current Description:" in user:
+        name = user.split("\n", 1)[0].replace("Product Name:", "").strip()
+        return f"<p>{name} described by the mock server.</p><ul><li>Size: as listed</li><li></li></ul>"
+    title = user.split(":", 1)[-1].strip()
+    return " ".join(title.split()[:8]) or "Mock Title"
+
+def count_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+def completion(request: dict, number, pack_drop_rate: float = 0.0) -> dict:
+    """A chat.completion answer to a request body."""
+    messages = request.get("messages", [])
+    answer = fake_answer(messages, pack_drop_rate)
+    prompt_tokens = sum(count_tokens(message.get("content", "")) for message in messages)
+    completion_tokens = count_tokens(answer)
+    return {
+        "id": f"chatcmpl-mock-{number}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.get("model", "mock"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+def multipart_fields(content_type: str, body: bytes) -> dict:
+    """name -> (filename, bytes) of a multipart/form-data upload."""
+    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode("utf-8") + body
+    )
+    return {
+        part.get_param("name", header="content-disposition"): (part.get_filename(), part.get_payload(decode=True))
+        for part in message.iter_parts()
+    }
+
+class MockState:
+    def __init__(self, args):
+        self.args = args
+        self.lock = threading.Lock()
+        self.recent = deque()
+        self.requests = 0
+        self.rejected = 0
+        self.failed = 0
+        self.files = {}
+        self.batches = {}
+
+    def fail(self) -> bool:
+        """True when this request should get a 500 at random."""
+        with self.lock:
+            if random.random() < self.args.server_error_rate:
+                self.failed += 1
+                return True
+            return False
+
+    def add_file(self, filename: str, purpose: str, data: bytes) -> dict:
+        with self.lock:
+            file = {
+                "id": f"file-mock-{uuid.uuid4().hex[:12]}",
+                "object": "file",
+                "bytes": len(data),
+                "created_at": int(time.time()),
+                "filename": filename,
+                "purpose": purpose,
+                "status": "processed",
+            }
+            self.files[file["id"]] = (file, data)
+            return file
+
+    def batch(self, batch_id: str):
+        """The batch as it is now, running it the first time it is asked for after --batch-seconds."""
+        with self.lock:
+            batch = self.batches.get(batch_id)
+        if batch is None or batch["status"] != "in_progress" or time.time() - batch["created_at"] < self.args.batch_seconds:
+            return batch
+        _, data = self.files[batch["input_file_id"]]
+        output, errors, answered = [], [], 0
+        lines = [json.loads(line) for line in data.decode("utf-8").splitlines() if line.strip()]
+        for number, line in enumerate(lines):
+            if random.random() < self.args.batch_expire_rate:
+                continue
+            answered += 1
+            item = {"id": f"batch_req_{number}", "custom_id": line["custom_id"], "error": None}
+            if random.random() < self.args.batch_error_rate:
+                item["response"] = {"status_code": 500, "request_id": f"req_{number}", "body": {
+                    "error": {"message": "The server had an error while processing your request (mock)", "type": "server_error"}}}
+                errors.append(item)
+            else:
+                item["response"] = {"status_code": 200, "request_id": f"req_{number}", "body": completion(line["body"], number, self.args.pack_drop_rate)}
+                output.append(item)
+        for items, field in ((output, "output_file_id"), (errors, "error_file_id")):
+            if items:
+                content = "".join(json.dumps(item) + "\n" for item in items).encode("utf-8")
+                batch[field] = self.add_file(f"{batch_id}_{field}.jsonl", "batch_output", content)["id"]
+        batch["status"] = "completed" if answered == len(lines) else "expired"
+        batch["completed_at" if answered == len(lines) else "expired_at"] = int(time.time())
+        batch["request_counts"] = {"total": len(lines), "completed": len(output), "failed": len(errors)}
+        return batch
+
+    def limit_headers(self) -> dict:
+        retry_after = self.args.retry_after
+        with self.lock:
+            remaining = max(0, self.args.rpm - len(self.recent)) if self.args.rpm else 0
+        return {
+            "Retry-After": str(max(1, round(retry_after))),
+            "retry-after-ms": str(int(retry_after * 1000)),
+            "x-ratelimit-remaining-requests": str(remaining),
+            "x-ratelimit-reset-requests": f"{retry_after}s",
+        }
+
+    def admit(self) -> bool:
+        """False when this request should get a 429, either at random or for going over --rpm."""
+        with self.lock:
+            self.requests += 1
+            now = time.monotonic()
+            while self.recent and now - self.recent[0] > 60:
+                self.recent.popleft()
+            if random.random() < self.args.error_rate or (self.args.rpm and len(self.recent) >= self.args.rpm):
+                self.rejected += 1
+                return False
+            self.recent.append(now)
+            return True
+
+def make_handler(state: MockState):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            if state.args.verbose:
+                super().log_message(format, *args)
+
+        def _send(self, status: int, body: dict, headers: dict = None):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            path = self.path.rstrip("/")
+            if "/files/" in path and path.endswith("/content"):
+                file_id = path.rsplit("/", 2)[-2]
+                if file_id in state.files:
+                    data = state.files[file_id][1]
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/octet-stream")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                    return
+            elif "/batches/" in path:
+                batch = state.batch(path.rsplit("/", 1)[-1])
+                if batch is not None:
+                    self._send(200, batch)
+                    return
+            self._send(404, {"error": {"message": f"mock has no {self.path}", "type": "invalid_request_error"}})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            body = self.rfile.read(length)
+            path = self.path.rstrip("/")
+            if path.endswith("/files"):
+                fields = multipart_fields(self.headers.get("Content-Type", ""), body)
+                filename, data = fields["file"]
+                self._send(200, state.add_file(filename, fields["purpose"][1].decode("utf-8"), data))
+                return
+            if path.endswith("/batches"):
+                request = json.loads(body)
+                if request.get("input_file_id") not in state.files:
+                    self._send(400, {"error": {"message": "unknown input_file_id (mock)", "type": "invalid_request_error"}})
+                    return
+                batch = {
+                    "id": f"batch_mock_{uuid.uuid4().hex[:12]}",
+                    "object": "batch",
+                    "endpoint": request.get("endpoint"),
+                    "input_file_id": request["input_file_id"],
+                    "completion_window": request.get("completion_window", "24h"),
+                    "status": "in_progress",
+                    "created_at": int(time.time()),
+                    "output_file_id": None,
+                    "error_file_id": None,
+                    "request_counts": {"total": 0, "completed": 0, "failed": 0},
+                }
+                with state.lock:
+                    state.batches[batch["id"]] = batch
+                self._send(200, batch)
+                return
+            request = json.loads(body or b"{}")
+            if not path.endswith("/chat/completions"):
+                self._send(404, {"error": {"message": f"mock has no {self.path}", "type": "invalid_request_error"}})
+                return
+
+            low, high = state.args.latency
+            time.sleep(random.uniform(low, high))
+            if not state.admit():
+                self._send(
+                    429,
+                    {"error": {"message": "Rate limit reached (mock)", "type": "requests", "code": "rate_limit_exceeded"}},
+                    state.limit_headers(),
+                )
+                return
+            if state.fail():
+                self._send(500, {"error": {"message": "The server had an error while processing your request (mock)", "type": "server_error"}})
+                return
+
+            self._send(200, completion(request, state.requests, state.args.pack_drop_rate))
+    return Handler
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Mock OpenAI chat completions server with latency and 429s.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=lambda v: tuple(float(x) for x in v.split(",")), default=(0.2, 1.0),
+                        help="min,max seconds before answering")
+    parser.add_argument("--error-rate", type=float, default=0.02, help="fraction of requests answered with a 429 at random")
+    parser.add_argument("--server-error-rate", type=float, default=0.0, help="fraction of requests answered with a 500 at random")
+    parser.add_argument("--rpm", type=int, default=0, help="answer 429 above this many requests per minute, 0 for no limit")
+    parser.add_argument("--retry-after", type=float, default=1, help="seconds a 429 asks the client to wait (Retry-After, retry-after-ms, x-ratelimit-reset-requests)")
+    parser.add_argument("--batch-seconds", type=float, default=3, help="seconds before a batch is done")
+    parser.add_argument("--batch-error-rate", type=float, default=0.02, help="fraction of batch rows answered with a 500")
+    parser.add_argument("--batch-expire-rate", type=float, default=0.0, help="fraction of batch rows left unanswered, the batch then ends as expired")
+    parser.add_argument("--pack-drop-rate", type=float, default=0.0, help="fraction of the items of a packed request left out of the answer")
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    state = MockState(args)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(state))
+    print(f"🧪 Mock OpenAI listening on http://{args.host}:{args.port}/v1 (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"🛑 Served {state.requests} requests, {state.rejected} answered with 429, {state.failed} with 500")
+
+if __name__ == "__main__":
+    main()
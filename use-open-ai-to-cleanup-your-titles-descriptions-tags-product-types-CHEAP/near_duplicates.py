@@ -0,0 +1,231 @@
+# === Near-duplicate collapsing for the OpenAI cleanup scripts (02, 05, 08) ===
+# Supplier feeds list the same product once per size and color: "Comforter Set Queen Grey",
+# "Comforter Set King Grey", "Comforter Set King Blue"... Asking GPT about each one pays for the same
+# answer over and over. Before the requests go out, size and color words are masked, the rest of the
+# name (and description) is MinHashed, and rows whose masked text is nearly the same (Jaccard at least
+# NEAR_DUPLICATE_THRESHOLD) are grouped behind the first one. Only that representative is sent; the
+# others get its answer with the representative's size and color words swapped for their own.
+#
+# A row only joins a group when its size/color words line up one to one with the representative's
+# (same number, same kinds, no word that would have to turn into two different ones), its <img> sources
+# are the same and none of the words to swap is a color that is also an everyday noun (AMBIGUOUS_WORDS),
+# otherwise it is sent on its own like before. Words are only swapped in text, never inside tags (image
+# URLs, attributes). When the representative's answer doesn't contain one of the words that had to be
+# swapped (GPT reworded or dropped it), its members are sent on their own too instead of being filled in.
+# Every fan-out is written to a log CSV so it can be checked.
+import csv
+import hashlib
+import os
+import re
+
+# === Immutable Variables ===
+NUM_HASHES = 32 # MinHash signature length
+BANDS = 8 # LSH bands of NUM_HASHES // BANDS hashes, rows sharing any band are compared
+SHINGLE_WORDS = 3 # words per shingle
+
+SIZE_WORDS = [
+    "california king", "cal king", "super king", "twin xl", "full/queen", "full queen", "queen/king",
+    "twin", "full", "queen", "king", "single", "double",
+    "small", "medium", "large", "x-large", "xx-large", "xl", "xxl", "xxxl",
+]
+COLOR_WORDS = [
+    "black", "white", "grey", "gray", "silver", "charcoal", "blue", "navy", "teal", "turquoise", "aqua",
+    "green", "sage", "olive", "emerald", "yellow", "mustard", "gold", "orange", "coral", "red", "burgundy",
+    "wine", "pink", "blush", "rose", "purple", "lavender", "lilac", "brown", "coffee", "chocolate", "tan",
+    "taupe", "beige", "khaki", "ivory", "cream", "camel", "multicolor",
+]
+# Colors that are also everyday nouns ("rose scent", "wine glass", "gold foil", "coffee table"), a swap can't tell which is meant
+AMBIGUOUS_WORDS = [
+    "rose", "wine", "coffee", "gold", "cream", "sage", "olive", "tan",
+    "chocolate", "camel", "coral", "orange", "mustard", "lavender", "ivory",
+]
+
+_VARIANT = re.compile(
+    r"(?P<dimension>\b\d+(?:\.\d+)?\s*[x×*]\s*\d+(?:\.\d+)?(?:\s*[x×*]\s*\d+(?:\.\d+)?)?\b)"
+    r"|(?P<measure>\b\d+(?:\.\d+)?\s*(?:inches|inch|in|cm|mm|ft|oz|ml)\b)"
+    r"|(?P<size>\b(?:" + "|".join(re.escape(word) for word in sorted(SIZE_WORDS, key=len, reverse=True)) + r")\b)"
+    r"|(?P<color>\b(?:" + "|".join(re.escape(word) for word in sorted(COLOR_WORDS, key=len, reverse=True)) + r")\b)",
+    re.I,
+)
+_TAG = re.compile(r"<[^>]+>")
+_TAG_SPLIT = re.compile(r"(<[^>]+>)")
+_IMG_SRC = re.compile(r"""<img\b[^>]*?\bsrc\s*=\s*["']?([^"'\s>]+)""", re.I)
+_WORD = re.compile(r"[a-z0-9<>]+")
+_PRIME = (1 << 61) - 1
+_SEEDS = [
+    (int.from_bytes(hashlib.blake2b(f"a{i}".encode(), digest_size=8).digest(), "big") % _PRIME | 1,
+     int.from_bytes(hashlib.blake2b(f"b{i}".encode(), digest_size=8).digest(), "big") % _PRIME)
+    for i in range(NUM_HASHES)
+]
+
+# === Helper Functions ===
+def variants(text: str):
+    """(masked lowercase text, [(kind, word as written)]) with every size/color word replaced by <kind>."""
+    found = []
+
+    def mask(match):
+        found.append((match.lastgroup, match.group(0)))
+        return f" <{match.lastgroup}> "
+    return _VARIANT.sub(mask, text).lower(), found
+
+def shingles(masked: str) -> set:
+    words = _WORD.findall(masked)
+    if len(words) <= SHINGLE_WORDS:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+def signature(shingle_set: set) -> tuple:
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big") for s in shingle_set]
+    return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in _SEEDS)
+
+def jaccard(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+def _variant_key(kind: str, word: str) -> str:
+    word = word.lower()
+    if kind == "dimension":
+        return "x".join(re.split(r"\s*[x×*]\s*", word))
+    return " ".join(word.split())
+
+def substitutions(representative: list, member: list):
+    """Representative word -> member word, None when the two lists of size/color words don't line up."""
+    if len(representative) != len(member):
+        return None
+    mapping = {}
+    for (kind, rep_word), (member_kind, member_word) in zip(representative, member):
+        if kind != member_kind:
+            return None
+        key = _variant_key(kind, rep_word)
+        if key in mapping and _variant_key(kind, mapping[key][1]) != _variant_key(kind, member_word):
+            return None
+        mapping[key] = (kind, member_word)
+    # Words that stay the same need no swapping
+    return {key: word for key, (kind, word) in mapping.items() if _variant_key(kind, word) != key}
+
+def ambiguous(mapping: dict) -> bool:
+    """True when a word the mapping swaps could just as well be a noun as a color."""
+    return any(key in AMBIGUOUS_WORDS for key in mapping)
+
+def image_sources(values) -> tuple:
+    return tuple(src for value in values for src in _IMG_SRC.findall(value or ""))
+
+def _outside_tags(text: str, change) -> str:
+    """change() applied to the text between tags, the tags themselves (URLs, attributes) are left as they are."""
+    parts = _TAG_SPLIT.split(text)
+    return "".join(part if number % 2 else change(part) for number, part in enumerate(parts))
+
+def found_words(value) -> set:
+    """Variant keys of the size/color words in value (a string, or a list/tuple of them), outside tags."""
+    found = set()
+    if isinstance(value, str):
+        def collect(text):
+            found.update(_variant_key(match.lastgroup, match.group(0)) for match in _VARIANT.finditer(text))
+            return text
+        _outside_tags(value, collect)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            found |= found_words(item)
+    return found
+
+def _match_case(found: str, word: str) -> str:
+    if found.isupper():
+        return word.upper()
+    if found[:1].isupper():
+        return " ".join(part[:1].upper() + part[1:] for part in word.split(" "))
+    return word.lower()
+
+def substitute(value, mapping: dict):
+    """value (a string, or a list/tuple of them) with every representative word outside tags swapped for the member's."""
+    if isinstance(value, str):
+        if not mapping:
+            return value
+
+        def swap(match):
+            word = mapping.get(_variant_key(match.lastgroup, match.group(0)))
+            return _match_case(match.group(0), word) if word else match.group(0)
+        return _outside_tags(value, lambda text: _VARIANT.sub(swap, text))
+    if isinstance(value, (list, tuple)):
+        return type(value)(substitute(item, mapping) for item in value)
+    return value
+
+class NearDuplicates:
+    """
+    Groups rows whose text, with size and color words masked, is nearly the same.
+    - text_of(row) -> the strings the prompt is built from (name, description...)
+    - collapse([(index, row)]) -> the representatives to send
+    - expand(index, output) -> ([(index, row, output)] of the rows filled in from a representative's answer,
+      [(index, row)] of the rows its answer can't be swapped into, to be sent on their own)
+    - members_of(index) -> [(index, row)] waiting on a representative that failed
+    """
+
+    def __init__(self, text_of, threshold: float = 0.9, log_csv: str = None, key: str = "filename"):
+        self.text_of = text_of
+        self.threshold = threshold
+        self.log_csv = log_csv
+        self.key = key
+        self.members = {}
+
+    def collapse(self, indexed: list) -> list:
+        buckets = {}
+        leaders = {}
+        representatives = []
+        rows_per_band = NUM_HASHES // BANDS
+        for index, row in indexed:
+            values = self.text_of(row)
+            text = " | ".join(_TAG.sub(" ", value or "") for value in values)
+            images = image_sources(values)
+            masked, found = variants(text)
+            shingle_set = shingles(masked)
+            sig = signature(shingle_set)
+            bands = [(band, sig[band * rows_per_band:(band + 1) * rows_per_band]) for band in range(BANDS)]
+            # The earliest representative that is similar enough and whose words line up wins
+            for leader in sorted({leader for band in bands for leader in buckets.get(band, ())}):
+                leader_shingles, leader_found, leader_images, _ = leaders[leader]
+                # Different pictures are a different product (or at least a description that has to keep its own)
+                if images != leader_images or jaccard(shingle_set, leader_shingles) < self.threshold:
+                    continue
+                mapping = substitutions(leader_found, found)
+                if mapping is not None and not ambiguous(mapping):
+                    self.members.setdefault(leader, []).append((index, row, mapping))
+                    break
+            else:
+                leaders[index] = (shingle_set, found, images, row)
+                for band in bands:
+                    buckets.setdefault(band, []).append(index)
+                representatives.append((index, row))
+        filled = len(indexed) - len(representatives)
+        if filled:
+            print(f"🧬 {len(indexed)} rows, {len(representatives)} sent, {filled} filled in from a near-duplicate")
+            self.write_log(leaders)
+        return representatives
+
+    def members_of(self, index: int) -> list:
+        """Take out the rows waiting on a representative that failed, [(index, row)]."""
+        return [(member_index, member_row) for member_index, member_row, _ in self.members.pop(index, ())]
+
+    def expand(self, index: int, output):
+        filled, resend = [], []
+        answered = found_words(output)
+        for member_index, member_row, mapping in self.members.pop(index, ()):
+            if all(key in answered for key in mapping):
+                filled.append((member_index, member_row, substitute(output, mapping)))
+            else:
+                resend.append((member_index, member_row))
+        if resend:
+            print(f"🧬 {len(resend)} near-duplicates sent on their own, the answer they'd be filled in from left out words they need swapped")
+        return filled, resend
+
+    def write_log(self, leaders: dict):
+        if not self.log_csv:
+            return
+        # Appended to like the output CSVs, so runs done in chunks (catalog_pipeline.py) keep every group
+        new_file = not os.path.exists(self.log_csv) or os.stat(self.log_csv).st_size == 0
+        with open(self.log_csv, "a", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            if new_file:
+                writer.writerow([self.key, "representative", "substitutions"])
+            for leader, members in self.members.items():
+                leader_key = leaders[leader][3][self.key]
+                for _, row, mapping in members:
+                    swaps = "; ".join(f"{rep} → {word}" for rep, word in mapping.items())
+                    writer.writerow([row[self.key], leader_key, swaps])
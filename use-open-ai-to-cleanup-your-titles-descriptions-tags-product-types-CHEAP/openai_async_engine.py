@@ -0,0 +1,402 @@
+# === Shared asyncio request engine for the OpenAI cleanup scripts (02, 05, 08) ===
+# Instead of one chat.completions call at a time followed by a sleep, the rows of a CSV are handed to
+# CONCURRENCY workers that share one AsyncOpenAI client. Two token buckets keep the run under your
+# account's requests-per-minute and tokens-per-minute limits, so throughput is set by those limits
+# and not by waiting on one round-trip after another.
+#
+# Output can be "ordered" (rows are written in input order) or "keyed" (rows are written the moment they
+# finish). Either way the scripts resume from checkpoint_store.py, which doesn't care about the order.
+#
+# Failed requests are retried by openai_retry_policy.py, rows that can't be done go to a dead-letter CSV.
+# With a Packing from openai_prompt_packing.py several rows share one request, and with a ResponseCache
+# from openai_response_cache.py rows that were answered before are served from disk. NearDuplicates
+# (near_duplicates.py) sends one row per group of near-identical listings and fills in the others.
+# A Telemetry from openai_telemetry.py logs every request (tokens, latency, tries, outcome) and can stop
+# sending once a token or dollar budget is spent.
+#
+# Point OPENAI_BASE_URL in a script at mock_openai_server.py to try it without spending anything.
+import asyncio
+import csv
+import os
+import time
+from collections import deque
+from openai import AsyncOpenAI
+from openai_retry_policy import RetryPolicy, classify
+
+CHARS_PER_TOKEN = 4 # rough size of a token for English text, used to reserve tokens before a request is sent
+
+# === Rate limiting ===
+class TokenBucket:
+    """
+    Refills at per_minute / 60 per second up to capacity (one minute's worth by default).
+    take() waits until the amount is available; amounts bigger than the whole bucket are capped,
+    so one huge request can't block forever.
+    """
+
+    def __init__(self, per_minute: float, capacity: float = None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity or per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def take(self, amount: float):
+        amount = min(amount, self.capacity)
+        async with self.lock:  # first come first served, a big request isn't starved by small ones
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def adjust(self, amount: float):
+        """Give back (positive) or charge extra (negative) once the real cost of a request is known."""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute buckets; a limit of 0 or None is not enforced."""
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.paused_until = 0.0
+
+    def pause(self, seconds: float):
+        """Hold every worker back after a 429, so they don't all keep hitting a limit that already ran out."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self, estimated_tokens: int):
+        while time.monotonic() < self.paused_until:
+            await asyncio.sleep(self.paused_until - time.monotonic())
+        if self.requests:
+            await self.requests.take(1)
+        if self.tokens:
+            await self.tokens.take(estimated_tokens)
+
+    def settle(self, estimated_tokens: int, used_tokens: int):
+        if self.tokens and used_tokens is not None:
+            self.tokens.adjust(estimated_tokens - used_tokens)
+
+# === Helper Functions ===
+def make_client(api_key: str, organization: str = None, base_url: str = None) -> AsyncOpenAI:
+    # The SDK's own retries are off, openai_retry_policy.py decides what gets retried and when
+    return AsyncOpenAI(api_key=api_key, organization=organization or None, base_url=base_url or None, max_retries=0)
+
+def estimate_tokens(messages: list, max_output_tokens: int) -> int:
+    """Tokens a request will probably cost: its text at CHARS_PER_TOKEN plus the expected answer."""
+    chars = sum(len(message["content"]) for message in messages)
+    return chars // CHARS_PER_TOKEN + 4 * len(messages) + max_output_tokens
+
+class OrderedWriter:
+    """Holds finished rows back until every earlier row is done, then hands them to write() in input order."""
+
+    def __init__(self, write):
+        self.write = write
+        self.next_index = 0
+        self.waiting = {}
+
+    def done(self, index: int, row: dict, output: dict):
+        self.waiting[index] = (row, output)
+        self._flush()
+
+    def skip(self, index: int):
+        """A row that went to the dead-letter CSV, later rows don't wait for it."""
+        self.waiting[index] = None
+        self._flush()
+
+    def _flush(self):
+        while self.next_index in self.waiting:
+            finished = self.waiting.pop(self.next_index)
+            if finished is not None:
+                self.write(*finished)
+            self.next_index += 1
+
+class DeadLetterWriter:
+    """Appends rows that failed for good to a CSV: the input columns plus why and after how many tries."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.count = 0
+
+    def write(self, row: dict, kind: str, error: Exception, attempts: int):
+        fieldnames = list(row) + ["error_kind", "error", "attempts", "failed_at"]
+        new_file = not os.path.exists(self.path) or os.stat(self.path).st_size == 0
+        with open(self.path, "a", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction="ignore")
+            if new_file:
+                writer.writeheader()
+            writer.writerow({
+                **row,
+                "error_kind": kind,
+                "error": str(error)[:500],
+                "attempts": attempts,
+                "failed_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            })
+        self.count += 1
+
+# === Engine ===
+async def _run(rows, build_messages, call, parse, write, settings):
+    client = settings["make_client"]()
+    limiter = RateLimiter(settings["requests_per_minute"], settings["tokens_per_minute"])
+    packing = settings["packing"]
+    cache = settings["cache"]
+    near_duplicates = settings["near_duplicates"]
+    ordered = OrderedWriter(write) if settings["ordered"] else None
+    policy = settings["policy"]
+    dead_letter = DeadLetterWriter(settings["dead_letter_csv"])
+    telemetry = settings["telemetry"]
+    stats = {"rows": 0, "tokens": 0, "errors": 0, "requests": 0, "splits": 0, "cached": 0, "near_duplicates": 0, "pending": 0}
+
+    def give_up(index, row, kind, error, attempts):
+        dead_letter.write(row, kind, error, attempts)
+        print(f"❌ Giving up on {row.get('filename', index)} after {attempts} tries ({kind}): {error}\n→ Written to {dead_letter.path}")
+        if ordered:
+            ordered.skip(index)
+        # Rows waiting on this one as their near-duplicate fail with it
+        for member_index, member_row in near_duplicates.members_of(index) if near_duplicates else ():
+            give_up(member_index, member_row, kind, f"near-duplicate of {row.get('filename', index)}: {error}", attempts)
+
+    def leave(job):
+        """Rows over the budget: not sent, not written, the next run does them."""
+        for index, row in job:
+            for left_index in [index] + [member_index for member_index, _ in (near_duplicates.members_of(index) if near_duplicates else ())]:
+                stats["pending"] += 1
+                if ordered:
+                    ordered.skip(left_index)
+
+    def finished(index, row, output):
+        stats["rows"] += 1
+        if ordered:
+            ordered.done(index, row, output)
+        else:
+            write(row, output)
+        if not near_duplicates:
+            return
+        filled, resend = near_duplicates.expand(index, output)
+        for member_index, member_row, member_output in filled:
+            stats["near_duplicates"] += 1
+            finished(member_index, member_row, member_output)
+        # Members the answer can't be swapped into are asked themselves, next so ordered output isn't held up
+        for item in reversed(resend):
+            queue.appendleft([item])
+
+    def serve_cached(index, row) -> bool:
+        """Write the row from the response cache, False when it has to be asked."""
+        # With packing rows are cached one item at a time, as the answer to a pack of just that row, and rows
+        # that were asked on their own (e.g. split off a pack) under their normal prompt
+        lookups = [(packing.messages([row]), lambda response: packing.parse([row], response)[0])] if packing else []
+        lookups.append((build_messages(row), lambda response: parse(row, response)))
+        for number, (messages, read) in enumerate(lookups, 1):
+            response = cache.lookup(messages, count_miss=number == len(lookups))
+            if response is None:
+                continue
+            try:
+                output = read(response)
+            except Exception:
+                output = None
+            if output is None:  # e.g. the parser got stricter since, ask again
+                continue
+            stats["cached"] += 1
+            finished(index, row, output)
+            return True
+        return False
+
+    def split(job, reason, singly=False):
+        """
+        Try the rows of a pack again in two smaller packs, or with singly one request per row, at the front
+        of the queue so ordered output isn't held up.
+        """
+        stats["splits"] += 1
+        half = (len(job) + 1) // 2
+        if len(job) == 1:
+            print(f"✂️ {job[0][1].get('filename', job[0][0])} came back {reason} in a pack, trying it again on its own")
+        elif singly:
+            print(f"✂️ A pack of {len(job)} rows failed {reason}, trying each row on its own")
+        else:
+            print(f"✂️ {len(job)} rows of a pack came back {reason}, trying them again in packs of {half} and {len(job) - half}")
+        parts = [[item] for item in job] if singly else [job[:half], job[half:]]
+        for part in reversed(parts):
+            if part:
+                queue.appendleft(part)
+
+    # A job is a list of (index, row): one row, or a pack of rows sharing a request. The queue exists before
+    # rows are served from the cache, finished() may put rows on it
+    queue = deque()
+    indexed = [(index, row) for index, row in enumerate(rows) if not (cache and serve_cached(index, row))]
+    if near_duplicates:
+        indexed = near_duplicates.collapse(indexed)
+    queue.extend(packing.pack(indexed, settings["max_output_tokens"]) if packing else [[item] for item in indexed])
+
+    in_progress = 0
+    changed = asyncio.Event()  # set when a job is done, waiting workers look at the queue again
+
+    async def next_job():
+        """
+        The next job, None when everything is done. An empty queue isn't the end while other workers are
+        still busy, their jobs may put rows back (split packs, near-duplicates to ask themselves).
+        """
+        nonlocal in_progress
+        while not queue:
+            if not in_progress:
+                return None
+            changed.clear()
+            await changed.wait()
+        in_progress += 1
+        return queue.popleft()
+
+    async def worker():
+        nonlocal in_progress
+        while True:
+            job = await next_job()
+            if job is None:
+                return
+            try:
+                await handle(job)
+            finally:
+                in_progress -= 1
+                changed.set()
+
+    async def handle(job):
+        packed = len(job) > 1
+        if packed:
+            messages = packing.messages([row for _, row in job])
+        else:
+            index, row = job[0]
+            messages = build_messages(row)
+        estimated = estimate_tokens(messages, settings["max_output_tokens"] * len(job))
+        budgeted = telemetry.estimate(messages, len(job)) if telemetry else None
+        if telemetry and not telemetry.reserve(budgeted):
+            leave(job)
+            return
+        keys = [str(job_row.get("filename", job_index)).strip() for job_index, job_row in job]
+        attempts = 0
+        response = None
+        first_try = time.perf_counter()
+        while response is None:
+            await limiter.acquire(estimated)
+            attempts += 1
+            try:
+                sent = time.perf_counter()
+                response = await call(client, messages)
+                answered_in = time.perf_counter() - sent
+            except Exception as e:
+                limiter.settle(estimated, 0)
+                stats["errors"] += 1
+                kind = classify(e)
+                if not policy.should_retry(kind, attempts):
+                    if telemetry:
+                        telemetry.record(keys, "split" if packed else "gave_up", wall_seconds=time.perf_counter() - first_try,
+                                         attempts=attempts, error_kind=kind, estimate=budgeted)
+                    if packed:  # e.g. a pack the model refuses as too long or one bad row, halving again and again would cost ~2N requests
+                        split(job, f"with {kind} errors", singly=True)
+                    else:
+                        give_up(index, row, kind, e, attempts)
+                    break
+                delay = policy.delay(e, kind, attempts)
+                if kind == "rate_limit":
+                    limiter.pause(delay)
+                label = f"a pack of {len(job)}" if packed else row.get("filename", index)
+                print(f"⚠️ {kind} error on {label} (try {attempts}): {e}\n→ Retrying in {delay:.1f} seconds...")
+                await asyncio.sleep(delay)
+        if response is None:
+            return
+        stats["requests"] += 1
+        usage = getattr(response, "usage", None)
+        used = getattr(usage, "total_tokens", None)
+        limiter.settle(estimated, used)
+        stats["tokens"] += used or estimated
+
+        def log_call(outcome):
+            if telemetry:
+                telemetry.record(keys, outcome, usage, answered_in, time.perf_counter() - first_try, attempts, estimate=budgeted)
+        if packed:
+            pack_rows = [row for _, row in job]
+            answers = packing.answers(pack_rows, response)
+            outputs = packing.outputs(pack_rows, answers)
+            missing = [item for item, output in zip(job, outputs) if output is None]
+            log_call("partial" if missing else "ok")
+            for (index, row), answer, output in zip(job, answers, outputs):
+                if output is None:
+                    continue
+                if cache:
+                    cache.store(
+                        packing.messages([row]), packing.single_answer(answer),
+                        (getattr(usage, "prompt_tokens", 0) or 0) // len(job),
+                        (getattr(usage, "completion_tokens", 0) or 0) // len(job),
+                    )
+                finished(index, row, output)
+            if missing:
+                split(missing, "missing or malformed")
+            return
+        try:
+            output = parse(row, response)
+        except Exception as e:  # not retried, another try at the same prompt costs as much and rarely parses better, the dead-letter CSV can be fed back in
+            log_call("unparseable")
+            give_up(index, row, "fatal", e, attempts)
+            return
+        log_call("ok")
+        if cache:
+            cache.store_response(messages, response)
+        finished(index, row, output)
+
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(worker() for _ in range(max(1, settings["concurrency"]))))
+    finally:
+        await client.close()
+    stats["seconds"] = time.perf_counter() - start
+    stats["dead_letter"] = dead_letter.count
+    return stats
+
+def run(rows, build_messages, call, parse, write, *, make_client, concurrency, requests_per_minute,
+        tokens_per_minute, max_output_tokens, dead_letter_csv, ordered=True, policy=None, packing=None, cache=None,
+        near_duplicates=None, telemetry=None):
+    """
+    Send one request per row and write the parsed results.
+    - build_messages(row) -> chat messages for the row
+    - call(client, messages) -> awaitable API response
+    - parse(row, response) -> whatever write() needs, runs in the event loop so keep it quick
+    - write(row, output) is called once per row, in input order when ordered is True
+    - rows whose request fails for good, or whose answer parse() can't use, go to dead_letter_csv
+    - packing (an openai_prompt_packing.Packing) sends several rows per request, max_output_tokens is then per row
+    - cache (an openai_response_cache.ResponseCache) answers rows asked before without a request
+    - near_duplicates (a near_duplicates.NearDuplicates) sends one row per group of near-identical rows
+    - telemetry (an openai_telemetry.Telemetry) logs every request, rows over its budget are left pending
+    Returns stats: rows, tokens, errors, requests, splits, cached, near_duplicates, pending, dead_letter, seconds.
+    """
+    settings = {
+        "make_client": make_client,
+        "concurrency": concurrency,
+        "requests_per_minute": requests_per_minute,
+        "tokens_per_minute": tokens_per_minute,
+        "max_output_tokens": max_output_tokens,
+        "ordered": ordered,
+        "policy": policy or RetryPolicy(),
+        "dead_letter_csv": dead_letter_csv,
+        "packing": packing,
+        "cache": cache,
+        "near_duplicates": near_duplicates,
+        "telemetry": telemetry,
+    }
+    stats = asyncio.run(_run(list(rows), build_messages, call, parse, write, settings))
+    asked = stats["rows"] - stats["cached"] - stats["near_duplicates"]
+    if asked or stats["dead_letter"]:
+        per_minute = asked / max(stats["seconds"], 1e-9) * 60
+        print(
+            f"📊 {asked} rows asked in {stats['seconds']:.1f}s ({per_minute:.0f} rows/minute),"
+            f" ~{stats['tokens']} tokens, {stats['errors']} failed requests"
+        )
+    if packing and stats["requests"]:
+        print(f"📦 {asked} rows in {stats['requests']} requests ({asked / stats['requests']:.1f} per request), {stats['splits']} packs split and retried")
+    if cache:
+        cache.report()
+    if stats["dead_letter"]:
+        print(f"🪦 {stats['dead_letter']} rows failed for good, see {dead_letter_csv}, fix them and feed that file back in as INPUT_CSV")
+    return stats
@@ -0,0 +1,294 @@
+# === Batch API mode for the OpenAI cleanup scripts (02, 05, 08) ===
+# Titles, descriptions and tags don't need an answer within a second, so instead of sending one request
+# per row the whole prep CSV can go to the OpenAI Batch API: the rows are written to a JSONL file, uploaded,
+# and OpenAI works through it within COMPLETION_WINDOW at half the price of the live endpoint, with no
+# requests/tokens per minute pacing on our side at all.
+#
+# The ids of submitted batches are kept in a small JSON state file. Run the script again (or leave it
+# polling) and it picks the batches up where they are: finished ones are downloaded and merged into the
+# output CSV by filename, expired, cancelled or failed ones merge whatever OpenAI did finish and the rest of
+# their rows is sent again in a new batch (up to RESUBMIT_ROUNDS times per run, after that the next run
+# does them). Rows OpenAI answered with an error go to the dead-letter CSV.
+# With a ResponseCache (openai_response_cache.py) rows answered before aren't put in a batch at all, and
+# with NearDuplicates (near_duplicates.py) only one row per group of near-identical listings is.
+# A Telemetry (openai_telemetry.py) logs every answered row and only submits rows that fit its budget.
+#
+# Point OPENAI_BASE_URL in a script at mock_openai_server.py to try it without spending anything.
+import json
+import os
+import time
+from openai import OpenAI
+from openai.types.chat import ChatCompletion
+from openai_async_engine import DeadLetterWriter
+
+# === Immutable Variables ===
+ENDPOINT = "/v1/chat/completions"
+COMPLETION_WINDOW = "24h" # the only window OpenAI offers right now
+MAX_REQUESTS_PER_BATCH = 50000 # OpenAI's limit per batch, bigger CSVs are split over several batches
+MAX_BYTES_PER_BATCH = 190 * 1024 * 1024 # OpenAI takes batch files up to 200 MB, keep a little room
+FINISHED = {"completed", "failed", "expired", "cancelled"}
+RESUBMIT_ROUNDS = 2 # times per run the rows a batch didn't answer (expired, cancelled, failed) are sent again in a new batch
+
+# === Helper Functions ===
+def make_client(api_key: str, organization: str = None, base_url: str = None) -> OpenAI:
+    return OpenAI(api_key=api_key, organization=organization or None, base_url=base_url or None)
+
+def load_state(path: str) -> dict:
+    if not os.path.exists(path):
+        return {"batches": []}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_state(path: str, state: dict):
+    """Write the state file in one go, so a crash can't leave half a file that forgets submitted batches."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, path)
+
+def write_batch_files(rows: list, build_messages, request_body, key: str, prefix: str) -> list:
+    """
+    One JSONL line per row, custom_id = the row's key (filename), split into files that stay under
+    MAX_REQUESTS_PER_BATCH and MAX_BYTES_PER_BATCH. Returns [(path, [keys in the file])].
+    """
+    files, lines, keys, size = [], [], [], 0
+
+    def flush():
+        path = f"{prefix}_{time.strftime('%Y%m%d-%H%M%S')}_{len(files) + 1}.jsonl"
+        with open(path, "w", encoding="utf-8") as f:
+            f.writelines(lines)
+        files.append((path, list(keys)))
+        lines.clear()
+        keys.clear()
+
+    for row in rows:
+        line = json.dumps({
+            "custom_id": row[key].strip(),
+            "method": "POST",
+            "url": ENDPOINT,
+            "body": request_body(build_messages(row)),
+        }, ensure_ascii=False) + "\n"
+        line_bytes = len(line.encode("utf-8"))
+        if lines and (len(lines) >= MAX_REQUESTS_PER_BATCH or size + line_bytes > MAX_BYTES_PER_BATCH):
+            flush()
+            size = 0
+        lines.append(line)
+        keys.append(row[key].strip())
+        size += line_bytes
+    if lines:
+        flush()
+    return files
+
+def submit(client: OpenAI, path: str) -> str:
+    with open(path, "rb") as f:
+        uploaded = client.files.create(file=f, purpose="batch")
+    batch = client.batches.create(input_file_id=uploaded.id, endpoint=ENDPOINT, completion_window=COMPLETION_WINDOW)
+    return batch.id
+
+def wait_for(client: OpenAI, batch_id: str, poll_seconds: float, deadline: float = None):
+    """Poll a batch until OpenAI is done with it, printing progress when it changes. None when deadline (time.monotonic()) comes first."""
+    last = None
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        progress = (batch.status, counts.completed if counts else 0, counts.failed if counts else 0)
+        if progress != last:
+            total = counts.total if counts else "?"
+            print(f"⏳ Batch {batch_id}: {batch.status}, {progress[1]}/{total} done, {progress[2]} failed")
+            last = progress
+        if batch.status in FINISHED:
+            return batch
+        if deadline is not None:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                return None
+            time.sleep(min(poll_seconds, left))
+            continue
+        time.sleep(poll_seconds)
+
+def read_results(client: OpenAI, batch) -> list:
+    """(custom_id, chat completion body or None, error message or None) for every row OpenAI finished."""
+    results = []
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        for line in client.files.content(file_id).text.splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            response = item.get("response") or {}
+            body = response.get("body") or {}
+            if response.get("status_code") == 200 and not item.get("error"):
+                results.append((item["custom_id"], body, None))
+            else:
+                error = item.get("error") or body.get("error") or {}
+                message = error.get("message") if isinstance(error, dict) else str(error)
+                results.append((item["custom_id"], None, f"HTTP {response.get('status_code')}: {message}"))
+    return results
+
+# === Batch Runner ===
+def run(rows, build_messages, request_body, parse, write, *, make_client, state_file, dead_letter_csv,
+        key="filename", poll_seconds=60, max_wait=0, cache=None, near_duplicates=None, telemetry=None):
+    """
+    Send rows through the Batch API and write the parsed results, resuming any batch in state_file first.
+    - build_messages(row) -> chat messages for the row
+    - request_body(messages) -> the chat.completions parameters (model, messages, temperature...)
+    - parse(row, response) -> whatever write() needs, response is a ChatCompletion like in live mode
+    - write(row, output) is called once per row, rows of one batch in input order
+    - rows is everything not yet in the output CSV; rows OpenAI answered with an error go to dead_letter_csv
+    - max_wait (seconds, 0 for no limit): stop waiting after that long, unfinished batches stay in state_file for the next run
+    - cache (an openai_response_cache.ResponseCache) answers rows asked before, and keeps the new answers
+    - near_duplicates (a near_duplicates.NearDuplicates) sends one row per group of near-identical rows
+    - telemetry (an openai_telemetry.Telemetry) logs every row OpenAI answered, rows over its budget aren't submitted
+    Returns stats: rows, tokens, dead_letter, pending (rows still without an answer), seconds.
+    """
+    start = time.perf_counter()
+    client = make_client()
+    dead_letter = DeadLetterWriter(dead_letter_csv)
+    state = load_state(state_file)
+    prefix = os.path.splitext(state_file)[0]
+    indexed = list(enumerate(rows))
+    if near_duplicates:
+        indexed = near_duplicates.collapse(indexed)
+    pending = {}
+    for index, row in indexed:
+        pending.setdefault(row[key].strip(), (index, row))  # a filename listed twice is only sent once
+    # Every row not written yet: a batch from an earlier run may have answered rows that are near-duplicate members now
+    unfinished = {}
+    for index, row in enumerate(rows):
+        unfinished.setdefault(row[key].strip(), (index, row))
+    delivered = set()
+    stats = {"rows": 0, "tokens": 0, "cached": 0, "near_duplicates": 0}
+    budgeted = {}  # what the budget holds for each submitted row, until its answer is merged
+    deadline = time.monotonic() + max_wait if max_wait else None
+
+    def deliver(index, row, output):
+        if row[key].strip() in delivered:  # a member that had its own answer from an earlier batch
+            return
+        delivered.add(row[key].strip())
+        write(row, output)
+        stats["rows"] += 1
+        if not near_duplicates:
+            return
+        filled, resend = near_duplicates.expand(index, output)
+        for member_index, member_row, member_output in filled:
+            stats["near_duplicates"] += 1
+            deliver(member_index, member_row, member_output)
+        # Members the answer can't be swapped into are submitted themselves, in the next batch
+        for member_index, member_row in resend:
+            if member_row[key].strip() not in delivered:
+                pending.setdefault(member_row[key].strip(), (member_index, member_row))
+
+    def fail(index, row, kind, error):
+        if row[key].strip() in delivered:
+            return
+        dead_letter.write(row, kind, error, 1)
+        for member_index, member_row in near_duplicates.members_of(index) if near_duplicates else ():
+            fail(member_index, member_row, kind, f"near-duplicate of {row[key].strip()}: {error}")
+
+    def merge(batch):
+        # Answers for rows that aren't sent themselves any more (near-duplicate members now) are kept too, they're paid for
+        results = sorted(
+            (
+                result for result in read_results(client, batch)
+                if result[0] in pending or (result[0] in unfinished and result[0] not in delivered and result[2] is None)
+            ),
+            key=lambda result: unfinished[result[0]][0],
+        )
+        for custom_id, body, error in results:
+            if custom_id in delivered:  # answered twice, keep the first
+                continue
+            index, row = pending.pop(custom_id, None) or unfinished[custom_id]
+            if error:
+                if telemetry:
+                    telemetry.record([custom_id], "gave_up", error_kind="batch", estimate=budgeted.pop(custom_id, None))
+                fail(index, row, "batch", error)
+                continue
+            response = ChatCompletion.model_validate(body)
+            try:
+                output = parse(row, response)
+            except Exception as e:
+                if telemetry:
+                    telemetry.record([custom_id], "unparseable", response.usage, estimate=budgeted.pop(custom_id, None))
+                fail(index, row, "fatal", e)
+                continue
+            if telemetry:
+                telemetry.record([custom_id], "ok", response.usage, estimate=budgeted.pop(custom_id, None))
+            if cache:
+                cache.store_response(build_messages(row), response)
+            deliver(index, row, output)
+            stats["tokens"] += response.usage.total_tokens if response.usage else 0
+
+    def finish(entry):
+        """Merge a batch once OpenAI is done with it, or leave it in state_file when max_wait runs out first."""
+        batch = wait_for(client, entry["id"], poll_seconds, deadline)
+        if batch is None:
+            print(f"⏰ Stopped waiting for batch {entry['id']} after {max_wait / 3600:g} hours, it is kept in {state_file}, run again later to pick it up")
+            return
+        merge(batch)
+        if batch.status != "completed":
+            unanswered = [custom_id for custom_id in entry["keys"] if custom_id in pending]
+            for custom_id in unanswered:
+                if telemetry and custom_id in budgeted:  # give its share of the budget back, it may be sent again
+                    telemetry.record([custom_id], batch.status, error_kind="batch", estimate=budgeted.pop(custom_id))
+            print(f"⚠️ Batch {batch.id} ended as {batch.status}, {len(unanswered)} rows it didn't answer are still pending")
+        state["batches"].remove(entry)
+        save_state(state_file, state)
+        if os.path.exists(entry["input_file"]):
+            os.remove(entry["input_file"])
+
+    # Batches from an earlier run first, so their rows aren't submitted twice
+    for entry in list(state["batches"]):
+        print(f"🔁 Picking up batch {entry['id']} ({len(entry['keys'])} rows) from {state_file}")
+        finish(entry)
+
+    if pending and cache:
+        for custom_id, (index, row) in sorted(pending.items(), key=lambda item: item[1][0]):
+            response = cache.lookup(build_messages(row))
+            if response is None:
+                continue
+            try:
+                output = parse(row, response)
+            except Exception:
+                continue
+            del pending[custom_id]
+            stats["cached"] += 1
+            deliver(index, row, output)
+
+    # Rows of batches that ended without answering them (and near-duplicates to ask themselves) go in new batches
+    for resubmit in range(1 + RESUBMIT_ROUNDS):
+        # Rows of batches still running (max_wait ran out) are not sent twice
+        waiting = {custom_id for entry in state["batches"] for custom_id in entry["keys"]}
+        rows_left = [row for custom_id, (_, row) in sorted(pending.items(), key=lambda item: item[1][0]) if custom_id not in waiting]
+        if not rows_left or (telemetry and telemetry.exhausted):
+            break
+        if resubmit:
+            print(f"🔁 Sending {len(rows_left)} rows without an answer again (round {resubmit} of {RESUBMIT_ROUNDS})")
+        if telemetry:
+            fitting = []
+            for row in rows_left:
+                estimate = telemetry.estimate(build_messages(row))
+                if not telemetry.reserve(estimate):
+                    break
+                budgeted[row[key].strip()] = estimate
+                fitting.append(row)
+            rows_left = fitting
+        for path, keys in write_batch_files(rows_left, build_messages, request_body, key, prefix):
+            batch_id = submit(client, path)
+            state["batches"].append({"id": batch_id, "input_file": path, "keys": keys, "submitted_at": time.strftime("%Y-%m-%d %H:%M:%S")})
+            save_state(state_file, state)
+            print(f"📤 Submitted {len(keys)} rows as batch {batch_id} (saved in {state_file}, Ctrl+C and run again later to pick it up)")
+        for entry in list(state["batches"]):
+            finish(entry)
+
+    if not state["batches"] and os.path.exists(state_file):
+        os.remove(state_file)
+    stats["dead_letter"] = dead_letter.count
+    stats["pending"] = len(pending)
+    stats["seconds"] = time.perf_counter() - start
+    print(f"📊 {stats['rows']} rows merged from the Batch API in {stats['seconds']:.0f}s, ~{stats['tokens']} tokens at the batch price")
+    if cache:
+        cache.report()
+    if stats["dead_letter"]:
+        print(f"🪦 {stats['dead_letter']} rows failed, see {dead_letter_csv}, fix them and feed that file back in as INPUT_CSV")
+    return stats
@@ -0,0 +1,89 @@
+# === Prompt packing for the OpenAI cleanup scripts (02, 08) ===
+# A title is a few tokens, but every request also carries the whole system prompt, so one title per
+# request mostly pays for the same instructions over and over. Packing sends several rows in one
+# request as a numbered JSON list and asks for a JSON list back. The instructions are then paid once
+# per pack instead of once per row.
+#
+# Packs are filled in input order until PACK_SIZE rows or the PACK_TOKEN_BUDGET (prompt plus expected
+# answers) would be exceeded, so a pack always fits the model's context window. Every answer is
+# checked: rows that are missing from it or came back malformed are split off into smaller packs and
+# tried again by openai_async_engine.py, down to a single row sent with the script's normal prompt.
+import json
+from openai_async_engine import CHARS_PER_TOKEN
+
+PACK_FORMAT = (
+    "You will get a JSON object with a list of items, each with a numeric id."
+    " Handle every item on its own, exactly as described above."
+    " Answer with only a JSON object, no other text, in this form:"
+    ' {{"items": [{{"id": <id of the item>, {fields}}}, ...]}}'
+    " with exactly one entry for every id you were given."
+)
+
+class Packing:
+    """
+    How a script packs rows into one request and reads the answer back.
+    - instructions: the system prompt, what to do with one item
+    - item(row) -> dict sent for the row (the id is added here)
+    - fields: the answer fields of one item, as they should be written in the JSON answer
+    - parse_item(row, answer) -> output for write(), raises KeyError/TypeError/ValueError on a malformed answer
+    """
+
+    def __init__(self, instructions: str, item, fields: str, parse_item, max_items: int, token_budget: int):
+        self.system_prompt = f"{instructions}\n\n{PACK_FORMAT.format(fields=fields)}"
+        self.item = item
+        self.parse_item = parse_item
+        self.max_items = max_items
+        self.token_budget = token_budget
+
+    def messages(self, rows: list) -> list:
+        items = [{"id": number, **self.item(row)} for number, row in enumerate(rows, 1)]
+        return [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "user", "content": json.dumps({"items": items}, ensure_ascii=False)},
+        ]
+
+    def pack(self, jobs: list, output_tokens_per_item: int) -> list:
+        """Group [(index, row)] into packs in input order, each under max_items and token_budget."""
+        base = len(self.system_prompt) // CHARS_PER_TOKEN + 20
+        packs, current, tokens = [], [], base
+        for index, row in jobs:
+            # id, quotes and commas around the item add a few tokens on top of its text
+            cost = len(json.dumps(self.item(row), ensure_ascii=False)) // CHARS_PER_TOKEN + 8 + output_tokens_per_item
+            if current and (len(current) >= self.max_items or tokens + cost > self.token_budget):
+                packs.append(current)
+                current, tokens = [], base
+            current.append((index, row))
+            tokens += cost
+        if current:
+            packs.append(current)
+        return packs
+
+    def answers(self, rows: list, response) -> list:
+        """The answer item of every row in the pack, None for the ones missing from the answer."""
+        content = (response.choices[0].message.content or "").strip()
+        try:
+            # Tolerate ```json fences or a sentence around the object
+            answer = json.loads(content[content.index("{"):content.rindex("}") + 1])
+            items = answer["items"] if isinstance(answer, dict) else answer
+            by_id = {int(item["id"]): item for item in items if isinstance(item, dict) and "id" in item}
+        except (ValueError, KeyError, TypeError):
+            return [None] * len(rows)
+        return [by_id.get(number) for number in range(1, len(rows) + 1)]
+
+    def outputs(self, rows: list, answers: list) -> list:
+        """parse_item() of every answer, None for missing or malformed ones."""
+        outputs = []
+        for row, answer in zip(rows, answers):
+            try:
+                outputs.append(None if answer is None else self.parse_item(row, answer))
+            except (KeyError, TypeError, ValueError, AttributeError):
+                outputs.append(None)
+        return outputs
+
+    def parse(self, rows: list, response) -> list:
+        """The output of every row in the pack, None for the ones missing from the answer or malformed."""
+        return self.outputs(rows, self.answers(rows, response))
+
+    def single_answer(self, answer: dict) -> str:
+        """The answer of one item as the model would have given it for a pack of just that row (how it is cached)."""
+        return json.dumps({"items": [{**answer, "id": 1}]}, ensure_ascii=False)
@@ -0,0 +1,168 @@
+# === Response cache for the OpenAI cleanup scripts (02, 05, 08) ===
+# Re-running a script after changing only the post-processing (clean_title, collapse_empty_lists...), or
+# two suppliers listing the same product text, used to mean paying OpenAI again for the same prompt.
+# Every answer is now kept in one SQLite file shared by all three scripts, keyed on a hash of the model,
+# the temperature and the messages with their whitespace normalized, so an identical request is answered
+# from disk without touching the API or the rate limits. Changing the system prompt, the model or the
+# temperature changes the key, so old answers are never served for a new prompt.
+#
+# Entries older than CACHE_TTL_DAYS are dropped, and when the file grows over CACHE_MAX_MB the least
+# recently used answers go first.
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+import unicodedata
+from openai.types.chat import ChatCompletion
+from openai_async_engine import estimate_tokens
+
+# === Immutable Variables ===
+# USD per million (prompt, completion) tokens, only used to report what the cache saved
+PRICES_PER_MILLION = {
+    "gpt-3.5-turbo": (0.50, 1.50),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+}
+
+_WHITESPACE = re.compile(r"\s+")
+
+# === Helper Functions ===
+def normalize(text: str) -> str:
+    """Same text, same key: unicode NFC and runs of whitespace collapsed to one space."""
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFC", text or "")).strip()
+
+def request_key(body: dict) -> str:
+    """sha256 of the model, temperature and normalized messages of a chat.completions request."""
+    keyed = {
+        "model": body.get("model"),
+        "temperature": body.get("temperature"),
+        "messages": [(message["role"], normalize(message["content"])) for message in body["messages"]],
+    }
+    return hashlib.sha256(json.dumps(keyed, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+def dollars(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    prompt_price, completion_price = PRICES_PER_MILLION.get(model, PRICES_PER_MILLION["gpt-3.5-turbo"])
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+def estimate_cost(rows: list, build_messages, model: str, max_output_tokens: int, batch: bool = False):
+    """(tokens, dollars) rows would cost if every one was sent on its own, for dry runs. The Batch API is half price."""
+    prompt_tokens = sum(estimate_tokens(build_messages(row), 0) for row in rows)
+    completion_tokens = max_output_tokens * len(rows)
+    cost = dollars(model, prompt_tokens, completion_tokens)
+    return prompt_tokens + completion_tokens, cost / 2 if batch else cost
+
+class ResponseCache:
+    """
+    Answers of earlier requests, looked up by the messages a script is about to send.
+    request_body(messages) is the script's function that turns messages into the request parameters.
+    """
+
+    def __init__(self, path: str, request_body, ttl_days: float = 30, max_mb: float = 200):
+        self.path = path
+        self.request_body = request_body
+        self.ttl_seconds = ttl_days * 86400 if ttl_days else None
+        self.max_bytes = max_mb * 1024 * 1024 if max_mb else None
+        self.stats = {"hits": 0, "misses": 0, "prompt_tokens": 0, "completion_tokens": 0, "dollars": 0.0}
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, model TEXT, content TEXT,"
+            " prompt_tokens INTEGER, completion_tokens INTEGER,"
+            " created REAL, last_used REAL, size INTEGER)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self.evict()
+
+    def lookup(self, messages: list, count_miss: bool = True):
+        """
+        A ChatCompletion rebuilt from the cached answer, None when the request was never answered (or too long
+        ago). count_miss=False for a lookup that is followed by another one for the same row.
+        """
+        body = self.request_body(messages)
+        key = request_key(body)
+        row = self.db.execute(
+            "SELECT model, content, prompt_tokens, completion_tokens, created FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        now = time.time()
+        if row is None or (self.ttl_seconds and now - row[4] > self.ttl_seconds):
+            if count_miss:
+                self.stats["misses"] += 1
+            return None
+        model, content, prompt_tokens, completion_tokens, _ = row
+        self.db.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+        self.db.commit()
+        self.stats["hits"] += 1
+        self.stats["prompt_tokens"] += prompt_tokens
+        self.stats["completion_tokens"] += completion_tokens
+        self.stats["dollars"] += dollars(model, prompt_tokens, completion_tokens)
+        return ChatCompletion.model_validate({
+            "id": f"cache-{key[:16]}",
+            "object": "chat.completion",
+            "created": int(now),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},  # nothing was spent this time
+        })
+
+    def store(self, messages: list, content: str, prompt_tokens: int, completion_tokens: int):
+        """Keep the answer content to messages, with the tokens it cost."""
+        body = self.request_body(messages)
+        now = time.time()
+        self.db.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (request_key(body), body.get("model"), content, prompt_tokens, completion_tokens, now, now, len(content.encode("utf-8"))),
+        )
+        self.db.commit()
+
+    def store_response(self, messages: list, response):
+        usage = getattr(response, "usage", None)
+        self.store(
+            messages,
+            response.choices[0].message.content or "",
+            getattr(usage, "prompt_tokens", 0) or 0,
+            getattr(usage, "completion_tokens", 0) or 0,
+        )
+
+    def evict(self):
+        """Drop expired answers, then the least recently used ones until the cache fits in max_mb."""
+        if self.ttl_seconds:
+            self.db.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl_seconds,))
+        if self.max_bytes:
+            total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total > self.max_bytes:
+                freed = 0
+                doomed = []
+                for key, size in self.db.execute("SELECT key, size FROM responses ORDER BY last_used"):
+                    doomed.append((key,))
+                    freed += size
+                    if total - freed <= self.max_bytes:
+                        break
+                self.db.executemany("DELETE FROM responses WHERE key = ?", doomed)
+        self.db.commit()
+
+    def report(self):
+        lookups = self.stats["hits"] + self.stats["misses"]
+        if not lookups:
+            return
+        tokens = self.stats["prompt_tokens"] + self.stats["completion_tokens"]
+        print(
+            f"💾 Response cache: {self.stats['hits']}/{lookups} hits ({self.stats['hits'] / lookups:.0%}),"
+            f" ~{tokens} tokens (~${self.stats['dollars']:.4f}) not paid again"
+        )
+
+    def close(self):
+        self.evict()
+        self.db.close()
+
+def open_cache(path: str, request_body, ttl_days: float, max_mb: float):
+    """The cache at path, None when path is empty (cache off)."""
+    if not path:
+        return None
+    folder = os.path.dirname(os.path.abspath(path))
+    os.makedirs(folder, exist_ok=True)
+    return ResponseCache(path, request_body, ttl_days, max_mb)
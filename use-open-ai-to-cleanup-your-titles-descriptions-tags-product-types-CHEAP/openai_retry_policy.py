@@ -0,0 +1,101 @@
+# === Retry policy for the OpenAI cleanup scripts (used by openai_async_engine.py) ===
+# Replaces the old "any exception → sleep WAIT_TIMER (600s) → try again forever" loops:
+# - errors are sorted into rate_limit, server, timeout and fatal
+# - rate limits wait exactly as long as OpenAI says (retry-after-ms, Retry-After, x-ratelimit-reset-*),
+#   everything else backs off exponentially with full jitter so workers don't retry in lockstep
+# - fatal errors (bad request, auth, unknown model, quota used up...) and rows that run out of
+#   attempts are not retried, the engine writes them to a dead-letter CSV and the run keeps going
+import random
+import re
+import time
+from email.utils import parsedate_to_datetime
+import openai
+
+# === Immutable Variables ===
+MAX_ATTEMPTS = {"rate_limit": 8, "server": 5, "timeout": 5, "fatal": 1} # tries per row before it goes to the dead-letter CSV, per kind of error
+BASE_BACKOFF = 1.0 # seconds, first backoff for errors that don't say how long to wait, doubled on every attempt
+MAX_BACKOFF = 120.0 # seconds, no single wait is longer than this, even when a header asks for more
+HEADER_JITTER = 0.1 # fraction added at random on top of waits a header asked for, so workers don't all come back at the same moment
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+# === Helper Functions ===
+def classify(error: Exception) -> str:
+    """Kind of error: "rate_limit", "server", "timeout" or "fatal" (retrying won't help)."""
+    if isinstance(error, openai.RateLimitError):
+        # A 429 for an empty balance won't go away by waiting
+        return "fatal" if getattr(error, "code", None) == "insufficient_quota" else "rate_limit"
+    if isinstance(error, openai.APITimeoutError):
+        return "timeout"
+    if isinstance(error, openai.APIConnectionError):
+        return "timeout"
+    if isinstance(error, openai.InternalServerError):
+        return "server"
+    if isinstance(error, openai.APIStatusError):
+        # 408 request timeout and 409 conflict are worth another try, other 4xx are our fault
+        return "server" if error.status_code in (408, 409) or error.status_code >= 500 else "fatal"
+    return "fatal"
+
+def parse_duration(value: str):
+    """Seconds in a rate limit header: "1.5" (seconds), "20ms", "6m0s", "1h2m" or an HTTP date; None if unreadable."""
+    value = (value or "").strip()
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if parts and "".join(number + unit for number, unit in parts) == value:
+        return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def header_delay(error: Exception):
+    """How long the response headers of an error ask us to wait, None when they don't say."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers is None:
+        return None
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return max(0.0, float(retry_after_ms) / 1000)
+        except ValueError:
+            pass
+    delay = parse_duration(headers.get("retry-after"))
+    if delay is not None:
+        return delay
+    # x-ratelimit-reset-* say when each limit refills, wait for the one that actually ran out if the headers say which
+    resets, exhausted = [], []
+    for limit in ("requests", "tokens"):
+        reset = parse_duration(headers.get(f"x-ratelimit-reset-{limit}"))
+        if reset is None:
+            continue
+        resets.append(reset)
+        if (headers.get(f"x-ratelimit-remaining-{limit}") or "").strip() == "0":
+            exhausted.append(reset)
+    candidates = exhausted or resets
+    return max(candidates) if candidates else None
+
+class RetryPolicy:
+    """Decides whether a failed request is tried again, and after how long."""
+
+    def __init__(self, max_attempts: dict = None, base_backoff: float = BASE_BACKOFF, max_backoff: float = MAX_BACKOFF):
+        self.max_attempts = dict(MAX_ATTEMPTS, **(max_attempts or {}))
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+    def should_retry(self, kind: str, attempts: int) -> bool:
+        return attempts < self.max_attempts.get(kind, 1)
+
+    def delay(self, error: Exception, kind: str, attempts: int) -> float:
+        """Seconds to wait before try number attempts + 1."""
+        asked = header_delay(error)
+        if asked is not None:
+            return min(self.max_backoff, asked * (1 + random.uniform(0, HEADER_JITTER)))
+        ceiling = min(self.max_backoff, self.base_backoff * 2 ** (attempts - 1))
+        return random.uniform(ceiling / 2, ceiling) if kind == "rate_limit" else random.uniform(0, ceiling)
@@ -0,0 +1,203 @@
+# === Call telemetry and budget cap for the OpenAI cleanup scripts (02, 05, 08) ===
+# Every request the engine (or the Batch API runner) makes is appended to one JSON-lines file shared by the
+# three scripts: which stage and model, which products it was for, prompt and completion tokens from
+# response.usage, how long the call took, how many tries it needed and how it ended. One line per request,
+# so a pack of 20 titles is one line listing 20 filenames.
+#
+# The same object can cap a run: with TOKEN_BUDGET or DOLLAR_BUDGET set in a script, a request is only
+# sent while what this run already spent on that stage plus what the requests in flight may still cost
+# fits the budget. Rows over the budget aren't sent or written, the next run picks them up.
+#
+# Report on the log (p50/p95 latency, tokens per product, spend per stage, the most expensive products):
+#   python3 openai_telemetry.py report
+#   python3 openai_telemetry.py report --last --top 20
+import argparse
+import json
+import os
+import time
+from collections import defaultdict
+from openai_async_engine import estimate_tokens
+from openai_response_cache import dollars
+
+# === Immutable Variables ===
+RUN_ID = time.strftime("%Y%m%d-%H%M%S") + f"-{os.getpid()}" # lines of one run of a script (or of 10-single-pass-all-stages.py) share it
+DEFAULT_LOG = "openai_calls.jsonl"
+
+# What each stage spent in this process, so the budget holds across the chunks of catalog_pipeline.py
+_spent = defaultdict(lambda: {"tokens": 0, "dollars": 0.0})
+
+# === Telemetry ===
+class Telemetry:
+    """
+    Logs the requests of one stage to path and keeps it under token_budget / dollar_budget (0 or None is no cap).
+    batch=True prices the calls at the Batch API's half price.
+    """
+
+    def __init__(self, path: str, stage: str, model: str, max_output_tokens: int, batch: bool = False,
+                 token_budget: int = 0, dollar_budget: float = 0):
+        self.path = path
+        self.stage = stage
+        self.model = model
+        self.max_output_tokens = max_output_tokens
+        self.batch = batch
+        self.token_budget = token_budget or 0
+        self.dollar_budget = dollar_budget or 0
+        self.spent = _spent[stage]
+        self.reserved = {"tokens": 0, "dollars": 0.0}
+        self.exhausted = False
+        self.file = open(path, "a", encoding="utf-8") if path else None
+
+    def price(self, prompt_tokens: int, completion_tokens: int) -> float:
+        cost = dollars(self.model, prompt_tokens, completion_tokens)
+        return cost / 2 if self.batch else cost
+
+    def estimate(self, messages: list, rows: int = 1):
+        """(tokens, dollars) a request for messages may cost, with max_output_tokens of answer per row."""
+        prompt_tokens = estimate_tokens(messages, 0)
+        completion_tokens = self.max_output_tokens * rows
+        return prompt_tokens + completion_tokens, self.price(prompt_tokens, completion_tokens)
+
+    def reserve(self, estimate) -> bool:
+        """
+        Hold estimate (from estimate()) against the budget, False when it doesn't fit. Once one request
+        doesn't fit nothing more is sent, so a run stops at the budget instead of picking small rows after it.
+        """
+        tokens, cost = estimate
+        if self.exhausted:
+            return False
+        over_tokens = self.token_budget and self.spent["tokens"] + self.reserved["tokens"] + tokens > self.token_budget
+        over_dollars = self.dollar_budget and self.spent["dollars"] + self.reserved["dollars"] + cost > self.dollar_budget
+        if over_tokens or over_dollars:
+            self.exhausted = True
+            print(
+                f"💰 Budget reached for {self.stage}: ~{self.spent['tokens'] + self.reserved['tokens']} tokens"
+                f" (~${self.spent['dollars'] + self.reserved['dollars']:.4f}) spent or in flight this run,"
+                f" the next request would go over {self.budget_text()}, the remaining rows are left for the next run"
+            )
+            return False
+        self.reserved["tokens"] += tokens
+        self.reserved["dollars"] += cost
+        return True
+
+    def budget_text(self) -> str:
+        caps = []
+        if self.token_budget:
+            caps.append(f"{self.token_budget} tokens")
+        if self.dollar_budget:
+            caps.append(f"${self.dollar_budget:g}")
+        return " / ".join(caps)
+
+    def record(self, keys: list, outcome: str, usage=None, seconds: float = None, wall_seconds: float = None,
+               attempts: int = 1, error_kind: str = None, estimate=None):
+        """
+        One request done: keys are the filenames it was for, outcome "ok", "partial" (a pack with rows
+        missing), "gave_up", "split" or "unparseable". usage is response.usage (None when it failed), seconds
+        the time of the try that answered, wall_seconds from the first try on (limits, retries, backoff).
+        estimate is what reserve() held for it, given back now that the real cost is known.
+        """
+        if estimate:
+            self.reserved["tokens"] -= estimate[0]
+            self.reserved["dollars"] -= estimate[1]
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        cost = self.price(prompt_tokens, completion_tokens)
+        self.spent["tokens"] += prompt_tokens + completion_tokens
+        self.spent["dollars"] += cost
+        if not self.file:
+            return
+        self.file.write(json.dumps({
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "run": RUN_ID,
+            "stage": self.stage,
+            "model": self.model,
+            "mode": "batch" if self.batch else "live",
+            "keys": keys,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "dollars": round(cost, 8),
+            "seconds": None if seconds is None else round(seconds, 3),
+            "wall_seconds": None if wall_seconds is None else round(wall_seconds, 3),
+            "attempts": attempts,
+            "outcome": outcome,
+            "error_kind": error_kind,
+        }, ensure_ascii=False) + "\n")
+        self.file.flush()
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+def open_telemetry(path: str, stage: str, model: str, max_output_tokens: int, batch: bool = False,
+                   token_budget: int = 0, dollar_budget: float = 0):
+    """Telemetry for a stage, None when there is nothing to log or cap."""
+    if not path and not token_budget and not dollar_budget:
+        return None
+    return Telemetry(path, stage, model, max_output_tokens, batch, token_budget, dollar_budget)
+
+# === Report ===
+def percentile(values: list, share: float):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(share * len(values)))]
+
+def seconds_text(value) -> str:
+    return "-" if value is None else f"{value:.2f}s"
+
+def report(path: str, run: str = None, last: bool = False, top: int = 10):
+    """Print per-stage latency, tokens and spend from the log at path, for one run or all of them."""
+    if not os.path.exists(path):
+        print(f"❌ {path} not found, run 02, 05 or 08 with TELEMETRY_LOG set first")
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        calls = [json.loads(line) for line in f if line.strip()]
+    if last and calls:
+        run = calls[-1]["run"]
+    if run:
+        calls = [call for call in calls if call["run"] == run]
+    if not calls:
+        print("Nothing logged yet")
+        return
+
+    print(f"📈 {len(calls)} requests" + (f" of run {run}" if run else f" of {len({call['run'] for call in calls})} run(s)") + f" in {path}")
+    stages = defaultdict(list)
+    for call in calls:
+        stages[call["stage"]].append(call)
+    per_product = defaultdict(lambda: {"tokens": 0, "dollars": 0.0, "stages": set()})
+    for stage, stage_calls in stages.items():
+        answered = [call for call in stage_calls if call["outcome"] in ("ok", "partial")]
+        latencies = [call["seconds"] for call in answered if call["seconds"] is not None]
+        walls = [call["wall_seconds"] for call in answered if call["wall_seconds"] is not None]
+        tokens = sum(call["prompt_tokens"] + call["completion_tokens"] for call in stage_calls)
+        spend = sum(call["dollars"] for call in stage_calls)
+        products = {key for call in answered for key in call["keys"]}
+        retries = sum(call["attempts"] - 1 for call in stage_calls)
+        failed = len(stage_calls) - len(answered)
+        print(f"   {stage}: {len(stage_calls)} requests for {len(products)} products, {retries} retries, {failed} failed")
+        print(f"      latency p50 {seconds_text(percentile(latencies, 0.5))}, p95 {seconds_text(percentile(latencies, 0.95))}"
+              f" (with waits and retries p50 {seconds_text(percentile(walls, 0.5))}, p95 {seconds_text(percentile(walls, 0.95))})")
+        print(f"      ~{tokens} tokens ({tokens / max(len(products), 1):.0f} per product), ~${spend:.4f}")
+        for call in stage_calls:
+            # A packed request's tokens are split evenly over its rows
+            share = len(call["keys"]) or 1
+            for key in call["keys"]:
+                product = per_product[key]
+                product["tokens"] += (call["prompt_tokens"] + call["completion_tokens"]) / share
+                product["dollars"] += call["dollars"] / share
+                product["stages"].add(stage)
+    print(f"💵 ~${sum(call['dollars'] for call in calls):.4f} in total")
+    if top and per_product:
+        print(f"🏷️ {min(top, len(per_product))} most expensive products:")
+        for key, product in sorted(per_product.items(), key=lambda item: item[1]["dollars"], reverse=True)[:top]:
+            print(f"   {key:<40} ~{product['tokens']:.0f} tokens  ~${product['dollars']:.5f}  ({', '.join(sorted(product['stages']))})")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report on the OpenAI calls of 02, 05 and 08")
+    parser.add_argument("command", choices=["report"])
+    parser.add_argument("--log", default=DEFAULT_LOG, help="the TELEMETRY_LOG of the scripts")
+    parser.add_argument("--run", default=None, help="only this run id")
+    parser.add_argument("--last", action="store_true", help="only the last run")
+    parser.add_argument("--top", type=int, default=10, help="how many of the most expensive products to list, 0 for none")
+    args = parser.parse_args()
+    report(args.log, args.run, args.last, args.top)
@@ -0,0 +1,81 @@
+# === Shared clean-up helpers for titles (02) ===
+# The word lists to edit by hand (GENDERED_TERMS, COLLAPSE_KEYWORDS, BANNED_TERMS in 02) are plain lists that
+# keyword_pattern() turns into one alternation, 02 and 05 compile their clean-up patterns once at import
+# instead of going through the re cache on every call.
+#
+# Run it directly to time clean_title against the old inline re.sub version:
+#   python3 text_rules.py --bench 100000
+import argparse
+import importlib.util
+import os
+import random
+import re
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# === Helper Functions ===
+def keyword_pattern(words: list) -> str:
+    """One regex alternation matching any of words (lowercase, so compile it with re.I), longest first so "bedspread coverlet" wins over "bedspread"."""
+    return "|".join(re.escape(word.lower()) for word in sorted(words, key=len, reverse=True))
+
+# === Benchmark ===
+def clean_title_like_before(title: str) -> str:
+    """clean_title as it was in 02 before the rules were precompiled, to compare against."""
+    title = re.sub(r'\b(teen boy|teen girl|boys|girls|boy|girl)\b', '', title, flags=re.I)
+    title = re.sub(r'\s{2,}', ' ', title).strip()
+    title = re.sub(
+        r'\b(Bedspread Coverlet Bedding|Quilt Bedding Set|Bedspread Coverlet|Bedspread|Coverlet|Bedding)\b',
+        lambda m: m.group(0).split()[0],
+        title,
+        flags=re.I
+    )
+    title = title.replace('""', '"')
+    title = re.sub(r'(\d+/\d+)([a-zA-Z]+)', r'\1 \2', title)
+
+    def normalize_range(match):
+        parts = re.split(r'[/\*]', match.group(0))
+        cleaned_parts = [p.replace(' ', '').replace('X', 'x') for p in parts]
+        return ', '.join(cleaned_parts)
+
+    title = re.sub(r'(\d+\s*[xX]\s*\d+(?:[/\*]\s*\d+\s*[xX]\s*\d+)+)', normalize_range, title)
+    title = re.sub(r"[-–/:;,.\s]+$", "", title)
+    title = " ".join(word.capitalize() if not word.isupper() else word for word in title.split())
+    title = re.sub(r"\s{2,}", " ", title)
+    title = re.sub(r"\s+([,.:;!?])", r"\1", title)
+    title = title.replace('"', r'\"')
+    return title.strip()
+
+def synthetic_titles(count: int, seed: int = 7) -> list:
+    rng = random.Random(seed)
+    words = ["Luxury", "Soft", "Quilt", "Bedding", "Set", "Bedspread", "Coverlet", "Comforter", "Grey", "KING",
+             "Queen", "Microfiber", "for", "Boys", "Girls", "teen girl", "3/4in", "Hotel", "Style", "Duvet"]
+    sizes = ["90x90", "14x14/15*15/12*12", "20 X 20", "68x90/88x90", ""]
+    return [
+        " ".join(rng.choice(words) for _ in range(rng.randint(5, 14))) + " " + rng.choice(sizes) + rng.choice(["", ".", " -", ","])
+        for _ in range(count)
+    ]
+
+def benchmark(count: int):
+    spec = importlib.util.spec_from_file_location("names", os.path.join(HERE, "02-clean_name_output_to_new_csv-V4.py"))
+    names = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(names)
+    titles = synthetic_titles(count)
+
+    start = time.perf_counter()
+    before = [clean_title_like_before(title) for title in titles]
+    seconds_before = time.perf_counter() - start
+    start = time.perf_counter()
+    after = [names.clean_title(title) for title in titles]
+    seconds_after = time.perf_counter() - start
+    mismatches = sum(a != b for a, b in zip(before, after))
+
+    print(f"{count} synthetic titles, {mismatches} different results")
+    print(f"   before (inline re.sub)  {seconds_before:6.2f}s  {count / seconds_before:9.0f} titles/s")
+    print(f"   clean_title (compiled)  {seconds_after:6.2f}s  {count / seconds_after:9.0f} titles/s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time clean_title on synthetic titles")
+    parser.add_argument("--bench", type=int, default=100000, help="number of synthetic titles")
+    args = parser.parse_args()
+    benchmark(args.bench)